@@ -10,15 +10,37 @@ FFC compiles finite element variational forms into C code.
 
 """
 
+import importlib
 import logging
 
-import pkg_resources
-
 # Import default parameters
 from ffcx.parameters import get_parameters  # noqa: F401
 
-__version__ = pkg_resources.get_distribution("fenics-ffcx").version
-
 logging.basicConfig()
 logger = logging.getLogger("ffcx")
 logging.captureWarnings(capture=True)
+
+# Submodules which import UFL, FIAT or numpy, and are therefore only
+# imported on first access (PEP 562)
+_lazy_submodules = ("analysis", "codegeneration", "compiler", "fiatinterface", "formatting", "ir", "naming")
+
+
+def _get_version():
+    try:
+        import importlib.metadata as metadata
+    except ImportError:
+        try:
+            import importlib_metadata as metadata
+        except ImportError:
+            import pkg_resources
+            return pkg_resources.get_distribution("fenics-ffcx").version
+    return metadata.version("fenics-ffcx")
+
+
+def __getattr__(name):
+    if name == "__version__":
+        version = globals()["__version__"] = _get_version()
+        return version
+    if name in _lazy_submodules:
+        return importlib.import_module("ffcx." + name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
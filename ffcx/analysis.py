@@ -19,6 +19,7 @@ from collections import namedtuple
 import numpy
 
 import ufl
+from ffcx import tracing
 
 logger = logging.getLogger("ffcx")
 
@@ -53,45 +54,57 @@ def analyze_ufl_objects(ufl_objects: typing.Union[typing.List[ufl.form.Form], ty
     logger.info("Compiler stage 1: Analyzing UFL objects")
     logger.info(79 * "*")
 
-    form_data = ()
+    forms = []
+    elements = []
+    meshes = []
+    expressions = []
+    for ufl_object in ufl_objects:
+        if isinstance(ufl_object, ufl.form.Form):
+            forms.append(ufl_object)
+        elif isinstance(ufl_object, ufl.FiniteElementBase):
+            elements.append(ufl_object)
+        elif isinstance(ufl_object, ufl.Mesh):
+            meshes.append(ufl_object)
+        elif isinstance(ufl_object, tuple) and isinstance(ufl_object[0], ufl.core.expr.Expr):
+            expressions.append(ufl_object)
+        else:
+            raise TypeError("UFL objects not recognised.")
+
+    # Objects of different kinds may be compiled together, in which case
+    # elements and coordinate elements shared between them are only
+    # included once
+    form_data = []
+    for i, form in enumerate(forms):
+        with tracing.span("analysis", "form_{}".format(i)):
+            form_data.append(_analyze_form(form, parameters))
+    form_data = tuple(form_data)
     unique_elements = set()
     unique_coordinate_elements = set()
-    expressions = []
+    for data in form_data:
+        # Extract unique elements across forms
+        unique_elements.update(data.unique_sub_elements)
 
-    # FIXME: This assumes that forms come before elements in
-    # ufl_objects? Is this reasonable?
-    if isinstance(ufl_objects[0], ufl.form.Form):
-        forms = ufl_objects
-        form_data = tuple(_analyze_form(form, parameters) for form in forms)
+        # Extract unique coordinate elements across forms
+        unique_coordinate_elements.update(data.coordinate_elements)
 
-        # Extract unique elements across forms
-        for data in form_data:
-            unique_elements.update(data.unique_sub_elements)
-
-        # Extract uniquecoordinate elements across forms
-        for data in form_data:
-            unique_coordinate_elements.update(data.coordinate_elements)
-    elif isinstance(ufl_objects[0], ufl.FiniteElementBase):
-        # Extract unique (sub)elements
-        elements = ufl_objects
-        unique_elements.update(ufl.algorithms.analysis.extract_sub_elements(elements))
-    elif isinstance(ufl_objects[0], ufl.Mesh):
-        # Extract unique (sub)elements
-        meshes = ufl_objects
-        unique_coordinate_elements = [mesh.ufl_coordinate_element() for mesh in meshes]
-    elif isinstance(ufl_objects[0], tuple) and isinstance(ufl_objects[0][0], ufl.core.expr.Expr):
-        for expression in ufl_objects:
-            original_expression = expression[0]
-            points = expression[1]
-            expression = expression[0]
-
-            unique_elements.update(ufl.algorithms.extract_elements(expression))
-            unique_elements.update(ufl.algorithms.extract_sub_elements(unique_elements))
+    # Extract unique (sub)elements
+    unique_elements.update(ufl.algorithms.analysis.extract_sub_elements(elements))
 
+    # Extract coordinate elements of meshes
+    unique_coordinate_elements.update(mesh.ufl_coordinate_element() for mesh in meshes)
+
+    analyzed_expressions = []
+    for i, expression in enumerate(expressions):
+        original_expression = expression[0]
+        points = expression[1]
+        expression = expression[0]
+
+        unique_elements.update(ufl.algorithms.extract_elements(expression))
+        unique_elements.update(ufl.algorithms.extract_sub_elements(unique_elements))
+
+        with tracing.span("analysis", "expression_{}".format(i)):
             expression = _analyze_expression(expression, parameters)
-            expressions.append((expression, points, original_expression))
-    else:
-        raise TypeError("UFL objects not recognised.")
+        analyzed_expressions.append((expression, points, original_expression))
 
     # Make sure coordinate elements and their subelements are included
     unique_elements.update(ufl.algorithms.analysis.extract_sub_elements(unique_coordinate_elements))
@@ -106,7 +119,7 @@ def analyze_ufl_objects(ufl_objects: typing.Union[typing.List[ufl.form.Form], ty
     return ufl_data(form_data=form_data, unique_elements=unique_elements,
                     element_numbers=element_numbers,
                     unique_coordinate_elements=unique_coordinate_elements,
-                    expressions=expressions)
+                    expressions=analyzed_expressions)
 
 
 def _analyze_expression(expression: ufl.core.expr.Expr, parameters: typing.Dict):
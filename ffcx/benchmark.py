@@ -0,0 +1,363 @@
+# Copyright (C) 2020 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Compile-time and kernel benchmarks of UFL files.
+
+Each UFL file is compiled with :func:`ffcx.compiler.compile_ufl_objects`
+for each of a set of parameter variants (see :data:`VARIANTS`),
+recording the time of each compiler stage (from a :mod:`ffcx.tracing`
+trace), the peak memory allocated by Python and the size of the
+generated code. Results are written as JSON by ``ffcx bench compile``,
+and can be compared with the results of another commit to catch
+compile-time regressions::
+
+    ffcx bench compile -o before.json demo
+    (change the compiler)
+    ffcx bench compile -o after.json --compare before.json demo
+
+The tabulate_tensor kernels of compiled forms are timed by
+:func:`time_kernels` (``ffcx bench kernels``), which calls each kernel
+for a batch of synthetic cells in a loop in C.
+"""
+
+import contextlib
+import datetime
+import importlib.util
+import platform
+import re
+import subprocess
+import tempfile
+from pathlib import Path
+
+from ffcx import tracing
+
+# Parameter variants, by name
+VARIANTS = {
+    "double": {},
+    "float": {"scalar_type": "float"},
+    "complex": {"scalar_type": "double complex"},
+    "aligned": {"padlen": 4, "assume_aligned": 32},
+}
+
+# Compiler stages, as traced by ffcx.compiler
+STAGES = ("analysis", "ir", "codegen", "formatting")
+
+# Measurements compared between results
+METRICS = ("time", "peak_memory", "code_size")
+
+
+def _load_ufl_file(filename):
+    import ufl
+
+    ufd = ufl.algorithms.load_ufl_file(str(filename))
+    ufl_objects = ufd.forms if len(ufd.forms) > 0 else ufd.elements
+    return ufl_objects, ufd.object_names
+
+
+def compile_file(filename, parameters=None, repeat=3):
+    """Benchmark the compilation of a UFL file.
+
+    The file is compiled repeat (at least one) times with timing only,
+    and once more with tracing of memory allocations, which slows down
+    compilation.
+
+    Returns
+    -------
+    Dict with the total time ``time`` and stage times ``stages`` (in
+    seconds, fastest of the timed compilations), the time of the first
+    compilation ``first_time``, the peak memory ``peak_memory`` and peak
+    memory of each stage ``stage_peak_memory`` (in bytes, None before
+    Python 3.9, see :mod:`ffcx.tracing`), and the size of the generated
+    header and source ``code_size`` (in bytes).
+
+    """
+    from ffcx import compiler
+
+    ufl_objects, object_names = _load_ufl_file(filename)
+    prefix = re.sub("[^A-Za-z0-9_]", "_", Path(filename).stem)
+
+    def run(memory):
+        with tracing.trace(memory=memory) as tracer:
+            with tracer.span("benchmark", prefix) as span:
+                code = compiler.compile_ufl_objects(ufl_objects, object_names, prefix=prefix,
+                                                    parameters=parameters)
+        stages = {s["name"]: s for s in tracer.spans if s["category"] == "stage"}
+        return span, stages, code
+
+    times = []
+    stage_times = {stage: [] for stage in STAGES}
+    for i in range(max(repeat, 1)):
+        span, stages, code = run(memory=False)
+        times.append(span["wall_time"])
+        for stage in STAGES:
+            stage_times[stage].append(stages[stage]["wall_time"])
+    span, stages, code = run(memory=True)
+
+    return {"time": min(times),
+            "first_time": times[0],
+            "stages": {stage: min(t) for stage, t in stage_times.items()},
+            "peak_memory": span["peak_memory"],
+            "stage_peak_memory": {stage: stages[stage]["peak_memory"] for stage in STAGES},
+            "code_size": sum(len(c.encode("utf-8")) for c in code),
+            "header_size": len(code[0].encode("utf-8"))}
+
+
+def _commit():
+    """Return the git commit of the FFCX source tree, or None."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=str(Path(__file__).parent), check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(filenames, variants=None, common_parameters=None, repeat=3, callback=None):
+    """Benchmark the compilation of UFL files for parameter variants.
+
+    Parameters
+    ----------
+    filenames
+        UFL files.
+    variants
+        Names of variants in VARIANTS (default all).
+    common_parameters
+        Parameters common to all variants, which override the variants.
+    repeat
+        Number of timed compilations of each file and variant.
+    callback
+        Function called with each benchmark record when done.
+
+    Returns
+    -------
+    Dict with a list of records ``benchmarks`` (``file``, ``variant``,
+    ``parameters``, and either the measurements of
+    :func:`compile_file` or ``error``), and the ``ffcx_version``,
+    ``commit``, ``date``, ``python`` and ``machine`` they were taken on.
+
+    """
+    from ffcx import __version__
+    from ffcx.parameters import get_parameters
+
+    if variants is None:
+        variants = list(VARIANTS)
+    benchmarks = []
+    for filename in filenames:
+        for variant in variants:
+            variant_parameters = dict(VARIANTS[variant], **(common_parameters or {}))
+            record = {"file": str(filename), "variant": variant, "parameters": variant_parameters}
+            try:
+                record.update(compile_file(filename, get_parameters(variant_parameters), repeat=repeat))
+            except Exception as e:
+                record["error"] = "{}: {}".format(type(e).__name__, e)
+            benchmarks.append(record)
+            if callback is not None:
+                callback(record)
+
+    return {"ffcx_version": __version__, "commit": _commit(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(), "machine": platform.machine(),
+            "benchmarks": benchmarks}
+
+
+def compare(baseline, results, threshold=1.1):
+    """Return the regressions of results with respect to baseline results.
+
+    A measurement (see METRICS) regresses if it exceeds the baseline by
+    more than a factor threshold. Measurements which are unavailable
+    (None) in either results are not compared. Benchmarks which fail in results but
+    not in the baseline are regressions too.
+
+    Returns
+    -------
+    List of tuples (file, variant, metric, baseline value, value), with
+    metric "error" for failures.
+
+    """
+    base = {(b["file"], b["variant"]): b for b in baseline["benchmarks"]}
+    regressions = []
+    for b in results["benchmarks"]:
+        old = base.get((b["file"], b["variant"]))
+        if old is None or "error" in old:
+            continue
+        if "error" in b:
+            regressions.append((b["file"], b["variant"], "error", None, b["error"]))
+            continue
+        for metric in METRICS:
+            if old[metric] and b[metric] is not None and b[metric] > threshold * old[metric]:
+                regressions.append((b["file"], b["variant"], metric, old[metric], b[metric]))
+    return regressions
+
+
+# Driver calling a tabulate_tensor kernel for a batch of cells in a C
+# loop, to time kernels without the overhead of calls from Python. The
+# kernel is passed by address, so the driver does not depend on the
+# scalar type.
+_DRIVER_DECL = """
+double ffcx_bench_tabulate_tensor(uintptr_t kernel, int64_t num_cells, int64_t num_repeats,
+                                  void* A, const void* w, int64_t w_stride, const void* c,
+                                  const double* coordinate_dofs, int64_t coordinate_dofs_stride,
+                                  const int* entity_local_index, const uint8_t* quadrature_permutation,
+                                  const uint32_t* cell_permutation);
+"""
+
+_DRIVER_SOURCE = """
+#ifndef _POSIX_C_SOURCE
+#define _POSIX_C_SOURCE 199309L
+#endif
+#include <stdint.h>
+#include <time.h>
+
+typedef void(ffcx_bench_kernel)(void* A, const void* w, const void* c, const double* coordinate_dofs,
+                                const int* entity_local_index, const uint8_t* quadrature_permutation,
+                                const uint32_t cell_permutation);
+
+double ffcx_bench_tabulate_tensor(uintptr_t kernel, int64_t num_cells, int64_t num_repeats,
+                                  void* A, const void* w, int64_t w_stride, const void* c,
+                                  const double* coordinate_dofs, int64_t coordinate_dofs_stride,
+                                  const int* entity_local_index, const uint8_t* quadrature_permutation,
+                                  const uint32_t* cell_permutation)
+{
+  ffcx_bench_kernel* tabulate_tensor = (ffcx_bench_kernel*)kernel;
+  struct timespec t0, t1;
+  clock_gettime(CLOCK_MONOTONIC, &t0);
+  for (int64_t r = 0; r < num_repeats; ++r)
+    for (int64_t cell = 0; cell < num_cells; ++cell)
+      tabulate_tensor(A, (const char*)w + cell * w_stride, c, coordinate_dofs + cell * coordinate_dofs_stride,
+                      entity_local_index + 2 * cell, quadrature_permutation + 2 * cell, cell_permutation[cell]);
+  clock_gettime(CLOCK_MONOTONIC, &t1);
+  return (double)(t1.tv_sec - t0.tv_sec) + 1e-9 * (double)(t1.tv_nsec - t0.tv_nsec);
+}
+"""
+
+
+def load_driver():
+    """Compile and load the driver calling kernels in a C loop (see :func:`time_kernels`).
+
+    The driver is compiled in a temporary directory, which is removed
+    once the driver is loaded.
+    """
+    import cffi
+
+    module_name = "ffcx_bench_driver"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ffibuilder = cffi.FFI()
+        ffibuilder.cdef(_DRIVER_DECL)
+        ffibuilder.set_source(module_name, _DRIVER_SOURCE, extra_compile_args=["-O2"])
+        filename = ffibuilder.compile(tmpdir=tmpdir)
+        spec = importlib.util.spec_from_file_location(module_name, filename)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module
+
+
+def count_flops(node):
+    """Estimate the number of floating-point operations executed by a C AST.
+
+    Arithmetic operators and function calls count as one operation, and
+    loop bodies are multiplied by the trip count of loops with literal
+    bounds. Integer arithmetic in array indices is not counted.
+    """
+    from ffcx.codegeneration.C import cnodes as L
+
+    if isinstance(node, (list, tuple)):
+        return sum(count_flops(n) for n in node)
+    if not isinstance(node, L.CNode) or isinstance(node, L.ArrayAccess):
+        return 0
+    if isinstance(node, L.ForRange):
+        trip_count = 1
+        if isinstance(node.begin, L.LiteralInt) and isinstance(node.end, L.LiteralInt):
+            trip_count = max(node.end.value - node.begin.value, 0)
+        return trip_count * count_flops(node.body)
+    if isinstance(node, L.Conditional):
+        return count_flops(node.condition) + max(count_flops(node.true), count_flops(node.false))
+
+    flops = sum(count_flops(getattr(node, name)) for cls in type(node).__mro__
+                for name in getattr(cls, "__slots__", ()) if hasattr(node, name))
+    if isinstance(node, (L.Add, L.Sub, L.Mul, L.Div, L.AssignAdd, L.AssignSub, L.AssignMul, L.AssignDiv, L.Call)):
+        flops += 1
+    elif isinstance(node, L.NaryOp):
+        flops += len(node.args) - 1
+    return flops
+
+
+def time_kernels(form, parameters=None, cache_dir=None, cffi_extra_compile_args=None, num_cells=1024,
+                 min_time=0.2, repeat=3, driver=None):
+    """Time the tabulate_tensor kernels of a form, called in a C loop over synthetic cells.
+
+    The form is compiled with the JIT, into a temporary directory if
+    cache_dir is None. Each cell, exterior facet and interior facet
+    integral kernel is called for num_cells cells with random inputs
+    (see :mod:`ffcx.codegeneration.kernel_inputs`), in loops over all
+    cells taking at least min_time seconds, and the fastest of repeat
+    such loops is taken. The driver (see :func:`load_driver`) is
+    compiled for each call unless given, so it should be passed when
+    timing several forms.
+
+    Returns
+    -------
+    List of dicts, one per integral, with ``integral_type``,
+    ``subdomain_id``, the estimated number of floating-point operations
+    ``flops`` (see :func:`count_flops`), ``ns_per_cell``,
+    ``cells_per_second`` and ``gflops`` (GFLOP/s).
+
+    """
+    with contextlib.ExitStack() as stack:
+        if cache_dir is None:
+            cache_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        if driver is None:
+            driver = load_driver()
+        return _time_kernels(form, parameters, cache_dir, cffi_extra_compile_args, num_cells, min_time, repeat,
+                             driver)
+
+
+def _time_kernels(form, parameters, cache_dir, cffi_extra_compile_args, num_cells, min_time, repeat, driver):
+    import numpy
+
+    from ffcx.codegeneration import jit, kernel_inputs
+    from ffcx.codegeneration.backend import FFCXBackend
+    from ffcx.codegeneration.integrals import IntegralGenerator
+    from ffcx.parameters import get_parameters
+
+    parameters = get_parameters(parameters)
+    compiled_forms, module = jit.compile_forms([form], parameters=parameters, cache_dir=cache_dir,
+                                               cffi_extra_compile_args=cffi_extra_compile_args)
+    compiled_form = compiled_forms[0]
+
+    # The IR of the compiled form, for the sizes of the kernel inputs
+    # and the operation counts
+    ir = kernel_inputs.compute_form_ir(form, parameters)
+
+    rng = numpy.random.RandomState(0)
+    results = []
+    for integral_ir, subdomain_id in kernel_inputs.integrals(ir):
+        integral = module.ffi.gc(kernel_inputs.create_integral(compiled_form, integral_ir, subdomain_id),
+                                 module.lib.free)
+        kernel = int(module.ffi.cast("uintptr_t", integral.tabulate_tensor))
+
+        inputs = kernel_inputs.kernel_inputs(ir, integral_ir, parameters["scalar_type"], num_cells, rng)
+        A, w, c, coordinate_dofs, entity_local_index, quadrature_permutation, cell_permutation = inputs
+        args = [driver.ffi.cast("void *", a.ctypes.data) for a in inputs]
+
+        def run(num_repeats):
+            return driver.lib.ffcx_bench_tabulate_tensor(
+                kernel, num_cells, num_repeats, args[0], args[1], w.strides[0], args[2], args[3],
+                coordinate_dofs.shape[1], args[4], args[5], args[6])
+
+        # Calibrate number of loops over all cells
+        num_repeats = 1
+        while True:
+            elapsed = run(num_repeats)
+            if elapsed >= min_time:
+                break
+            num_repeats *= 2
+        best = min([elapsed] + [run(num_repeats) for r in range(repeat - 1)])
+
+        backend = FFCXBackend(integral_ir, parameters)
+        flops = count_flops(IntegralGenerator(integral_ir, backend).generate())
+        time_per_cell = best / (num_repeats * num_cells)
+        results.append({"integral_type": integral_ir.integral_type, "subdomain_id": subdomain_id,
+                        "flops": flops, "ns_per_cell": 1e9 * time_per_cell, "cells_per_second": 1 / time_per_cell,
+                        "gflops": 1e-9 * flops / time_per_cell})
+    return results
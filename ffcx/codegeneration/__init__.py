@@ -1,3 +1,4 @@
+import functools
 import os
 import hashlib
 
@@ -16,21 +17,14 @@ def get_include_path():
     return _include_path
 
 
-def _compute_signature():
-    # Compute signature of ufc header files
+@functools.lru_cache(maxsize=None)
+def get_signature():
+    """Return SHA-1 hash of the contents of ufc.h and ufc_geometry.h.
+
+    In this implementation, the value is computed on first call.
+    """
     h = hashlib.sha1()
     for fn in ("ufc.h", "ufc_geometry.h"):
         with open(os.path.join(get_include_path(), fn)) as f:
             h.update(f.read().encode("utf-8"))
     return h.hexdigest()
-
-
-_signature = _compute_signature()
-
-
-def get_signature():
-    """Return SHA-1 hash of the contents of ufc.h and ufc_geometry.h.
-
-    In this implementation, the value is computed on import.
-    """
-    return _signature
@@ -0,0 +1,163 @@
+# Copyright (C) 2020 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Compile flag profiles for JIT modules, and selection of the fastest profile for a form.
+
+A profile is a named list of C compiler flags, selected with the
+parameter ``jit_compile_profile``. Its flags are passed to the compiler
+before ``cffi_extra_compile_args``, so that explicit arguments take
+precedence. With the profile ``autotune``, a form is compiled with each
+profile, its kernels are timed on synthetic inputs, and the fastest
+profile is recorded in the cache directory for the signature of the
+form and the host CPU.
+
+Code compiled for the host CPU (``-march=native``) must not be loaded
+on hosts with other CPUs, which may share the cache directory. Compile
+arguments with such flags therefore identify the host CPU (see
+:func:`host_signature`), which makes it part of the JIT module keys.
+"""
+
+import functools
+import hashlib
+import json
+import os
+import platform
+import threading
+import time
+from pathlib import Path
+
+from ffcx.codegeneration import kernel_inputs
+
+COMPILE_PROFILES = {
+    "fast-compile": ["-O0"],
+    "balanced": ["-O2"],
+    "max-performance": ["-O3", "-march=native", "-ffast-math"],
+}
+
+# Profile used for objects without kernels to time
+DEFAULT_AUTOTUNE_PROFILE = "balanced"
+
+# Subdirectory of the cache directory with the selected profiles
+AUTOTUNE_DIR = "autotune"
+
+# Selected profiles of forms tuned without a cache directory
+_selected = {}
+
+
+@functools.lru_cache(maxsize=None)
+def host_signature():
+    """Return a signature of the CPU of this host: architecture, model and instruction set extensions."""
+    identity = [platform.machine(), platform.processor()]
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                key = line.split(":")[0].strip()
+                if key in ("vendor_id", "model name", "flags", "Features", "CPU part"):
+                    identity.append(line.strip())
+                elif not line.strip() and len(identity) > 2:
+                    # Only the first processor
+                    break
+    except OSError:
+        pass
+    return hashlib.sha1("\n".join(identity).encode("utf-8")).hexdigest()[:16]
+
+
+def compile_args(profile, cffi_extra_compile_args):
+    """Return the C compiler arguments of a profile, followed by cffi_extra_compile_args.
+
+    If the arguments target the host CPU, a definition identifying the
+    host CPU is added.
+    """
+    if profile == "autotune":
+        profile = DEFAULT_AUTOTUNE_PROFILE
+    if not profile:
+        flags = []
+    else:
+        try:
+            flags = COMPILE_PROFILES[profile]
+        except KeyError:
+            raise ValueError("Unknown JIT compile profile '{}'. Available profiles: {}.".format(
+                profile, ", ".join(sorted(COMPILE_PROFILES) + ["autotune"])))
+    args = flags + list(cffi_extra_compile_args or [])
+    if any(arg.endswith("=native") for arg in args):
+        args.append("-DFFCX_HOST_CPU=" + host_signature())
+    elif not flags:
+        # Unchanged, so that JIT module keys do not change
+        return cffi_extra_compile_args
+    return args
+
+
+def lookup(cache_dir, key):
+    """Return the profile selected before for a key, or None."""
+    if cache_dir is None:
+        return _selected.get(key)
+    try:
+        with open(Path(cache_dir).joinpath(AUTOTUNE_DIR, key + ".json")) as f:
+            return json.load(f)["profile"]
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+
+
+def record(cache_dir, key, profile, timings):
+    """Record the profile selected for a key, with the kernel time of each profile."""
+    if cache_dir is None:
+        _selected[key] = profile
+        return
+    filename = Path(cache_dir).joinpath(AUTOTUNE_DIR, key + ".json")
+    filename.parent.mkdir(exist_ok=True, parents=True)
+    tmp_filename = filename.with_suffix(".json.{}.{}.tmp".format(os.getpid(), threading.get_ident()))
+    with open(tmp_filename, "w") as f:
+        json.dump({"profile": profile, "timings": timings}, f, indent=1, sort_keys=True)
+    os.replace(tmp_filename, filename)
+
+
+def time_form(form, module, ir, scalar_type, min_time=0.05, repeat=3):
+    """Time the kernels of a compiled form on synthetic inputs.
+
+    The inputs of each kernel are created for a single cell from the IR
+    of the form (see :mod:`ffcx.codegeneration.kernel_inputs`). Each
+    kernel is called in a loop for at least min_time seconds, and the
+    fastest of repeat such loops is taken.
+
+    Returns
+    -------
+    Sum over all integrals of the time (seconds) per kernel call.
+
+    """
+    import numpy
+
+    ffi = module.ffi
+    c_type = ffi.getctype(ffi.typeof("ufc_scalar_t"))
+    rng = numpy.random.RandomState(0)
+
+    total = 0.0
+    for integral_ir, subdomain_id in kernel_inputs.integrals(ir):
+        integral = ffi.gc(kernel_inputs.create_integral(form, integral_ir, subdomain_id), module.lib.free)
+        tabulate_tensor = integral.tabulate_tensor
+        A, w, c, coordinate_dofs, entity_local_index, quadrature_permutation, cell_permutation = \
+            kernel_inputs.kernel_inputs(ir, integral_ir, scalar_type, 1, rng)
+        args = (ffi.cast(c_type + " *", A.ctypes.data), ffi.cast(c_type + " *", w.ctypes.data),
+                ffi.cast(c_type + " *", c.ctypes.data), ffi.cast("double *", coordinate_dofs.ctypes.data),
+                ffi.cast("int *", entity_local_index.ctypes.data),
+                ffi.cast("uint8_t *", quadrature_permutation.ctypes.data), int(cell_permutation[0]))
+
+        # Calibrate number of calls per loop
+        num_calls = 1
+        while True:
+            t0 = time.perf_counter()
+            for i in range(num_calls):
+                tabulate_tensor(*args)
+            elapsed = time.perf_counter() - t0
+            if elapsed >= min_time:
+                break
+            num_calls *= 2
+        best = elapsed
+        for r in range(repeat - 1):
+            t0 = time.perf_counter()
+            for i in range(num_calls):
+                tabulate_tensor(*args)
+            best = min(best, time.perf_counter() - t0)
+        total += best / num_calls
+    return total
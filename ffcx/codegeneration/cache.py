@@ -0,0 +1,283 @@
+# Copyright (C) 2020 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Management of the JIT cache directory.
+
+Every module compiled by :mod:`ffcx.codegeneration.jit` leaves a set of
+artifacts (``.c``, ``.o``, ``.so`` and ``.c.cached`` files) in the
+cache directory, and sharded builds add object files of each shard to
+the ``objects`` subdirectory. The generated source code is kept in the
+``source`` subdirectory. Modules built in API mode include the UFC types
+from a small module (``_ffcx_ufc_*``) per scalar type, which is shared by
+all modules and not managed here. This module keeps a manifest of these modules, with
+their size and compile time, and uses it to evict the least recently
+used modules when the cache grows beyond a given
+size. The last access of a module is the modification time of its
+``.c.cached`` marker, which is updated on every cache hit without
+taking the manifest lock. Modules in a single-file store (see :mod:`ffcx.codegeneration.store`)
+are counted by :func:`stats` and removed by :func:`clear`.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+from ffcx.codegeneration import store
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger("ffcx")
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+# All JIT modules are named libffcx_<kind>_<signature>
+MODULE_PREFIX = "libffcx_"
+
+# Subdirectory with content addressed object files of sharded builds
+OBJECTS_DIR = "objects"
+# Subdirectory with generated source code, independent of C compiler flags
+SOURCE_DIR = "source"
+
+# Lock files of compiling modules without heartbeat for this long
+# (seconds) are considered stale
+STALE_LOCK_AGE = 10.0
+
+
+@contextlib.contextmanager
+def _manifest_lock(cache_dir):
+    """Hold an exclusive advisory lock on the manifest of a cache directory."""
+    with open(Path(cache_dir).joinpath(MANIFEST_NAME + ".lock"), "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _read_manifest(cache_dir):
+    try:
+        with open(Path(cache_dir).joinpath(MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest["entries"]
+
+
+def _write_manifest(cache_dir, entries):
+    filename = Path(cache_dir).joinpath(MANIFEST_NAME)
+    tmp_filename = filename.with_suffix(".json.{}".format(os.getpid()))
+    with open(tmp_filename, "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "entries": entries}, f, indent=1, sort_keys=True)
+    os.replace(tmp_filename, filename)
+
+
+def _artifacts(cache_dir, module_name):
+    """Return files belonging to a module.
+
+    Lock files are not included, since removing a lock file which may be
+    held by another process breaks the locking protocol.
+    """
+    return sorted(p for p in Path(cache_dir).glob(module_name + ".*") if p.suffix != ".lock")
+
+
+def _is_module(name):
+    """False if name is an object file or source code entry instead of a module."""
+    return "/" not in name
+
+
+def _scan(cache_dir, entries):
+    """Add modules found on disk but missing from manifest and drop entries without files.
+
+    The last access of modules is updated from the modification time of
+    their .c.cached marker (see :func:`touch`). Object files of sharded builds and generated source code are
+    included as entries named objects/<key> and source/<key>. Their last
+    access time is the modification time of the files, which is updated
+    whenever they are reused.
+    """
+    on_disk = {}
+    for path in Path(cache_dir).glob(MODULE_PREFIX + "*"):
+        if path.suffix == ".lock":
+            continue
+        on_disk.setdefault(path.name.split(".")[0], []).append(path)
+    for subdir in (OBJECTS_DIR, SOURCE_DIR):
+        for path in Path(cache_dir).joinpath(subdir).glob("*"):
+            on_disk.setdefault(subdir + "/" + path.name.split(".")[0], []).append(path)
+
+    for module_name in list(entries):
+        if module_name not in on_disk:
+            del entries[module_name]
+
+    for module_name, paths in on_disk.items():
+        if module_name not in entries or not _is_module(module_name):
+            entries[module_name] = _entry(paths, max(p.stat().st_mtime for p in paths), None)
+        else:
+            with contextlib.suppress(FileNotFoundError):
+                accessed = Path(cache_dir).joinpath(module_name + ".c.cached").stat().st_mtime
+                entries[module_name]["last_access"] = max(entries[module_name]["last_access"] or 0.0, accessed)
+
+    return entries
+
+
+def _entry(paths, last_access, compile_time):
+    return {"artifacts": sorted(p.name for p in paths),
+            "size": sum(p.stat().st_size for p in paths),
+            "last_access": last_access,
+            "compile_time": compile_time}
+
+
+def _is_complete(cache_dir, module_name):
+    """True if module is not currently being compiled.
+
+    A module without .c.cached marker is being compiled while the
+    heartbeat of its lock file (or else its C file) is recent. Otherwise
+    it was left behind by a crashed compilation.
+    """
+    c_filename = Path(cache_dir).joinpath(module_name + ".c")
+    if (c_filename.with_suffix(".c.cached").exists() or c_filename.with_suffix(".failed").exists()
+            or not c_filename.exists()):
+        return True
+    mtimes = []
+    for path in (c_filename.with_suffix(".lock"), c_filename):
+        with contextlib.suppress(FileNotFoundError):
+            mtimes.append(path.stat().st_mtime)
+    return not mtimes or time.time() - max(mtimes) > STALE_LOCK_AGE
+
+
+def record(cache_dir, module_name, compile_time=None):
+    """Add (or update) a freshly compiled module in the manifest."""
+    with _manifest_lock(cache_dir):
+        entries = _read_manifest(cache_dir)
+        entries[module_name] = _entry(_artifacts(cache_dir, module_name), time.time(), compile_time)
+        _write_manifest(cache_dir, entries)
+
+
+def touch(cache_dir, module_name):
+    """Mark module as recently used, by updating the modification time of its .c.cached marker."""
+    with contextlib.suppress(FileNotFoundError):
+        os.utime(Path(cache_dir).joinpath(module_name + ".c.cached"))
+
+
+def entries(cache_dir):
+    """Return manifest entries, including modules present on disk but not yet indexed."""
+    if not Path(cache_dir).is_dir():
+        return {}
+    with _manifest_lock(cache_dir):
+        return _scan(cache_dir, _read_manifest(cache_dir))
+
+
+def prune(cache_dir, max_bytes=0, max_entries=0, keep=()):
+    """Evict least recently used modules until the cache fits within the limits.
+
+    Parameters
+    ----------
+    cache_dir
+        JIT cache directory.
+    max_bytes
+        Maximum total size of all artifacts. Zero means unlimited.
+    max_entries
+        Maximum number of modules, not counting object files of sharded
+        builds and generated source code. Zero means unlimited.
+    keep
+        Names of modules which must not be evicted.
+
+    Returns
+    -------
+    List of evicted module names.
+
+    """
+    if not Path(cache_dir).is_dir():
+        return []
+
+    evicted = []
+    with _manifest_lock(cache_dir):
+        entries = _scan(cache_dir, _read_manifest(cache_dir))
+        total_bytes = sum(e["size"] for e in entries.values())
+        num_entries = sum(1 for name in entries if _is_module(name))
+
+        # Oldest first
+        candidates = sorted(entries.items(), key=lambda item: item[1]["last_access"] or 0.0)
+        for module_name, entry in candidates:
+            over_bytes = max_bytes > 0 and total_bytes > max_bytes
+            over_entries = max_entries > 0 and num_entries > max_entries
+            if not (over_bytes or over_entries):
+                break
+            if module_name in keep or not _is_complete(cache_dir, module_name):
+                continue
+            if not _is_module(module_name) and not over_bytes:
+                continue
+
+            logger.info("Evicting {} from JIT cache".format(module_name))
+            for path in _artifacts(cache_dir, module_name):
+                with contextlib.suppress(FileNotFoundError):
+                    path.unlink()
+            del entries[module_name]
+            total_bytes -= entry["size"]
+            if _is_module(module_name):
+                num_entries -= 1
+            evicted.append(module_name)
+
+        _write_manifest(cache_dir, entries)
+
+    return evicted
+
+
+def clear(cache_dir):
+    """Remove all JIT modules and the manifest from the cache directory."""
+    removed = []
+    if not Path(cache_dir).is_dir():
+        return removed
+    with _manifest_lock(cache_dir):
+        entries = _scan(cache_dir, _read_manifest(cache_dir))
+        for module_name in entries:
+            for path in _artifacts(cache_dir, module_name):
+                with contextlib.suppress(FileNotFoundError):
+                    path.unlink()
+            removed.append(module_name)
+        for path in Path(cache_dir).glob(MODULE_PREFIX + "*.lock"):
+            with contextlib.suppress(FileNotFoundError):
+                path.unlink()
+        _write_manifest(cache_dir, {})
+    for module_store in _stores(cache_dir):
+        stored = list(module_store.entries())
+        module_store.remove(stored)
+        removed += [name for name in stored if name not in removed]
+    return removed
+
+
+def _stores(cache_dir):
+    """Return the single-file stores present in the cache directory."""
+    stores = (store.get_store(name, cache_dir) for name in sorted(store.STORES))
+    return [s for s in stores if s.path.exists()]
+
+
+def stats(cache_dir):
+    """Return summary statistics of the cache directory."""
+    e = entries(cache_dir)
+    stored = {}
+    for module_store in _stores(cache_dir):
+        stored.update(module_store.entries())
+    compile_times = [v["compile_time"] for v in e.values() if v["compile_time"] is not None]
+    last_access = [v["last_access"] for v in e.values() if v["last_access"] is not None]
+    return {"cache_dir": str(Path(cache_dir).resolve()),
+            "num_entries": sum(1 for name in e if _is_module(name)),
+            "num_objects": sum(1 for name in e if name.startswith(OBJECTS_DIR + "/")),
+            "num_sources": sum(1 for name in e if name.startswith(SOURCE_DIR + "/")),
+            "num_stored": len(stored),
+            "stored_bytes": sum(v["size"] for v in stored.values()),
+            "total_bytes": sum(v["size"] for v in e.values()),
+            "total_compile_time": sum(compile_times),
+            "oldest_access": min(last_access, default=None),
+            "newest_access": max(last_access, default=None)}
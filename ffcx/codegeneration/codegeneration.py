@@ -11,9 +11,11 @@ UFC function from an intermediate representation (IR).
 
 """
 
+import itertools
 import logging
 from collections import namedtuple
 
+from ffcx import parallel, tracing
 from ffcx.codegeneration.coordinate_mapping import \
     generator as coordinate_mapping_generator
 from ffcx.codegeneration.dofmap import generator as dofmap_generator
@@ -29,6 +31,15 @@ code_blocks = namedtuple("code_blocks", ["elements", "dofmaps",
                                          "coordinate_mappings", "integrals",
                                          "forms", "expressions"])
 
+# Generator of each kind of code block, in order of the code_blocks
+# fields (which are also the fields of the IR)
+_generators = (("elements", "finite_element", finite_element_generator),
+               ("dofmaps", "dofmap", dofmap_generator),
+               ("coordinate_mappings", "coordinate_mapping", coordinate_mapping_generator),
+               ("integrals", "integral", integral_generator),
+               ("forms", "form", form_generator),
+               ("expressions", "expression", expression_generator))
+
 
 def generate_code(ir, parameters):
     """Generate code blocks from intermediate representation."""
@@ -37,14 +48,18 @@ def generate_code(ir, parameters):
     logger.info("Compiler stage 3: Generating code")
     logger.info(79 * "*")
 
-    # Generate code for finite_elements
-    code_finite_elements = [finite_element_generator(element_ir, parameters) for element_ir in ir.elements]
-    code_dofmaps = [dofmap_generator(dofmap_ir, parameters) for dofmap_ir in ir.dofmaps]
-    code_coordinate_mappings = [coordinate_mapping_generator(cmap_ir, parameters) for cmap_ir in ir.coordinate_mappings]
-    code_integrals = [integral_generator(integral_ir, parameters) for integral_ir in ir.integrals]
-    code_forms = [form_generator(form_ir, parameters) for form_ir in ir.forms]
-    code_expressions = [expression_generator(expression_ir, parameters) for expression_ir in ir.expressions]
-
-    return code_blocks(elements=code_finite_elements, dofmaps=code_dofmaps,
-                       coordinate_mappings=code_coordinate_mappings, integrals=code_integrals,
-                       forms=code_forms, expressions=code_expressions)
+    # Code for each object is generated independently, in parallel
+    # processes with the parameter parallel_codegen, and merged into the
+    # code blocks in order of the IR
+    tasks = [(_generate, (generator, kind, object_ir, parameters))
+             for field, kind, generator in _generators for object_ir in getattr(ir, field)]
+    code = iter(parallel.map_tasks(tasks, parameters["parallel_codegen"]))
+
+    return code_blocks(**{field: list(itertools.islice(code, len(getattr(ir, field))))
+                          for field, _, _ in _generators})
+
+
+def _generate(generator, kind, ir, parameters):
+    """Generate code for IR of an object with generator, tracing it."""
+    with tracing.span("codegen", ir.name, generator=kind):
+        return generator(ir, parameters)
@@ -5,98 +5,742 @@
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
 from contextlib import redirect_stdout
+import collections.abc
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
 import importlib
 import io
+import json
 import logging
 import os
 import re
+import socket
+import subprocess
+import sys
+import sysconfig
 import tempfile
+import threading
 import time
+import traceback
+import types
+import weakref
 from pathlib import Path
 
-import cffi
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 import ffcx
-import ffcx.naming
+from ffcx.codegeneration import autotune, cache, kernel_inputs, store
 
 logger = logging.getLogger("ffcx")
 
-# Get declarations directly from ufc.h
-file_dir = os.path.dirname(os.path.abspath(__file__))
-with open(file_dir + "/ufc.h", "r") as f:
-    ufc_h = ''.join(f.readlines())
-
-UFC_HEADER_DECL = "typedef {} ufc_scalar_t;  /* Hack to deal with scalar type */\n"
-header = ufc_h.split("<HEADER_DECL>")[1].split("</HEADER_DECL>")[0].strip(" /\n")
-header = header.replace("{", "{{").replace("}", "}}")
-UFC_HEADER_DECL += header + "\n"
-UFC_HEADER_DECL += "void free(void *); \n"
-
-UFC_ELEMENT_DECL = '\n'.join(re.findall('typedef struct ufc_finite_element.*?ufc_finite_element;', ufc_h, re.DOTALL))
-UFC_DOFMAP_DECL = '\n'.join(re.findall('typedef struct ufc_dofmap.*?ufc_dofmap;', ufc_h, re.DOTALL))
-UFC_COORDINATEMAPPING_DECL = '\n'.join(re.findall('typedef struct ufc_coordinate_mapping.*?ufc_coordinate_mapping;',
-                                                  ufc_h, re.DOTALL))
-UFC_FORM_DECL = '\n'.join(re.findall('typedef struct ufc_form.*?ufc_form;', ufc_h, re.DOTALL))
+# Interval (seconds) at which a compiling process refreshes its lock file
+_HEARTBEAT_INTERVAL = 1.0
+# Range of intervals (seconds) for polling when locks cannot be used
+_MIN_BACKOFF = 0.001
+_MAX_BACKOFF = 0.1
+
+# Without a Unix-style C compiler, cffi compiles modules itself. It then
+# changes the working directory of the process, and its output is
+# captured by redirecting sys.stdout, so only one thread at a time may
+# call it
+_cffi_compile_lock = threading.Lock()
+
+# Out-of-line cffi modules with the UFC types, included by the modules
+# built in API mode, see _ufc_module
+_UFC_MODULE_PREFIX = "_ffcx_ufc_"
+_ufc_module_lock = threading.Lock()
+
+# Futures of asynchronous compilations which have not finished yet,
+# keyed by the function and signature of the objects being compiled
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+_default_executor = None
+
+# Objects of modules already loaded by this process, keyed by module name
+# and cache directory. An entry is dropped once the caller no longer
+# holds the list of objects.
+_registry = weakref.WeakValueDictionary()
+_registry_lock = threading.Lock()
+_registry_hits = 0
+_registry_misses = 0
+
+# Counts and times (seconds) of the JIT compilations of this process,
+# see stats()
+_STAT_COUNTS = ("hits", "misses", "waits", "timeouts", "failures")
+_STAT_TIMES = ("wait_time", "codegen_time", "compile_time", "load_time")
+_OUTCOME_COUNTS = {"hit": "hits", "miss": "misses", "timeout": "timeouts", "failure": "failures"}
+_stats = dict.fromkeys(_STAT_COUNTS, 0)
+_stats.update(dict.fromkeys(_STAT_TIMES, 0.0))
+_stats_lock = threading.Lock()
+
+
+class _CompiledObjects(collections.abc.Sequence):
+    """Sequence of compiled UFC objects, which also keeps their module alive.
+
+    Each object is created by its UFC factory (which calls malloc) on
+    first access, and kept for later accesses.
+    """
 
-UFC_INTEGRAL_DECL = '\n'.join(re.findall(r'typedef void ?\(ufc_tabulate_tensor\).*?\);', ufc_h, re.DOTALL))
-UFC_INTEGRAL_DECL += '\n'.join(re.findall(r'typedef void ?\(ufc_tabulate_tensor_custom\).*?\);', ufc_h, re.DOTALL))
-UFC_INTEGRAL_DECL += '\n'.join(re.findall('typedef struct ufc_integral.*?ufc_integral;',
-                                          ufc_h, re.DOTALL))
-UFC_INTEGRAL_DECL += '\n'.join(re.findall('typedef struct ufc_custom_integral.*?ufc_custom_integral;',
-                                          ufc_h, re.DOTALL))
-UFC_EXPRESSION_DECL = '\n'.join(re.findall('typedef struct ufc_expression.*?ufc_expression;', ufc_h, re.DOTALL))
+    __slots__ = ("module", "_names", "_objects", "_lock", "__weakref__")
+
+    def __init__(self, module, names):
+        self.module = module
+        self._names = list(names)
+        self._objects = [None] * len(self._names)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._names)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        obj = self._objects[i]
+        if obj is None:
+            with self._lock:
+                obj = self._objects[i]
+                if obj is None:
+                    # Call UFC factory to create object data struct (calls malloc)
+                    obj = getattr(self.module.lib, "create_" + self._names[i])()
+
+                    # Set garbage collector to use C free()
+                    obj = self.module.ffi.gc(obj, self.module.lib.free)
+                    self._objects[i] = obj
+        return obj
+
+    def __repr__(self):
+        return "<compiled UFC objects {} of {}>".format(self._names, self.module.__name__)
+
+
+class _CompiledObjectsView(collections.abc.Sequence):
+    """Part of a sequence of compiled objects, optionally grouped in tuples, without creating them."""
+
+    __slots__ = ("_objects", "_start", "_stop", "_group")
+
+    def __init__(self, objects, start, stop, group=1):
+        self._objects = objects
+        self._start = start
+        self._stop = stop
+        self._group = group
+
+    def __len__(self):
+        return (self._stop - self._start) // self._group
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("compiled object index out of range")
+        j = self._start + i * self._group
+        if self._group == 1:
+            return self._objects[j]
+        return tuple(self._objects[j + k] for k in range(self._group))
+
+
+# Suffix of plain shared libraries built in ABI mode
+_SHLIB_SUFFIX = sysconfig.get_config_var("SHLIB_SUFFIX") or ".so"
+# Suffix of Python extension modules built in API mode
+_EXT_SUFFIX = sysconfig.get_config_var("EXT_SUFFIX")
+
+
+@functools.lru_cache(maxsize=None)
+def _ufc_declarations():
+    """Get declarations directly from ufc.h, on first use."""
+    with open(os.path.join(ffcx.codegeneration.get_include_path(), "ufc.h"), "r") as f:
+        ufc_h = ''.join(f.readlines())
+
+    UFC_HEADER_DECL = "typedef {} ufc_scalar_t;  /* Hack to deal with scalar type */\n"
+    header = ufc_h.split("<HEADER_DECL>")[1].split("</HEADER_DECL>")[0].strip(" /\n")
+    header = header.replace("{", "{{").replace("}", "}}")
+    UFC_HEADER_DECL += header + "\n"
+    UFC_HEADER_DECL += "void free(void *); \n"
+
+    UFC_ELEMENT_DECL = '\n'.join(re.findall('typedef struct ufc_finite_element.*?ufc_finite_element;', ufc_h,
+                                            re.DOTALL))
+    UFC_DOFMAP_DECL = '\n'.join(re.findall('typedef struct ufc_dofmap.*?ufc_dofmap;', ufc_h, re.DOTALL))
+    UFC_COORDINATEMAPPING_DECL = '\n'.join(re.findall(
+        'typedef struct ufc_coordinate_mapping.*?ufc_coordinate_mapping;', ufc_h, re.DOTALL))
+    UFC_FORM_DECL = '\n'.join(re.findall('typedef struct ufc_form.*?ufc_form;', ufc_h, re.DOTALL))
+
+    UFC_INTEGRAL_DECL = '\n'.join(re.findall(r'typedef void ?\(ufc_tabulate_tensor\).*?\);', ufc_h, re.DOTALL))
+    UFC_INTEGRAL_DECL += '\n'.join(re.findall(r'typedef void ?\(ufc_tabulate_tensor_custom\).*?\);', ufc_h,
+                                              re.DOTALL))
+    UFC_INTEGRAL_DECL += '\n'.join(re.findall('typedef struct ufc_integral.*?ufc_integral;',
+                                              ufc_h, re.DOTALL))
+    UFC_INTEGRAL_DECL += '\n'.join(re.findall('typedef struct ufc_custom_integral.*?ufc_custom_integral;',
+                                              ufc_h, re.DOTALL))
+    UFC_EXPRESSION_DECL = '\n'.join(re.findall('typedef struct ufc_expression.*?ufc_expression;', ufc_h,
+                                               re.DOTALL))
+
+    return {"UFC_HEADER_DECL": UFC_HEADER_DECL, "UFC_ELEMENT_DECL": UFC_ELEMENT_DECL,
+            "UFC_DOFMAP_DECL": UFC_DOFMAP_DECL, "UFC_COORDINATEMAPPING_DECL": UFC_COORDINATEMAPPING_DECL,
+            "UFC_FORM_DECL": UFC_FORM_DECL, "UFC_INTEGRAL_DECL": UFC_INTEGRAL_DECL,
+            "UFC_EXPRESSION_DECL": UFC_EXPRESSION_DECL}
+
+
+def _ufc_decl(scalar_type, *kinds):
+    """Return the UFC header declarations for a scalar type, followed by the declarations of the given kinds."""
+    declarations = _ufc_declarations()
+    return declarations["UFC_HEADER_DECL"].format(scalar_type) + \
+        "".join(declarations["UFC_{}_DECL".format(kind)] for kind in kinds)
+
+
+def __getattr__(name):
+    # The UFC_*_DECL declarations are extracted from ufc.h on first
+    # access, to keep importing this module cheap (PEP 562)
+    try:
+        return _ufc_declarations()[name]
+    except KeyError:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 
 def _compute_parameter_signature(parameters):
     """Return parameters signature (some parameters should not affect signature)."""
-    return str(sorted(parameters.items()))
+    # JIT and scheduling parameters only control how and where code is
+    # generated and compiled, not the code itself
+    return str(sorted(ffcx.parameters.code_parameters(parameters).items()))
 
 
-def get_cached_module(module_name, object_names, cache_dir, timeout):
-    """Look for an existing C file and wait for compilation, or if it does not exist, create it."""
-    cache_dir = Path(cache_dir)
-    c_filename = cache_dir.joinpath(module_name).with_suffix(".c")
-    ready_name = c_filename.with_suffix(".c.cached")
+def _read_owner(lock_file):
+    """Return owner record (pid, hostname) of a lock file and the age of its heartbeat."""
+    try:
+        owner = json.loads(lock_file.read_text())
+        age = time.time() - lock_file.stat().st_mtime
+    except (FileNotFoundError, ValueError):
+        return None, None
+    return owner, age
+
+
+def _owner_alive(owner, age):
+    """Check if the process recorded as owner of a lock is still compiling."""
+    if owner is None or age > cache.STALE_LOCK_AGE:
+        return False
+    if owner.get("hostname") != socket.gethostname():
+        # Cannot check processes on other hosts, so trust the heartbeat
+        return True
+    if owner.get("pid") == os.getpid():
+        return False
+    try:
+        os.kill(owner["pid"], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _wait_for_unlock(lock_file, timeout):
+    """Block (without polling) until the exclusive lock on lock_file is released.
+
+    Returns False if timeout is exceeded.
+    """
+    released = threading.Event()
+
+    def wait():
+        # Use a separate open file description, so that the wait can be
+        # abandoned on timeout
+        with open(lock_file, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            fcntl.flock(f, fcntl.LOCK_UN)
+        released.set()
 
-    # Ensure cache dir exists
+    threading.Thread(target=wait, daemon=True).start()
+    return released.wait(max(timeout, 0.0))
+
+
+def _heartbeat(lock_file, stop):
+    """Periodically update the modification time of the lock file while compiling."""
+    while not stop.wait(_HEARTBEAT_INTERVAL):
+        try:
+            os.utime(lock_file)
+        except FileNotFoundError:
+            return
+
+
+def _check_failed(failed_name, retry_failed):
+    """Raise the recorded error of a previously failed compilation, unless it is to be retried."""
+    if retry_failed:
+        return
+    try:
+        diagnostics = failed_name.read_text()
+    except FileNotFoundError:
+        return
+    raise RuntimeError("""JIT compilation failed previously with:
+{}
+Set parameter jit_retry_failed to retry, or remove {}.""".format(diagnostics.rstrip(), failed_name))
+
+
+@contextlib.contextmanager
+def _module_lock(cache_dir, module_name, timeout, retry_failed=False):
+    """Wait for the module to be compiled by another process, or obtain the right to compile it.
+
+    Yields True if the module is ready in cache_dir and False if the
+    caller must compile it. In the latter case, an exclusive advisory
+    lock is held on <module_name>.lock until the context exits, and
+    other processes block on the lock until it is released.
+
+    If a previous compilation failed, the recorded error is raised
+    instead, unless retry_failed is True.
+
+    A lock whose owner has died is released by the operating system. On
+    filesystems where locks are not visible across hosts, the owner
+    record (hostname, PID) and the heartbeat (modification time) of the
+    lock file are used to detect a compilation in progress elsewhere.
+    """
     cache_dir.mkdir(exist_ok=True, parents=True)
+    c_filename = cache_dir.joinpath(module_name + ".c")
+    ready_name = c_filename.with_suffix(".c.cached")
+    failed_name = c_filename.with_suffix(".failed")
+    lock_file = c_filename.with_suffix(".lock")
+
+    # Fast path, no lock needed
+    if ready_name.exists():
+        yield True
+        return
+    _check_failed(failed_name, retry_failed)
+
+    if fcntl is None:
+        yield from _module_lock_exclusive_create(c_filename, ready_name, failed_name, timeout, retry_failed)
+        return
+
+    deadline = time.time() + timeout
+    backoff = _MIN_BACKOFF
+    waiting = False
+    with open(lock_file, "a+") as f:
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.info("Waiting for {} to be compiled.".format(module_name))
+                if not waiting:
+                    waiting = True
+                    _count("waits")
+                if not _wait_for_unlock(lock_file, deadline - time.time()):
+                    break
+                if ready_name.exists():
+                    yield True
+                    return
+                # Owner released the lock without producing the module (crashed
+                # or failed), so try to take over
+                continue
+
+            try:
+                if ready_name.exists():
+                    yield True
+                    return
+                # Owner may have just failed, in which case waiters fail too
+                _check_failed(failed_name, retry_failed)
+
+                owner, age = _read_owner(lock_file)
+                if _owner_alive(owner, age):
+                    # Compilation in progress on another host, which does not see our lock
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                    if not waiting:
+                        waiting = True
+                        _count("waits")
+                    if time.time() > deadline:
+                        break
+                    time.sleep(backoff)
+                    backoff = min(2 * backoff, _MAX_BACKOFF)
+                    continue
+
+                if owner is not None:
+                    logger.info("Taking over stale JIT lock of process {} on {}.".format(
+                        owner.get("pid"), owner.get("hostname")))
+
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps({"pid": os.getpid(), "hostname": socket.gethostname()}))
+                f.flush()
+
+                stop = threading.Event()
+                heartbeat = threading.Thread(target=_heartbeat, args=(lock_file, stop), daemon=True)
+                heartbeat.start()
+                try:
+                    yield False
+                finally:
+                    stop.set()
+                    heartbeat.join()
+                    f.seek(0)
+                    f.truncate()
+                    f.flush()
+                return
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    raise TimeoutError("""JIT compilation timed out, probably due to a failed previous compile.
+        Try cleaning cache (e.g. remove {}) or increase timeout parameter.""".format(c_filename))
 
+
+def _module_lock_exclusive_create(c_filename, ready_name, failed_name, timeout, retry_failed):
+    """Fallback for platforms without fcntl: claim module by exclusive creation of the C file."""
     try:
-        # Create C file with exclusive access
-        open(c_filename, "x")
-        return None, None
+        open(c_filename, "x").close()
     except FileExistsError:
         logger.info("Cached C file already exists: " + str(c_filename))
-        finder = importlib.machinery.FileFinder(
-            str(cache_dir), (importlib.machinery.ExtensionFileLoader, importlib.machinery.EXTENSION_SUFFIXES))
-        finder.invalidate_caches()
-
-        # Now, wait for ready
-        for i in range(timeout):
-            if os.path.exists(ready_name):
-                spec = finder.find_spec(module_name)
-                if spec is None:
-                    raise ModuleNotFoundError("Unable to find JIT module.")
-                compiled_module = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(compiled_module)
-
-                compiled_objects = [getattr(compiled_module.lib, "create_" + name)() for name in object_names]
-                return compiled_objects, compiled_module
-
-            logger.info("Waiting for {} to appear.".format(str(ready_name)))
-            time.sleep(1)
+        _count("waits")
+        deadline = time.time() + timeout
+        backoff = _MIN_BACKOFF
+        while time.time() < deadline:
+            if ready_name.exists():
+                yield True
+                return
+            _check_failed(failed_name, retry_failed)
+            time.sleep(backoff)
+            backoff = min(2 * backoff, _MAX_BACKOFF)
         raise TimeoutError("""JIT compilation timed out, probably due to a failed previous compile.
         Try cleaning cache (e.g. remove {}) or increase timeout parameter.""".format(c_filename))
+    yield False
+
+
+class FileLockCoordinator:
+    """Coordinates compilation of modules between processes with advisory locks on files in the cache directory.
+
+    This is the default coordinator. The first process to lock a module
+    compiles it, and the others block on the lock until it is released.
+    """
+
+    # Whether module() must be called by all processes of a group
+    collective = False
+
+    @contextlib.contextmanager
+    def module(self, cache_dir, module_name, timeout, retry_failed=False):
+        """Wait for the module to be compiled by another process, or obtain the right to compile it.
+
+        Yields True if the module is ready in cache_dir and False if the
+        caller must compile it before the context exits.
+        """
+        with _module_lock(cache_dir, module_name, timeout, retry_failed) as ready:
+            if not ready or _library_exists(cache_dir, module_name):
+                if ready:
+                    cache.touch(cache_dir, module_name)
+                yield ready
+                return
+
+        # The library has been removed, for example by an eviction in
+        # progress, so the marker is stale and the module is compiled
+        # again
+        logger.info("JIT module {} is marked ready but its library is missing.".format(module_name))
+        with contextlib.suppress(FileNotFoundError):
+            cache_dir.joinpath(module_name + ".c.cached").unlink()
+        with _module_lock(cache_dir, module_name, timeout, retry_failed) as ready:
+            if ready:
+                cache.touch(cache_dir, module_name)
+            yield ready
+
+
+class CommCoordinator:
+    """Coordinates compilation of modules between the processes of a communicator.
+
+    The root process compiles the module (coordinating with processes
+    outside the communicator through another coordinator, by default a
+    FileLockCoordinator), and broadcasts the outcome to the other
+    processes, which block on the broadcast instead of the filesystem.
+
+    The JIT compile functions must then be called collectively by all
+    processes of the communicator, with the same arguments. Processes
+    which have already loaded the module take part in the broadcast
+    too, since other processes may not have loaded it.
+
+    Modules are ready on the other processes once the root has compiled
+    them. With a single-file store (parameter jit_cache_store), processes
+    whose node-local directory is missing the module extract it from
+    the store.
+
+    Parameters
+    ----------
+    comm
+        Communicator with a rank attribute and a method bcast(obj,
+        root), for example an mpi4py.MPI.Comm.
+    root
+        Rank of the process which compiles.
+    coordinator
+        Coordinator used by the root process.
+
+    """
+
+    collective = True
+
+    def __init__(self, comm, root=0, coordinator=None):
+        self.comm = comm
+        self.root = root
+        self.coordinator = FileLockCoordinator() if coordinator is None else coordinator
+
+    @contextlib.contextmanager
+    def module(self, cache_dir, module_name, timeout, retry_failed=False):
+        if self.comm.rank != self.root:
+            _count("waits")
+            error = self.comm.bcast(None, root=self.root)
+            if error is not None:
+                raise RuntimeError("JIT compilation failed on root process with:\n{}".format(error))
+            yield True
+            return
+
+        try:
+            with self.coordinator.module(cache_dir, module_name, timeout, retry_failed) as ready:
+                yield ready
+        except BaseException as e:
+            self.comm.bcast("".join(traceback.format_exception_only(type(e), e)).rstrip(), root=self.root)
+            raise
+        self.comm.bcast(None, root=self.root)
+
+
+def _compile_module(ufc_decl, decl, ufl_objects, object_names, module_name, source_key, parameters, cache_dir,
+                    timeout, cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries, coordinator=None):
+    """Compile (or fetch from cache_dir) the module and load its objects.
+
+    If the parameter jit_abi_mode is set, the module is a plain shared
+    library loaded with cffi in ABI mode instead of a Python extension
+    module.
+
+    The cffi declarations are split into the UFC types (ufc_decl), which
+    are shared by many modules, and the factory functions (decl).
+
+    The module name identifies the compiled module, while source_key
+    identifies the generated code, which does not depend on the C
+    compiler flags.
+
+    If the parameter jit_cache_store is set, cache_dir only holds a
+    single-file store of compiled modules. The module is then compiled
+    (or extracted from the store) in a node-local directory, given by
+    the parameter jit_local_dir, and newly compiled modules are added to
+    the store.
+
+    Processes compiling the same module into the same cache directory
+    are coordinated by coordinator, by default a FileLockCoordinator.
+    """
+    global _registry_hits, _registry_misses
+
+    if parameters["jit_abi_mode"]:
+        # Different artifacts from the same code
+        module_name += "_abi"
+
+    key = (module_name, None if cache_dir is None else str(Path(cache_dir).absolute()))
+    with _registry_lock:
+        objects = _registry.get(key)
+        if objects is not None:
+            _registry_hits += 1
+        else:
+            _registry_misses += 1
+    if objects is not None:
+        if cache_dir is not None and getattr(coordinator, "collective", False):
+            # Other processes of the group may not have loaded the module,
+            # so take part in their collective
+            module_store, local_dir = _local_cache_dir(cache_dir, parameters, timeout)
+            local_dir = Path(local_dir).absolute()
+            with coordinator.module(local_dir, module_name, timeout, parameters["jit_retry_failed"]) as ready:
+                if not ready:
+                    # Evicted from the cache since this process loaded it,
+                    # but needed by the others
+                    _compile_objects(ufc_decl, decl, ufl_objects, object_names, module_name, source_key,
+                                     parameters, local_dir, cffi_extra_compile_args, cffi_verbose, cffi_debug,
+                                     cffi_libraries)
+                    if module_store is not None:
+                        _add_to_store(module_store, local_dir, module_name, parameters["jit_abi_mode"])
+        return objects, objects.module
+
+    event = {"time": time.time(), "module": module_name, "cache_dir": key[1], "outcome": "hit",
+             "wait_time": 0.0, "codegen_time": 0.0, "compile_time": 0.0, "load_time": 0.0}
+    try:
+        objects, module = _get_module(ufc_decl, decl, ufl_objects, object_names, module_name, source_key,
+                                      parameters, cache_dir, timeout, cffi_extra_compile_args, cffi_verbose,
+                                      cffi_debug, cffi_libraries, coordinator, event)
+    except TimeoutError:
+        event["outcome"] = "timeout"
+        raise
+    except Exception:
+        event["outcome"] = "failure"
+        raise
+    finally:
+        _add_stats(event)
+        if parameters["jit_event_log"]:
+            _log_event(parameters["jit_event_log"], event)
+
+    with _registry_lock:
+        # Another thread may have loaded the same module meanwhile
+        objects = _registry.setdefault(key, objects)
+    return objects, objects.module
+
+
+def _get_module(ufc_decl, decl, ufl_objects, object_names, module_name, source_key, parameters, cache_dir,
+                timeout, cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries, coordinator, event):
+    """Compile (or fetch from cache_dir) the module and load it, recording outcome and timings in event."""
+    module_store, cache_dir = _local_cache_dir(cache_dir, parameters, timeout)
+
+    with contextlib.ExitStack() as stack:
+        if cache_dir is None:
+            # Fresh directory, no other process can be compiling into it
+            cache_dir = Path(tempfile.mkdtemp())
+            ready = False
+        else:
+            # Absolute path, since the working directory changes while
+            # cffi compiles in another thread
+            cache_dir = Path(cache_dir).absolute()
+            if coordinator is None:
+                coordinator = FileLockCoordinator()
+            t0 = time.time()
+            ready = stack.enter_context(coordinator.module(cache_dir, module_name, timeout,
+                                                           parameters["jit_retry_failed"]))
+            event["wait_time"] = time.time() - t0
+
+        if module_store is not None and not (ready and cache_dir.joinpath(module_name + ".c.cached").exists()):
+            # Missing locally, also if it was compiled by a process on another node
+            ready = _fetch_from_store(module_store, cache_dir, module_name)
+
+        if not ready:
+            event["outcome"] = "miss"
+            event.update(_compile_objects(ufc_decl, decl, ufl_objects, object_names, module_name, source_key,
+                                          parameters, cache_dir, cffi_extra_compile_args, cffi_verbose,
+                                          cffi_debug, cffi_libraries))
+            if module_store is not None:
+                _add_to_store(module_store, cache_dir, module_name, parameters["jit_abi_mode"])
+
+    t0 = time.time()
+    if parameters["jit_abi_mode"]:
+        objects, module = _load_library(cache_dir, module_name, object_names, ufc_decl, decl)
+    else:
+        objects, module = _load_objects(cache_dir, module_name, object_names, ufc_decl)
+    event["load_time"] = time.time() - t0
+    return objects, module
+
+
+def _local_cache_dir(cache_dir, parameters, timeout):
+    """Return the single-file store (or None) and the directory in which modules are compiled and loaded.
+
+    With a store, modules are compiled and loaded in a node-local
+    directory, which is filled from the store in the (shared) cache
+    directory.
+    """
+    if cache_dir is None or not parameters["jit_cache_store"]:
+        return None, cache_dir
+    module_store = store.get_store(parameters["jit_cache_store"], cache_dir, timeout)
+    return module_store, module_store.local_dir(parameters["jit_local_dir"])
+
+
+def _add_stats(event):
+    """Add the outcome and timings of a compile call to the statistics of this process."""
+    with _stats_lock:
+        _stats[_OUTCOME_COUNTS[event["outcome"]]] += 1
+        for name in _STAT_TIMES:
+            _stats[name] += event[name]
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _log_event(filename, event):
+    """Append an event to a JSON lines log file.
+
+    The event is written with a single call on a file opened for
+    appending, so that the lines of concurrent processes do not
+    interleave.
+    """
+    line = json.dumps(dict(event, pid=os.getpid(), hostname=socket.gethostname())) + "\n"
+    with open(filename, "a") as f:
+        f.write(line)
+
+
+def stats():
+    """Return statistics of the JIT compilations of this process.
+
+    Returns
+    -------
+    A dict with the number of modules found compiled in the cache
+    ("hits"), compiled by this process ("misses"), waited for while
+    another process compiled them ("waits"), timed out ("timeouts") and
+    failed ("failures"), and the total time in seconds spent generating
+    code ("codegen_time"), in the C compiler ("compile_time"), loading
+    modules ("load_time") and waiting for other processes ("wait_time").
+    Modules loaded by this process before are counted by registry_stats
+    instead.
+
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    """Reset the statistics returned by stats()."""
+    with _stats_lock:
+        _stats.update(dict.fromkeys(_STAT_COUNTS, 0))
+        _stats.update(dict.fromkeys(_STAT_TIMES, 0.0))
+
+
+def _library_filename(cache_dir, module_name, abi_mode):
+    """Return the compiled library of a module in cache_dir, or None if it does not exist."""
+    suffixes = [_SHLIB_SUFFIX] if abi_mode else importlib.machinery.EXTENSION_SUFFIXES
+    for suffix in suffixes:
+        filename = cache_dir.joinpath(module_name + suffix)
+        if filename.exists():
+            return filename
+    return None
+
+
+def _library_exists(cache_dir, module_name):
+    """True if the compiled library of a module (built in either mode) exists in cache_dir."""
+    return any(_library_filename(cache_dir, module_name, abi_mode) is not None for abi_mode in (False, True))
+
+
+def _fetch_from_store(module_store, cache_dir, module_name):
+    """Extract a module from the store into cache_dir, returning False if it is not in the store."""
+    files = module_store.get(module_name)
+    if files is None:
+        return False
+    logger.info("JIT module {} found in store {}".format(module_name, module_store.path))
+    # The build log marks the module as ready, so it is written last
+    ready_filename = module_name + ".c.cached"
+    ready_log = files.pop(ready_filename, b"")
+    files[ready_filename] = ready_log
+    store.extract(files, cache_dir)
+    cache.record(cache_dir, module_name)
+    return True
+
+
+def _add_to_store(module_store, cache_dir, module_name, abi_mode):
+    """Add a module freshly compiled in cache_dir to the store."""
+    filename = _library_filename(cache_dir, module_name, abi_mode)
+    ready_name = cache_dir.joinpath(module_name + ".c.cached")
+    files = {filename.name: filename.read_bytes(), ready_name.name: ready_name.read_bytes()}
+    compile_time = cache.entries(cache_dir).get(module_name, {}).get("compile_time")
+    module_store.put(module_name, files, compile_time=compile_time)
+
+
+def registry_stats():
+    """Return hits, misses and number of entries of the registry of loaded JIT modules."""
+    with _registry_lock:
+        return {"hits": _registry_hits, "misses": _registry_misses, "size": len(_registry)}
+
+
+def clear_registry():
+    """Forget all loaded JIT modules, so that the next compile call loads them again."""
+    global _registry_hits, _registry_misses
+    with _registry_lock:
+        _registry.clear()
+        _registry_hits = 0
+        _registry_misses = 0
 
 
 def compile_elements(elements, parameters=None, cache_dir=None, timeout=10, cffi_extra_compile_args=None,
-                     cffi_verbose=False, cffi_debug=None, cffi_libraries=None):
+                     cffi_verbose=False, cffi_debug=None, cffi_libraries=None,
+                     coordinator=None):
     """Compile a list of UFL elements and dofmaps into Python objects."""
     p = ffcx.parameters.get_parameters(parameters)
+    cffi_extra_compile_args = autotune.compile_args(p["jit_compile_profile"], cffi_extra_compile_args)
 
     # Get a signature for these elements
     module_name = 'libffcx_elements_' + \
         ffcx.naming.compute_signature(elements, _compute_parameter_signature(p)
                                       + str(cffi_extra_compile_args) + str(cffi_debug))
+    source_key = 'elements_' + ffcx.naming.compute_signature(elements, _compute_parameter_signature(p))
 
     names = []
     for e in elements:
@@ -105,82 +749,98 @@ def compile_elements(elements, parameters=None, cache_dir=None, timeout=10, cffi
         name = ffcx.naming.dofmap_name(e, "JIT")
         names.append(name)
 
-    if cache_dir is not None:
-        cache_dir = Path(cache_dir)
-        obj, mod = get_cached_module(module_name, names, cache_dir, timeout)
-        if obj is not None:
-            # Pair up elements with dofmaps
-            obj = list(zip(obj[::2], obj[1::2]))
-            return obj, mod
-    else:
-        cache_dir = Path(tempfile.mkdtemp())
-
-    try:
-        scalar_type = p["scalar_type"].replace("complex", "_Complex")
-        decl = UFC_HEADER_DECL.format(scalar_type) + UFC_ELEMENT_DECL + UFC_DOFMAP_DECL
-        element_template = "ufc_finite_element * create_{name}(void);\n"
-        dofmap_template = "ufc_dofmap * create_{name}(void);\n"
-        for i in range(len(elements)):
-            decl += element_template.format(name=names[i * 2])
-            decl += dofmap_template.format(name=names[i * 2 + 1])
-
-        _compile_objects(decl, elements, names, module_name, p, cache_dir,
-                         cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries)
-    except Exception:
-        # remove c file so that it will not timeout next time
-        c_filename = cache_dir.joinpath(module_name + ".c")
-        os.replace(c_filename, c_filename.with_suffix(".c.failed"))
-        raise
-
-    objects, module = _load_objects(cache_dir, module_name, names)
+    scalar_type = p["scalar_type"].replace("complex", "_Complex")
+    ufc_decl = _ufc_decl(scalar_type, "ELEMENT", "DOFMAP")
+    decl = ""
+    element_template = "ufc_finite_element * create_{name}(void);\n"
+    dofmap_template = "ufc_dofmap * create_{name}(void);\n"
+    for i in range(len(elements)):
+        decl += element_template.format(name=names[i * 2])
+        decl += dofmap_template.format(name=names[i * 2 + 1])
+
+    objects, module = _compile_module(ufc_decl, decl, elements, names, module_name, source_key, p, cache_dir,
+                                      timeout, cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries,
+                                      coordinator)
     # Pair up elements with dofmaps
-    objects = list(zip(objects[::2], objects[1::2]))
+    objects = _CompiledObjectsView(objects, 0, len(objects), 2)
     return objects, module
 
 
 def compile_forms(forms, parameters=None, cache_dir=None, timeout=10, cffi_extra_compile_args=None,
-                  cffi_verbose=False, cffi_debug=None, cffi_libraries=None):
+                  cffi_verbose=False, cffi_debug=None, cffi_libraries=None,
+                  coordinator=None):
     """Compile a list of UFL forms into UFC Python objects."""
     p = ffcx.parameters.get_parameters(parameters)
+    if p["jit_compile_profile"] == "autotune":
+        p = dict(p, jit_compile_profile=_autotune_forms(forms, p, cache_dir, timeout, cffi_extra_compile_args,
+                                                        cffi_verbose, cffi_debug, cffi_libraries, coordinator))
+    cffi_extra_compile_args = autotune.compile_args(p["jit_compile_profile"], cffi_extra_compile_args)
 
     # Get a signature for these forms
     module_name = 'libffcx_forms_' + \
         ffcx.naming.compute_signature(forms, _compute_parameter_signature(p)
                                       + str(cffi_extra_compile_args) + str(cffi_debug))
+    source_key = 'forms_' + ffcx.naming.compute_signature(forms, _compute_parameter_signature(p))
 
     form_names = [ffcx.naming.form_name(form, i) for i, form in enumerate(forms)]
 
-    if cache_dir is not None:
-        cache_dir = Path(cache_dir)
-        obj, mod = get_cached_module(module_name, form_names, cache_dir, timeout)
-        if obj is not None:
-            return obj, mod
-    else:
-        cache_dir = Path(tempfile.mkdtemp())
+    scalar_type = p["scalar_type"].replace("complex", "_Complex")
+    ufc_decl = _ufc_decl(scalar_type, "ELEMENT", "DOFMAP", "COORDINATEMAPPING", "INTEGRAL", "FORM")
+    decl = ""
 
-    try:
-        scalar_type = p["scalar_type"].replace("complex", "_Complex")
-        decl = UFC_HEADER_DECL.format(scalar_type) + UFC_ELEMENT_DECL + UFC_DOFMAP_DECL + \
-            UFC_COORDINATEMAPPING_DECL + UFC_INTEGRAL_DECL + UFC_FORM_DECL
+    form_template = "ufc_form * create_{name}(void);\n"
+    for name in form_names:
+        decl += form_template.format(name=name)
 
-        form_template = "ufc_form * create_{name}(void);\n"
-        for name in form_names:
-            decl += form_template.format(name=name)
+    obj, module = _compile_module(ufc_decl, decl, forms, form_names, module_name, source_key, p, cache_dir,
+                                  timeout, cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries,
+                                  coordinator)
+    return obj, module
 
-        _compile_objects(decl, forms, form_names, module_name, p, cache_dir,
-                         cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries)
-    except Exception:
-        # remove c file so that it will not timeout next time
-        c_filename = cache_dir.joinpath(module_name + ".c")
-        os.replace(c_filename, c_filename.with_suffix(".c.failed"))
-        raise
 
-    obj, module = _load_objects(cache_dir, module_name, form_names)
-    return obj, module
+def _autotune_forms(forms, parameters, cache_dir, timeout, cffi_extra_compile_args, cffi_verbose, cffi_debug,
+                    cffi_libraries, coordinator):
+    """Select the compile profile with the fastest kernels for forms.
+
+    Each profile is compiled and timed once per signature, and the
+    selection is recorded in cache_dir.
+    """
+    import cffi
+
+    # Timings only apply to the host CPU
+    key = 'forms_' + ffcx.naming.compute_signature(forms, _compute_parameter_signature(parameters)
+                                                   + str(cffi_extra_compile_args) + str(cffi_debug)
+                                                   + autotune.host_signature())
+    profile = autotune.lookup(cache_dir, key)
+    if profile is not None:
+        return profile
+
+    # The IR of the forms, for the sizes of the kernel inputs
+    irs = [kernel_inputs.compute_form_ir(form, parameters) for form in forms]
+    timings = {}
+    for name in autotune.COMPILE_PROFILES:
+        try:
+            compiled_forms, module = compile_forms(forms, dict(parameters, jit_compile_profile=name), cache_dir,
+                                                   timeout, cffi_extra_compile_args, cffi_verbose, cffi_debug,
+                                                   cffi_libraries, coordinator)
+        except (cffi.VerificationError, RuntimeError) as e:
+            logger.warning("Compile profile {} failed and is not tuned: {}".format(name, e))
+            continue
+        timings[name] = sum(autotune.time_form(form, module, ir, parameters["scalar_type"])
+                            for form, ir in zip(compiled_forms, irs))
+        logger.info("Kernels compiled with profile {} take {:.3e}s".format(name, timings[name]))
+    if not timings:
+        raise RuntimeError("JIT compilation failed with all compile profiles.")
+
+    profile = min(timings, key=timings.get)
+    logger.info("Selected compile profile {}".format(profile))
+    autotune.record(cache_dir, key, profile, timings)
+    return profile
 
 
 def compile_expressions(expressions, parameters=None, cache_dir=None, timeout=10, cffi_extra_compile_args=None,
-                        cffi_verbose=False, cffi_debug=None, cffi_libraries=None):
+                        cffi_verbose=False, cffi_debug=None, cffi_libraries=None,
+                        coordinator=None):
     """Compile a list of UFL expressions into UFC Python objects.
 
     Parameters
@@ -190,97 +850,351 @@ def compile_expressions(expressions, parameters=None, cache_dir=None, timeout=10
 
     """
     p = ffcx.parameters.get_parameters(parameters)
+    cffi_extra_compile_args = autotune.compile_args(p["jit_compile_profile"], cffi_extra_compile_args)
 
     # Get a signature for these forms
-    module_name = 'libffcx_expressions_' + ffcx.naming.compute_signature(expressions, '', p)
+    module_name = 'libffcx_expressions_' + \
+        ffcx.naming.compute_signature(expressions, _compute_parameter_signature(p)
+                                      + str(cffi_extra_compile_args) + str(cffi_debug))
+    source_key = 'expressions_' + ffcx.naming.compute_signature(expressions, _compute_parameter_signature(p))
 
     expr_names = ["expression_{!s}".format(ffcx.naming.compute_signature([expression], "", p))
                   for expression in expressions]
 
-    if cache_dir is not None:
-        cache_dir = Path(cache_dir)
-        obj, mod = get_cached_module(module_name, expr_names, cache_dir, timeout)
-        if obj is not None:
-            return obj, mod
-    else:
-        cache_dir = Path(tempfile.mkdtemp())
-
-    try:
-        scalar_type = p["scalar_type"].replace("complex", "_Complex")
-        decl = UFC_HEADER_DECL.format(scalar_type) + UFC_ELEMENT_DECL + UFC_DOFMAP_DECL + \
-            UFC_COORDINATEMAPPING_DECL + UFC_INTEGRAL_DECL + UFC_FORM_DECL + UFC_EXPRESSION_DECL
+    scalar_type = p["scalar_type"].replace("complex", "_Complex")
+    ufc_decl = _ufc_decl(scalar_type, "ELEMENT", "DOFMAP", "COORDINATEMAPPING", "INTEGRAL", "FORM", "EXPRESSION")
+    decl = ""
 
-        expression_template = "ufc_expression* create_{name}(void);\n"
-        for name in expr_names:
-            decl += expression_template.format(name=name)
+    expression_template = "ufc_expression* create_{name}(void);\n"
+    for name in expr_names:
+        decl += expression_template.format(name=name)
 
-        _compile_objects(decl, expressions, expr_names, module_name, p, cache_dir,
-                         cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries)
-    except Exception:
-        # remove c file so that it will not timeout next time
-        c_filename = cache_dir.joinpath(module_name + ".c")
-        os.replace(c_filename, c_filename.with_suffix(".c.failed"))
-        raise
-
-    obj, module = _load_objects(cache_dir, module_name, expr_names)
+    obj, module = _compile_module(ufc_decl, decl, expressions, expr_names, module_name, source_key, p, cache_dir,
+                                  timeout, cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries,
+                                  coordinator)
     return obj, module
 
 
 def compile_coordinate_maps(meshes, parameters=None, cache_dir=None, timeout=10, cffi_extra_compile_args=None,
-                            cffi_verbose=False, cffi_debug=None, cffi_libraries=None):
+                            cffi_verbose=False, cffi_debug=None, cffi_libraries=None,
+                            coordinator=None):
     """Compile a list of UFL coordinate mappings into UFC Python objects."""
     p = ffcx.parameters.get_parameters(parameters)
+    cffi_extra_compile_args = autotune.compile_args(p["jit_compile_profile"], cffi_extra_compile_args)
 
     # Get a signature for these cmaps
     module_name = 'libffcx_cmaps_' + \
         ffcx.naming.compute_signature(meshes, _compute_parameter_signature(
             p) + str(cffi_extra_compile_args) + str(cffi_debug), True)
+    source_key = 'cmaps_' + ffcx.naming.compute_signature(meshes, _compute_parameter_signature(p), True)
 
     cmap_names = [ffcx.naming.coordinate_map_name(
         mesh.ufl_coordinate_element(), "JIT") for mesh in meshes]
 
-    if cache_dir is not None:
-        cache_dir = Path(cache_dir)
-        obj, mod = get_cached_module(module_name, cmap_names, cache_dir, timeout)
-        if obj is not None:
-            return obj, mod
-    else:
-        cache_dir = Path(tempfile.mkdtemp())
+    scalar_type = p["scalar_type"].replace("complex", "_Complex")
+    ufc_decl = _ufc_decl(scalar_type, "COORDINATEMAPPING", "DOFMAP")
+    decl = ""
+    cmap_template = "ufc_coordinate_mapping * create_{name}(void);\n"
 
+    for name in cmap_names:
+        decl += cmap_template.format(name=name)
+
+    obj, module = _compile_module(ufc_decl, decl, meshes, cmap_names, module_name, source_key, p, cache_dir,
+                                  timeout, cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries,
+                                  coordinator)
+    return obj, module
+
+
+def compile_bundle(forms=(), elements=(), meshes=(), expressions=(), parameters=None, cache_dir=None, timeout=10,
+                   cffi_extra_compile_args=None, cffi_verbose=False, cffi_debug=None, cffi_libraries=None,
+                   coordinator=None):
+    """Compile UFL forms, elements, coordinate mappings and expressions together into one module.
+
+    Elements, dofmaps and coordinate mappings shared between the objects
+    are generated and compiled once, instead of once per compile_*
+    call.
+
+    Returns
+    -------
+    A dict of UFC Python objects, with the same structure as returned
+    by compile_forms, compile_elements, compile_coordinate_maps and
+    compile_expressions under the keys "forms", "elements",
+    "coordinate_maps" and "expressions", and the module.
+
+    """
+    p = ffcx.parameters.get_parameters(parameters)
+    cffi_extra_compile_args = autotune.compile_args(p["jit_compile_profile"], cffi_extra_compile_args)
+
+    ufl_objects = list(forms) + list(elements) + list(meshes) + list(expressions)
+    if len(ufl_objects) == 0:
+        raise ValueError("Nothing to compile.")
+
+    # Get a signature for this bundle, which distinguishes the kinds of
+    # objects
+    tag = _compute_parameter_signature(p) + "bundle_{}_{}_{}_{}".format(
+        len(forms), len(elements), len(meshes), len(expressions))
+    module_name = 'libffcx_bundle_' + \
+        ffcx.naming.compute_signature(ufl_objects, tag + str(cffi_extra_compile_args) + str(cffi_debug))
+    source_key = 'bundle_' + ffcx.naming.compute_signature(ufl_objects, tag)
+
+    form_names = [ffcx.naming.form_name(form, i) for i, form in enumerate(forms)]
+    element_names = []
+    for e in elements:
+        element_names.append(ffcx.naming.finite_element_name(e, "JIT"))
+        element_names.append(ffcx.naming.dofmap_name(e, "JIT"))
+    cmap_names = [ffcx.naming.coordinate_map_name(mesh.ufl_coordinate_element(), "JIT") for mesh in meshes]
+    expr_names = ["expression_{!s}".format(ffcx.naming.compute_signature([expression], "", p))
+                  for expression in expressions]
+
+    scalar_type = p["scalar_type"].replace("complex", "_Complex")
+    ufc_decl = _ufc_decl(scalar_type, "ELEMENT", "DOFMAP", "COORDINATEMAPPING", "INTEGRAL", "FORM", "EXPRESSION")
+    decl = ""
+
+    for name in form_names:
+        decl += "ufc_form * create_{name}(void);\n".format(name=name)
+    for i in range(len(elements)):
+        decl += "ufc_finite_element * create_{name}(void);\n".format(name=element_names[i * 2])
+        decl += "ufc_dofmap * create_{name}(void);\n".format(name=element_names[i * 2 + 1])
+    for name in cmap_names:
+        decl += "ufc_coordinate_mapping * create_{name}(void);\n".format(name=name)
+    for name in expr_names:
+        decl += "ufc_expression* create_{name}(void);\n".format(name=name)
+
+    names = form_names + element_names + cmap_names + expr_names
+    obj, module = _compile_module(ufc_decl, decl, ufl_objects, names, module_name, source_key, p, cache_dir,
+                                  timeout, cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries,
+                                  coordinator)
+
+    # Split objects by kind, without creating them
+    offsets = [0, len(form_names), len(element_names), len(cmap_names), len(expr_names)]
+    offsets = [sum(offsets[:i + 1]) for i in range(len(offsets))]
+    objects = {"forms": _CompiledObjectsView(obj, offsets[0], offsets[1]),
+               "elements": _CompiledObjectsView(obj, offsets[1], offsets[2], 2),
+               "coordinate_maps": _CompiledObjectsView(obj, offsets[2], offsets[3]),
+               "expressions": _CompiledObjectsView(obj, offsets[3], offsets[4])}
+    return objects, module
+
+
+def _get_default_executor():
+    global _default_executor
+    with _in_flight_lock:
+        if _default_executor is None:
+            _default_executor = concurrent.futures.ThreadPoolExecutor(thread_name_prefix="ffcx-jit")
+        return _default_executor
+
+
+def _compile_in_process(compile_function, ufl_objects, kwargs):
+    """Compile into the cache directory in a worker process, without returning the (unpicklable) objects."""
+    globals()[compile_function](ufl_objects, **kwargs)
+
+
+def _submit(compile_function, ufl_objects, executor, kwargs):
+    """Run a compile function on an executor, sharing the future with identical requests in flight."""
+    p = ffcx.parameters.get_parameters(kwargs.get("parameters"))
+    # The JIT parameters, left out of the signature of the generated
+    # code, select where and how the module is built and stored
+    jit_parameters = str(sorted((name, value) for name, value in p.items() if name.startswith("jit_")))
+    key = (compile_function.__name__, str(kwargs.get("cache_dir")), jit_parameters,
+           ffcx.naming.compute_signature(ufl_objects, _compute_parameter_signature(p)
+                                         + str(kwargs.get("cffi_extra_compile_args"))
+                                         + str(kwargs.get("cffi_debug")) + str(kwargs.get("cffi_libraries")),
+                                         compile_function is compile_coordinate_maps))
+
+    if executor is None:
+        executor = _get_default_executor()
+
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        if future is not None:
+            logger.info("Compilation of {} already in flight".format(key[-1]))
+            return future
+
+        if isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+            # Compiled objects cannot be sent back from a worker process,
+            # so the worker compiles into the cache directory and the
+            # module is loaded from there once it is ready
+            if kwargs.get("cache_dir") is None:
+                kwargs = dict(kwargs, cache_dir=tempfile.mkdtemp())
+            future = concurrent.futures.Future()
+            future.set_running_or_notify_cancel()
+
+            def load(build):
+                try:
+                    build.result()
+                    future.set_result(compile_function(ufl_objects, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+
+            build = executor.submit(_compile_in_process, compile_function.__name__, ufl_objects, kwargs)
+        else:
+            build = None
+            future = executor.submit(compile_function, ufl_objects, **kwargs)
+        _in_flight[key] = future
+
+    def done(future):
+        with _in_flight_lock:
+            if _in_flight.get(key) is future:
+                del _in_flight[key]
+
+    future.add_done_callback(done)
+    if build is not None:
+        build.add_done_callback(load)
+    return future
+
+
+def compile_elements_async(elements, executor=None, **kwargs):
+    """Compile a list of UFL elements in the background.
+
+    Parameters
+    ----------
+    elements
+        UFL elements.
+    executor
+        Executor to compile on, for example a
+        concurrent.futures.ThreadPoolExecutor or ProcessPoolExecutor.
+        If None, a thread pool shared by all asynchronous compilations
+        is used.
+
+    Other keyword arguments are passed to compile_elements.
+
+    Returns
+    -------
+    A concurrent.futures.Future for the result of compile_elements.
+    Wrap it with asyncio.wrap_future to await it from a coroutine.
+    Requests with the same elements and parameters, made while a
+    compilation is in flight, return the same future.
+
+    Modules are compiled by separate C compiler processes, so that the
+    working directory and sys.stdout of the calling thread are left
+    alone. Only without a Unix-style C compiler, cffi changes them while
+    it compiles; use a ProcessPoolExecutor in that case.
+
+    """
+    return _submit(compile_elements, elements, executor, kwargs)
+
+
+def compile_forms_async(forms, executor=None, **kwargs):
+    """Compile a list of UFL forms in the background.
+
+    See compile_elements_async.
+    """
+    return _submit(compile_forms, forms, executor, kwargs)
+
+
+def compile_expressions_async(expressions, executor=None, **kwargs):
+    """Compile a list of UFL expressions in the background.
+
+    See compile_elements_async.
+    """
+    return _submit(compile_expressions, expressions, executor, kwargs)
+
+
+def compile_coordinate_maps_async(meshes, executor=None, **kwargs):
+    """Compile a list of UFL coordinate mappings in the background.
+
+    See compile_elements_async.
+    """
+    return _submit(compile_coordinate_maps, meshes, executor, kwargs)
+
+
+def _generate_code(ufl_objects, source_key, parameters, cache_dir):
+    """Generate code for UFL objects, or load it from the source cache in cache_dir.
+
+    Returns header and source, or a list of sources for sharded builds.
+    """
+    import ffcx.compiler
+
+    num_shards = parameters["jit_shards"]
+    if num_shards != 0:
+        source_key += "_shards{}".format(num_shards)
+
+    source_file = cache_dir.joinpath(cache.SOURCE_DIR, source_key + ".json")
     try:
-        scalar_type = p["scalar_type"].replace("complex", "_Complex")
-        decl = UFC_HEADER_DECL.format(scalar_type) + UFC_COORDINATEMAPPING_DECL + UFC_DOFMAP_DECL
-        cmap_template = "ufc_coordinate_mapping * create_{name}(void);\n"
+        with open(source_file) as f:
+            code = json.load(f)
+        # Mark as recently used
+        os.utime(source_file)
+        logger.info("Generated code found in source cache: {}".format(source_file))
+        return code["code_h"], code["code_c"]
+    except (FileNotFoundError, ValueError):
+        pass
+
+    # JIT parameters do not affect the generated code, so leave them out
+    # of the parameters listed in it
+    compiler_parameters = {k: v for k, v in parameters.items() if not k.startswith("jit_")}
+
+    if num_shards == 0:
+        code_h, code_c = ffcx.compiler.compile_ufl_objects(ufl_objects, prefix="JIT", parameters=compiler_parameters)
+    else:
+        code_h, code_c = ffcx.compiler.compile_ufl_objects_shards(
+            ufl_objects, prefix="JIT", parameters=compiler_parameters, num_shards=num_shards)
 
-        for name in cmap_names:
-            decl += cmap_template.format(name=name)
+    # Write to temporary file and rename, since the same code may be
+    # generated concurrently by another process
+    source_file.parent.mkdir(exist_ok=True)
+    tmp_source_file = source_file.with_suffix(".json.{}.{}.tmp".format(os.getpid(), threading.get_ident()))
+    with open(tmp_source_file, "w") as f:
+        json.dump({"code_h": code_h, "code_c": code_c}, f)
+    os.replace(tmp_source_file, source_file)
 
-        _compile_objects(decl, meshes, cmap_names, module_name, p, cache_dir,
-                         cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries)
-    except Exception:
-        # remove c file so that it will not timeout next time
-        c_filename = cache_dir.joinpath(module_name + ".c")
-        os.replace(c_filename, c_filename.with_suffix(".c.failed"))
+    return code_h, code_c
+
+
+def _compile_objects(ufc_decl, decl, ufl_objects, object_names, module_name, source_key, parameters, cache_dir,
+                     cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries):
+    """Generate code and compile the module into cache_dir, returning the time spent in each.
+
+    If code generation or compilation fails, the error is recorded in
+    <module_name>.failed, so that later attempts fail immediately.
+    """
+    t_start = time.time()
+    c_filename = cache_dir.joinpath(module_name + ".c")
+    try:
+        times, build_log = _build_objects(ufc_decl, decl, ufl_objects, module_name, source_key, parameters,
+                                          cache_dir, cffi_extra_compile_args, cffi_verbose, cffi_debug,
+                                          cffi_libraries)
+    except Exception as e:
+        # Keep failed C file for inspection
+        if c_filename.exists():
+            os.replace(c_filename, c_filename.with_suffix(".c.failed"))
+        c_filename.with_suffix(".failed").write_text("".join(traceback.format_exception_only(type(e), e)))
         raise
 
-    obj, module = _load_objects(cache_dir, module_name, cmap_names)
-    return obj, module
+    # Create a "status ready" file. If this fails, it is an error,
+    # because it should not exist yet.
+    # Copy the stdout verbose output of the build into the ready file
+    fd = open(c_filename.with_suffix(".c.cached"), "x")
+    fd.write(build_log)
+    fd.close()
 
+    # Forget a previous failure which has now been retried
+    with contextlib.suppress(FileNotFoundError):
+        c_filename.with_suffix(".failed").unlink()
 
-def _compile_objects(decl, ufl_objects, object_names, module_name, parameters, cache_dir,
-                     cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries):
+    # Index the new module and keep the cache within its size limits
+    cache.record(cache_dir, module_name, compile_time=time.time() - t_start)
+    cache.prune(cache_dir, max_bytes=parameters["jit_cache_max_bytes"],
+                max_entries=parameters["jit_cache_max_entries"], keep=(module_name,))
 
-    import ffcx.compiler
+    return times
 
-    _, code_body = ffcx.compiler.compile_ufl_objects(ufl_objects, prefix="JIT", parameters=parameters)
 
-    ffibuilder = cffi.FFI()
-    ffibuilder.set_source(module_name, code_body, include_dirs=[ffcx.codegeneration.get_include_path()],
-                          extra_compile_args=cffi_extra_compile_args, libraries=cffi_libraries)
-    ffibuilder.cdef(decl)
+def _build_objects(ufc_decl, decl, ufl_objects, module_name, source_key, parameters, cache_dir,
+                   cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries):
+    """Generate code and compile the module into cache_dir, returning the time spent in each and the build log."""
+    t_start = time.time()
+
+    num_shards = parameters["jit_shards"]
+    if num_shards == 0:
+        _, code_body = _generate_code(ufl_objects, source_key, parameters, cache_dir)
+    else:
+        code_h, code_shards = _generate_code(ufl_objects, source_key, parameters, cache_dir)
+        # The module itself only declares the UFC functions, which are
+        # defined in separately compiled shards
+        code_body = '#include "{}.h"\n'.format(module_name)
+    t_codegen = time.time() - t_start
 
     c_filename = cache_dir.joinpath(module_name + ".c")
-    ready_name = c_filename.with_suffix(".c.cached")
 
     # Compile (ensuring that compile dir exists)
     cache_dir.mkdir(exist_ok=True, parents=True)
@@ -290,24 +1204,358 @@ def _compile_objects(decl, ufl_objects, object_names, module_name, parameters, c
     logger.info(79 * "#")
 
     t0 = time.time()
-    f = io.StringIO()
-    with redirect_stdout(f):
-        ffibuilder.compile(tmpdir=cache_dir, verbose=True, debug=cffi_debug)
-    s = f.getvalue()
+    if num_shards == 0:
+        extra_objects = []
+        shards_log = ""
+    else:
+        cache_dir.joinpath(module_name + ".h").write_text(code_h)
+        extra_objects, shards_log = _compile_shards(code_shards, module_name, cache_dir, cffi_extra_compile_args,
+                                                    cffi_debug, parameters["jit_build_processes"])
+
+    if parameters["jit_abi_mode"]:
+        # Plain shared library with the UFC functions only, without the
+        # Python extension module glue
+        c_filename.write_text(code_body)
+        if num_shards == 0:
+            extra_objects, shards_log = _compile_shards([code_body], module_name, cache_dir, cffi_extra_compile_args,
+                                                        cffi_debug, 1)
+        s = shards_log + _link_library(extra_objects, cache_dir.joinpath(module_name + _SHLIB_SUFFIX),
+                                       cffi_libraries)
+    else:
+        s = shards_log + _build_extension(ufc_decl, decl, code_body, module_name, cache_dir, extra_objects,
+                                          cffi_extra_compile_args, cffi_debug, cffi_libraries)
     if (cffi_verbose):
         print(s)
 
     logger.info("JIT C compiler finished in {:.4f}".format(time.time() - t0))
 
-    # Create a "status ready" file. If this fails, it is an error,
-    # because it should not exist yet.
-    # Copy the stdout verbose output of the build into the ready file
-    fd = open(ready_name, "x")
-    fd.write(s)
-    fd.close()
+    return {"codegen_time": t_codegen, "compile_time": time.time() - t0}, s
+
+
+def _build_extension(ufc_decl, decl, code_body, module_name, cache_dir, extra_objects,
+                     cffi_extra_compile_args, cffi_debug, cffi_libraries):
+    """Build a Python extension module with cffi (API mode), returning the build output.
+
+    cffi only writes the C source of the module, which is then compiled
+    and linked by C compiler processes with absolute paths, like the
+    shards of sharded builds. The working directory, sys.stdout and
+    file descriptors of this process, which other threads use while the
+    module builds, are therefore left alone.
+
+    The UFC types are included from the module built by _ufc_module, so
+    that only the factory declarations (decl) are parsed.
+    """
+    import cffi
+    import cffi.recompiler
+
+    ffibuilder = cffi.FFI()
+    ffibuilder.include(_ufc_module(ufc_decl, cache_dir))
+    ffibuilder.cdef(decl)
+
+    try:
+        command = _c_compiler_command()
+    except RuntimeError:
+        ffibuilder.set_source(module_name, code_body, include_dirs=[ffcx.codegeneration.get_include_path(),
+                                                                    str(cache_dir)],
+                              extra_compile_args=cffi_extra_compile_args, libraries=cffi_libraries,
+                              extra_objects=extra_objects)
+        return _cffi_compile(ffibuilder, cache_dir, cffi_debug)
+
+    command += _python_include_args(cache_dir)
+    if cffi_debug:
+        command.append("-g")
+    command += cffi_extra_compile_args or []
 
+    c_filename = cache_dir.joinpath(module_name + ".c")
+    o_filename = cache_dir.joinpath(module_name + ".o")
+    cffi.recompiler.make_c_source(ffibuilder, module_name, code_body, str(c_filename))
+    output = _compile_c(command, c_filename, o_filename)
+    # Pass on compiler warnings
+    sys.stderr.write(output)
+    return (" ".join(command) + "\n" + output
+            + _link_library([str(o_filename)] + extra_objects, cache_dir.joinpath(module_name + _EXT_SUFFIX),
+                            cffi_libraries))
+
+
+def _python_include_args(cache_dir):
+    """Return the include options for compiling a Python extension module in cache_dir."""
+    python_paths = sysconfig.get_paths()
+    return ["-I" + path for path in (ffcx.codegeneration.get_include_path(), str(cache_dir),
+                                     python_paths["include"], python_paths["platinclude"])]
+
+
+@functools.lru_cache(maxsize=None)
+def _ufc_ffibuilder(ufc_decl):
+    """Return the name, C source and cffi builder of the module with the UFC types of ufc_decl.
+
+    Parsing the UFC declarations (with pycparser) is slow, so it is only
+    done once per process for each scalar type and kind of object.
+    """
+    import cffi
+
+    module_name = _UFC_MODULE_PREFIX + hashlib.sha1(
+        (ufc_decl + ffcx.codegeneration.get_signature()).encode("utf-8")).hexdigest()
+    # The first line of the declarations defines ufc_scalar_t, which
+    # must be defined before including ufc.h
+    source = ufc_decl.split("\n", 1)[0] + "\n#include <ufc.h>\n"
+    ffibuilder = cffi.FFI()
+    ffibuilder.cdef(ufc_decl)
+    ffibuilder.set_source(module_name, source, include_dirs=[ffcx.codegeneration.get_include_path()])
+    return module_name, source, ffibuilder
 
-def _load_objects(cache_dir, module_name, object_names):
+
+def _ufc_module(ufc_decl, cache_dir):
+    """Return the cffi builder with the UFC types of ufc_decl, for inclusion by modules built in API mode.
+
+    cffi imports the module of an included builder by name when an
+    including module is loaded, so the module is built in cache_dir
+    (if missing, for example in a directory filled from a store) and
+    imported here first.
+    """
+    import cffi.recompiler
+
+    module_name, source, ffibuilder = _ufc_ffibuilder(ufc_decl)
+    with _ufc_module_lock:
+        filename = cache_dir.joinpath(module_name + _EXT_SUFFIX)
+        if not filename.exists():
+            logger.info("Building JIT module {} with UFC types".format(module_name))
+            try:
+                command = _c_compiler_command()
+            except RuntimeError:
+                _cffi_compile(ffibuilder, cache_dir, False)
+            else:
+                # Other processes may build the same module concurrently
+                tmp_suffix = ".{}.{}.tmp".format(os.getpid(), threading.get_ident())
+                c_filename = cache_dir.joinpath(module_name + tmp_suffix + ".c")
+                o_filename = cache_dir.joinpath(module_name + tmp_suffix + ".o")
+                try:
+                    cffi.recompiler.make_c_source(ffibuilder, module_name, source, str(c_filename))
+                    _compile_c(command + _python_include_args(cache_dir), c_filename, o_filename)
+                    _link_library([str(o_filename)], filename, None)
+                finally:
+                    for path in (c_filename, o_filename):
+                        with contextlib.suppress(FileNotFoundError):
+                            path.unlink()
+
+        if module_name not in sys.modules:
+            spec = importlib.util.spec_from_file_location(module_name, str(filename))
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            sys.modules[module_name] = module
+    return ffibuilder
+
+
+def _cffi_compile(ffibuilder, cache_dir, cffi_debug):
+    """Compile a cffi extension module with the C compiler of cffi, returning the build output.
+
+    Only used without a Unix-style C compiler. cffi changes the working
+    directory of the process while it compiles, and its output is
+    captured by redirecting sys.stdout and file descriptor 2, which also
+    affects the other threads of the process.
+    """
+    import cffi
+
+    f = io.StringIO()
+    with tempfile.TemporaryFile(mode="w+") as stderr:
+        try:
+            with _cffi_compile_lock, redirect_stdout(f), _redirect_stderr_fd(stderr):
+                ffibuilder.compile(tmpdir=cache_dir, verbose=True, debug=cffi_debug)
+        except cffi.VerificationError as e:
+            stderr.seek(0)
+            raise cffi.VerificationError("{}\n{}".format(e, stderr.read())) from e
+        finally:
+            # Pass on compiler warnings
+            stderr.seek(0)
+            sys.stderr.write(stderr.read())
+    return f.getvalue()
+
+
+def _link_library(objects, filename, libraries):
+    """Link object files into a plain shared library, returning the linker output."""
+    import cffi
+
+    tmp_filename = filename.with_suffix(filename.suffix + ".{}.{}.tmp".format(os.getpid(), threading.get_ident()))
+    command = _c_linker_command() + objects + ["-l" + library for library in libraries or []]
+    result = subprocess.run(command + ["-o", str(tmp_filename)],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    if result.returncode != 0:
+        raise cffi.VerificationError("Linking of {} failed:\n{}".format(filename, result.stdout))
+    os.replace(tmp_filename, filename)
+    return " ".join(command) + "\n" + result.stdout
+
+
+@functools.lru_cache(maxsize=None)
+def _abi_ffi(ufc_decl):
+    """Return the FFI used to load all libraries with the same UFC declarations, and the C library."""
+    import cffi
+
+    ffi = cffi.FFI()
+    ffi.cdef(ufc_decl)
+    ffi.cdef("""void *dlopen(const char *filename, int flags);
+                void *dlsym(void *handle, const char *symbol);
+                char *dlerror(void);""")
+    return ffi, ffi.dlopen(None)
+
+
+class _Library:
+    """Shared library loaded in ABI mode, with the UFC factory functions as attributes.
+
+    Symbols are looked up with dlsym and cast to their type, so that
+    the declarations of each library need not be parsed.
+    """
+
+    def __init__(self, ffi, libc, filename, decl):
+        self._ffi = ffi
+        self._libc = libc
+        self._handle = libc.dlopen(str(filename).encode(), ffi.RTLD_NOW | ffi.RTLD_LOCAL)
+        if self._handle == ffi.NULL:
+            raise OSError(ffi.string(libc.dlerror()).decode())
+        self._types = {name: "{} *(*)(void)".format(type_name)
+                       for type_name, name in re.findall(r"(\w+)\s*\*\s*(create_\w+)\(void\);", decl)}
+        self.free = libc.free
+
+    def __getattr__(self, name):
+        if name not in self._types:
+            raise AttributeError(name)
+        function = self._ffi.cast(self._types[name], self._libc.dlsym(self._handle, name.encode()))
+        setattr(self, name, function)
+        return function
+
+
+def _load_library(cache_dir, module_name, object_names, ufc_decl, decl):
+    """Load a plain shared library in ABI mode.
+
+    Returns the compiled objects and a module with the attributes ffi
+    and lib, like a module built in API mode.
+    """
+    filename = cache_dir.joinpath(module_name + _SHLIB_SUFFIX)
+    if not filename.exists():
+        raise ModuleNotFoundError("Unable to find JIT library.")
+
+    ffi, libc = _abi_ffi(ufc_decl)
+    compiled_module = types.ModuleType(module_name)
+    compiled_module.__file__ = str(filename)
+    compiled_module.ffi = ffi
+    compiled_module.lib = _Library(ffi, libc, filename, decl)
+
+    # Objects are created on first access
+    compiled_objects = _CompiledObjects(compiled_module, object_names)
+
+    return compiled_objects, compiled_module
+
+
+@contextlib.contextmanager
+def _redirect_stderr_fd(f):
+    """Redirect file descriptor 2, which is inherited by the C compiler processes, to the file f."""
+    sys.stderr.flush()
+    saved_fd = os.dup(2)
+    try:
+        os.dup2(f.fileno(), 2)
+        yield
+    finally:
+        sys.stderr.flush()
+        os.dup2(saved_fd, 2)
+        os.close(saved_fd)
+
+
+def _unix_c_compiler():
+    from distutils.ccompiler import new_compiler
+    from distutils.sysconfig import customize_compiler
+
+    compiler = new_compiler()
+    customize_compiler(compiler)
+    if not hasattr(compiler, "compiler_so"):
+        raise RuntimeError("Sharded and ABI mode JIT builds are only supported with a Unix-style C compiler.")
+    return compiler
+
+
+def _c_compiler_command():
+    """Return the command used by Python to compile C extension sources."""
+    return list(_unix_c_compiler().compiler_so)
+
+
+def _c_linker_command():
+    """Return the command used by Python to link shared libraries."""
+    return list(_unix_c_compiler().linker_so)
+
+
+def _compile_c(command, c_filename, o_filename):
+    """Compile a C file into an object file with a C compiler command, returning the compiler output."""
+    import cffi
+
+    # Write to a temporary file and rename, since the same object may
+    # be compiled concurrently by another process
+    tmp_o_filename = o_filename.with_suffix(".o.{}.{}.tmp".format(os.getpid(), threading.get_ident()))
+    result = subprocess.run(command + ["-c", str(c_filename), "-o", str(tmp_o_filename)],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    if result.returncode != 0:
+        raise cffi.VerificationError("Compilation of {} failed:\n{}".format(c_filename, result.stdout))
+    os.replace(tmp_o_filename, o_filename)
+    return result.stdout
+
+
+def _compile_shards(code_shards, module_name, cache_dir, cffi_extra_compile_args, cffi_debug, num_processes):
+    """Compile C sources in parallel into object files.
+
+    Object files are stored in the objects subdirectory of the cache
+    directory, under a hash of the source, the compile command and the
+    UFC headers. A source which has been compiled before, for example a
+    kernel of an unchanged form, is therefore not compiled again. Since
+    kernel names contain the signature of their form (see
+    :func:`ffcx.naming.integral_name`), kernels are reused per form: a
+    kernel shared by two different forms is compiled for each of them.
+
+    Each source is compiled by a separate C compiler process, at most
+    num_processes (or the number of CPUs if zero) at a time. Returns the
+    object files and a log with the compile time of each source.
+    """
+    command = _c_compiler_command() + ["-I" + ffcx.codegeneration.get_include_path()]
+    if cffi_debug:
+        command.append("-g")
+    command += cffi_extra_compile_args or []
+
+    objects_dir = cache_dir.joinpath(cache.OBJECTS_DIR)
+    objects_dir.mkdir(exist_ok=True)
+
+    def compile_shard(code):
+        key = hashlib.sha1(";".join([code, " ".join(command), ffcx.codegeneration.get_signature()])
+                           .encode("utf-8")).hexdigest()
+        o_filename = objects_dir.joinpath(key + ".o")
+        try:
+            # Mark as recently used
+            os.utime(o_filename)
+            return o_filename, None, ""
+        except FileNotFoundError:
+            pass
+
+        # Write to a temporary file and rename, since the same source
+        # may be written concurrently by another process
+        c_filename = objects_dir.joinpath(key + ".c")
+        tmp_suffix = ".{}.{}.tmp".format(os.getpid(), threading.get_ident())
+        tmp_c_filename = c_filename.with_suffix(".c" + tmp_suffix)
+        tmp_c_filename.write_text(code)
+        os.replace(tmp_c_filename, c_filename)
+
+        t0 = time.time()
+        output = _compile_c(command, c_filename, o_filename)
+        return o_filename, time.time() - t0, output
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_processes or os.cpu_count()) as executor:
+        results = list(executor.map(compile_shard, code_shards))
+
+    log = ""
+    for i, (o_filename, shard_time, output) in enumerate(results):
+        if shard_time is None:
+            logger.info("JIT shard {} of {} found in object cache".format(i + 1, len(code_shards)))
+            log += "{}: cached\n".format(o_filename.name)
+        else:
+            logger.info("JIT shard {} of {} compiled in {:.4f}".format(i + 1, len(code_shards), shard_time))
+            log += "{}: {:.4f}s\n{}".format(o_filename.name, shard_time, output)
+
+    return [str(r[0]) for r in results], log
+
+
+def _load_objects(cache_dir, module_name, object_names, ufc_decl):
 
     # Create module finder that searches the compile path
     finder = importlib.machinery.FileFinder(
@@ -320,16 +1568,12 @@ def _load_objects(cache_dir, module_name, object_names):
     if spec is None:
         raise ModuleNotFoundError("Unable to find JIT module.")
 
-    # Load module
+    # Load module, after the module with the UFC types it includes
+    _ufc_module(ufc_decl, cache_dir)
     compiled_module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(compiled_module)
 
-    compiled_objects = []
-    for name in object_names:
-        # Call UFC factory to create object data struct (calls malloc)
-        obj = getattr(compiled_module.lib, "create_" + name)()
-
-        # Set garbage collector to use C free()
-        compiled_objects.append(compiled_module.ffi.gc(obj, compiled_module.lib.free))
+    # Objects are created on first access
+    compiled_objects = _CompiledObjects(compiled_module, object_names)
 
     return compiled_objects, compiled_module
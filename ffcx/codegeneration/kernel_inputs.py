@@ -0,0 +1,133 @@
+# Copyright (C) 2020 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Synthetic inputs of tabulate_tensor kernels, for timing compiled forms.
+
+The arrays passed to a kernel are sized from the intermediate
+representation of its integral, so that a kernel only reads and writes
+within them. Used by :mod:`ffcx.codegeneration.autotune` and
+:mod:`ffcx.benchmark`.
+"""
+
+# NumPy types of the scalar types of generated code
+NUMPY_TYPES = {"double": "float64", "float": "float32", "long double": "longdouble",
+               "double complex": "complex128", "float complex": "complex64"}
+
+# Integral types with tabulate_tensor kernels taking cell geometry
+INTEGRAL_TYPES = ("cell", "exterior_facet", "interior_facet")
+
+# Number of quadrature permutations of the facets of a cell
+_num_quadrature_permutations = {"interval": 1, "triangle": 2, "quadrilateral": 2, "tetrahedron": 6,
+                                "hexahedron": 8}
+
+# Number of faces, rotations of a face and edges of a cell, encoded in
+# the cell permutation
+_cell_entities = {"interval": (0, 0, 0), "triangle": (0, 0, 3), "quadrilateral": (0, 0, 4),
+                  "tetrahedron": (4, 3, 6), "hexahedron": (6, 4, 12)}
+
+# Alignment (in bytes) of the kernel arguments for each cell
+ALIGNMENT = 64
+
+
+def compute_form_ir(form, parameters):
+    """Return the intermediate representation of a UFL form, as compiled with parameters."""
+    from ffcx.analysis import analyze_ufl_objects
+    from ffcx.ir.representation import compute_ir
+
+    return compute_ir(analyze_ufl_objects([form], parameters), {}, "inputs", parameters, False)
+
+
+def integrals(ir):
+    """Return the IR of the integrals with tabulate_tensor kernels, and the subdomain id of each."""
+    return [(integral_ir, -1 if integral_ir.subdomain_id == "otherwise" else integral_ir.subdomain_id)
+            for integral_ir in ir.integrals if integral_ir.integral_type in INTEGRAL_TYPES]
+
+
+def create_integral(compiled_form, integral_ir, subdomain_id):
+    """Create the compiled integral of a compiled form, for the IR of the integral."""
+    return getattr(compiled_form, "create_{}_integral".format(integral_ir.integral_type))(subdomain_id)
+
+
+def aligned_array(shape, dtype):
+    """Return an uninitialised array aligned to ALIGNMENT bytes."""
+    import numpy
+
+    dtype = numpy.dtype(dtype)
+    size = int(numpy.prod(shape)) * dtype.itemsize
+    buffer = numpy.empty(size + ALIGNMENT, dtype=numpy.uint8)
+    offset = -buffer.ctypes.data % ALIGNMENT
+    return buffer[offset:offset + size].view(dtype).reshape(shape)
+
+
+def _padded(size, dtype):
+    """Return size rounded up so that arrays of size items of dtype keep the alignment."""
+    import numpy
+
+    items = ALIGNMENT // numpy.dtype(dtype).itemsize
+    return max(-(-size // items) * items, items)
+
+
+def kernel_inputs(ir, integral_ir, scalar_type, num_cells, rng):
+    """Return synthetic inputs of an integral kernel for num_cells cells.
+
+    Returns
+    -------
+    Arrays A (element tensor), w (coefficients, per cell), c
+    (constants), coordinate_dofs (per cell), entity_local_index and
+    quadrature_permutation (two per cell) and cell_permutation (one per
+    cell). The arrays of each cell are aligned to ALIGNMENT bytes.
+
+    """
+    import numpy
+
+    np_type = getattr(numpy, NUMPY_TYPES[scalar_type])
+    num_restrictions = 2 if integral_ir.integral_type == "interior_facet" else 1
+
+    # Coefficient values and constants, sized as the kernel reads them
+    w_size = max((offset + num_restrictions * integral_ir.element_dimensions[coefficient.ufl_element()]
+                  for coefficient, offset in integral_ir.coefficient_offsets.items()), default=0)
+    c_size = max((offset + int(numpy.prod(constant.ufl_shape, dtype=int))
+                  for constant, offset in integral_ir.original_constant_offsets.items()), default=0)
+    A = aligned_array(_padded(int(numpy.prod(integral_ir.tensor_shape, dtype=int)), np_type), np_type)
+    A[:] = 0
+    w = aligned_array((num_cells, _padded(w_size, np_type)), np_type)
+    w[:] = rng.random_sample(w.shape)
+    c = aligned_array(_padded(c_size, np_type), np_type)
+    c[:] = rng.random_sample(c.shape)
+
+    # Cells are random perturbations of the reference cell, embedded in
+    # the geometric dimension
+    cmap_ir = ir.coordinate_mappings[0]
+    gdim = cmap_ir.geometric_dimension
+    element_ir = next(e for e in ir.elements if e.name == cmap_ir.coordinate_finite_element_classname)
+    X = numpy.zeros((cmap_ir.num_scalar_coordinate_element_dofs, gdim))
+    if element_ir.tabulate_dof_coordinates:
+        points = numpy.array(element_ir.tabulate_dof_coordinates.points)
+        X[:, :points.shape[1]] = points
+    else:
+        X[:] = rng.random_sample(X.shape)
+    coordinate_dofs = aligned_array((num_cells, _padded(num_restrictions * X.size, numpy.float64)), numpy.float64)
+    for cell in range(num_cells):
+        x = [X.dot(numpy.eye(gdim) + 0.2 * (rng.random_sample((gdim, gdim)) - 0.5)) + rng.random_sample(gdim)
+             for r in range(num_restrictions)]
+        coordinate_dofs[cell, :num_restrictions * X.size] = numpy.concatenate(x, axis=None)
+
+    # Facets of each cell, and the permutations of the facets and entities
+    entity_local_index = rng.randint(integral_ir.num_facets, size=(num_cells, 2)).astype(numpy.intc)
+    quadrature_permutation = numpy.zeros((num_cells, 2), dtype=numpy.uint8)
+    if integral_ir.integral_type == "interior_facet":
+        quadrature_permutation[:] = rng.randint(_num_quadrature_permutations[integral_ir.cell_shape],
+                                                size=(num_cells, 2))
+    cell_permutation = numpy.zeros(num_cells, dtype=numpy.uint32)
+    if integral_ir.needs_permutation_data:
+        num_faces, num_face_rotations, num_edges = _cell_entities[integral_ir.cell_shape]
+        for i in range(num_faces):
+            face = 2 * rng.randint(num_face_rotations, size=num_cells) + rng.randint(2, size=num_cells)
+            cell_permutation |= face.astype(numpy.uint32) << numpy.uint32(3 * i)
+        for i in range(num_edges):
+            cell_permutation |= rng.randint(2, size=num_cells).astype(numpy.uint32) << numpy.uint32(
+                3 * num_faces + i)
+
+    return A, w, c, coordinate_dofs, entity_local_index, quadrature_permutation, cell_permutation
@@ -0,0 +1,136 @@
+# Copyright (C) 2020 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Single-file stores of compiled JIT modules.
+
+On parallel filesystems, every JIT cache lookup in a cache directory
+costs several metadata operations (lock files, existence checks,
+directory scans), which do not scale to thousands of processes starting
+at once. A store keeps the compiled libraries of all modules as blobs
+in a single file in the cache directory instead. Each node compiles and
+loads modules in a node-local directory, and only reads a module from
+the store (or adds a newly compiled one) when it is missing there.
+
+Stores are selected by name with the parameter ``jit_cache_store``, see
+:data:`STORES`.
+"""
+
+import contextlib
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+
+class SQLiteStore:
+    """Store of compiled modules in a SQLite database.
+
+    Each module is a set of named files (the compiled library and the
+    build log), which are written in one transaction. Readers open the
+    database read-only, so a lookup is a single open of the file.
+    """
+
+    filename = "ffcx_store.sqlite"
+
+    def __init__(self, cache_dir, timeout=10):
+        self.path = Path(cache_dir).absolute().joinpath(self.filename)
+        self.timeout = timeout
+
+    def _connect(self, readonly):
+        import sqlite3
+
+        if readonly:
+            return sqlite3.connect("file:{}?mode=ro".format(self.path), uri=True, timeout=self.timeout)
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        connection = sqlite3.connect(str(self.path), timeout=self.timeout)
+        connection.execute("""CREATE TABLE IF NOT EXISTS artifacts (
+                                module TEXT NOT NULL, filename TEXT NOT NULL, data BLOB NOT NULL,
+                                compile_time REAL, created REAL NOT NULL,
+                                PRIMARY KEY (module, filename))""")
+        return connection
+
+    def get(self, module_name):
+        """Return the files of a module as a dict {filename: bytes}, or None if not in the store."""
+        import sqlite3
+
+        try:
+            with contextlib.closing(self._connect(readonly=True)) as connection:
+                rows = connection.execute("SELECT filename, data FROM artifacts WHERE module = ?",
+                                          (module_name,)).fetchall()
+        except sqlite3.OperationalError:
+            # Store does not exist (yet)
+            return None
+        return {filename: bytes(data) for filename, data in rows} or None
+
+    def put(self, module_name, files, compile_time=None):
+        """Add the files {filename: bytes} of a module, unless it was added meanwhile by another process."""
+        with contextlib.closing(self._connect(readonly=False)) as connection, connection:
+            now = time.time()
+            connection.executemany(
+                "INSERT OR IGNORE INTO artifacts VALUES (?, ?, ?, ?, ?)",
+                [(module_name, filename, data, compile_time, now) for filename, data in files.items()])
+
+    def remove(self, module_names):
+        """Remove modules from the store."""
+        if not self.path.exists():
+            return
+        with contextlib.closing(self._connect(readonly=False)) as connection, connection:
+            connection.executemany("DELETE FROM artifacts WHERE module = ?", [(name,) for name in module_names])
+
+    def entries(self):
+        """Return the modules in the store as a dict {module_name: {"size", "compile_time", "created"}}."""
+        import sqlite3
+
+        try:
+            with contextlib.closing(self._connect(readonly=True)) as connection:
+                rows = connection.execute("""SELECT module, SUM(LENGTH(data)), MAX(compile_time), MIN(created)
+                                             FROM artifacts GROUP BY module""").fetchall()
+        except sqlite3.OperationalError:
+            return {}
+        return {module: {"size": size, "compile_time": compile_time, "created": created}
+                for module, size, compile_time, created in rows}
+
+    def local_dir(self, local_root=None):
+        """Return the node-local directory into which modules of this store are extracted.
+
+        The directory is specific to the store, so that several stores
+        can share the same local root.
+        """
+        if not local_root:
+            local_root = tempfile.gettempdir()
+        key = hashlib.sha1(str(self.path).encode("utf-8")).hexdigest()[:16]
+        return Path(local_root).absolute().joinpath("ffcx-store-" + key)
+
+
+# Available stores, by name of the jit_cache_store parameter
+STORES = {"sqlite": SQLiteStore}
+
+
+def get_store(name, cache_dir, timeout=10):
+    """Return the store with the given name for a cache directory."""
+    try:
+        return STORES[name](cache_dir, timeout=timeout)
+    except KeyError:
+        raise ValueError("Unknown JIT cache store '{}'. Available stores: {}.".format(
+            name, ", ".join(sorted(STORES))))
+
+
+def extract(files, directory):
+    """Write the files {filename: bytes} of a module into directory.
+
+    Each file is written to a temporary file and renamed, so that other
+    processes never see partially written files. Files are written in
+    the given order, so the build log (marking the module as ready)
+    should be last.
+    """
+    directory.mkdir(exist_ok=True, parents=True)
+    tmp_suffix = ".{}.{}.tmp".format(os.getpid(), threading.get_ident())
+    for filename, data in files.items():
+        path = directory.joinpath(filename)
+        tmp_path = path.with_name(filename + tmp_suffix)
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
@@ -68,9 +68,10 @@ import os
 import typing
 from time import time
 
+from ffcx import tracing
 from ffcx.analysis import analyze_ufl_objects
 from ffcx.codegeneration.codegeneration import generate_code
-from ffcx.formatting import format_code
+from ffcx.formatting import format_code, format_code_shards
 from ffcx.ir.representation import compute_ir
 
 logger = logging.getLogger("ffcx")
@@ -94,27 +95,61 @@ def compile_ufl_objects(ufl_objects: typing.Union[typing.List, typing.Tuple],
         Objects to be compiled. Accepts elements, forms, integrals or coordinate mappings.
 
     """
+    code = _generate_code(ufl_objects, object_names, prefix, parameters, visualise)
+
+    # Stage 4: format code
+    cpu_time = time()
+    with tracing.span("stage", "formatting"):
+        code_h, code_c = format_code(code, parameters)
+    _print_timing(4, time() - cpu_time)
+
+    return code_h, code_c
+
+
+def compile_ufl_objects_shards(ufl_objects: typing.Union[typing.List, typing.Tuple],
+                               object_names: typing.Dict = {},
+                               prefix: str = None,
+                               parameters: typing.Dict = None,
+                               num_shards: int = -1):
+    """Generate UFC code for given UFL objects, split into several source files.
+
+    The source files can be compiled independently and linked together,
+    see :func:`ffcx.formatting.format_code_shards`. Returns the header
+    and a list of sources.
+
+    """
+    code = _generate_code(ufl_objects, object_names, prefix, parameters, False)
+
+    # Stage 4: format code
+    cpu_time = time()
+    with tracing.span("stage", "formatting"):
+        code_h, code_c_shards = format_code_shards(code, parameters, num_shards)
+    _print_timing(4, time() - cpu_time)
+
+    return code_h, code_c_shards
+
+
+def _generate_code(ufl_objects, object_names, prefix, parameters, visualise):
+    """Run compiler stages 1-3."""
     if prefix != os.path.basename(prefix):
         raise RuntimeError("Invalid prefix, looks like a full path? prefix='{}'.".format(prefix))
 
     # Stage 1: analysis
     cpu_time = time()
-    analysis = analyze_ufl_objects(ufl_objects, parameters)
+    with tracing.span("stage", "analysis"):
+        analysis = analyze_ufl_objects(ufl_objects, parameters)
     _print_timing(1, time() - cpu_time)
 
     # Stage 2: intermediate representation
     cpu_time = time()
-    ir = compute_ir(analysis, object_names, prefix, parameters, visualise)
+    with tracing.span("stage", "ir"):
+        ir = compute_ir(analysis, object_names, prefix, parameters, visualise)
     _print_timing(2, time() - cpu_time)
 
     # Stage 3: code generation
     cpu_time = time()
-    code = generate_code(ir, parameters)
+    with tracing.span("stage", "codegen"):
+        code = generate_code(ir, parameters)
     _print_timing(3, time() - cpu_time)
 
-    # Stage 4: format code
-    cpu_time = time()
-    code_h, code_c = format_code(code, parameters)
-    _print_timing(4, time() - cpu_time)
-
-    return code_h, code_c
+    return code
@@ -21,6 +21,7 @@ from collections import namedtuple
 
 from ffcx import __version__ as FFCX_VERSION
 from ffcx.codegeneration import __version__ as UFC_VERSION
+from ffcx.parameters import code_parameters
 
 logger = logging.getLogger("ffcx")
 
@@ -66,23 +67,7 @@ def format_code(code: namedtuple, parameters):
     logger.info("Compiler stage 5: Formatting code")
     logger.info(79 * "*")
 
-    # Generate code for comment at top of file
-    code_h_pre = _generate_comment(parameters) + "\n"
-    code_c_pre = _generate_comment(parameters) + "\n"
-
-    # Generate code for header
-    code_h_pre += FORMAT_TEMPLATE["header_h"]
-    code_c_pre += FORMAT_TEMPLATE["header_c"]
-
-    # Define ufc_scalar before including ufc.h
-    scalar_type = _define_scalar(parameters)
-    code_h_pre += scalar_type
-    code_c_pre += scalar_type
-
-    # Generate includes and add to preamble
-    includes_h, includes_c = _generate_includes(parameters)
-    code_h_pre += includes_h
-    code_c_pre += includes_c
+    code_h_pre, code_c_pre = _generate_preamble(parameters)
 
     # Enclose header with 'extern "C"'
     code_h_pre += c_extern_pre
@@ -102,6 +87,54 @@ def format_code(code: namedtuple, parameters):
     return code_h, code_c
 
 
+def format_code_shards(code: namedtuple, parameters, num_shards=-1):
+    """Format given code in UFC format, with the source split into several files.
+
+    Integral and expression kernels dominate the C compile time. With
+    num_shards < 0, each kernel goes in a file of its own and all other
+    objects share one file. Otherwise, objects are distributed over at
+    most num_shards files of approximately equal size. Files with other
+    objects than kernels declare all UFC functions, so the files can be
+    compiled separately and linked together. Kernels do not refer to
+    other UFC functions, so the source of a kernel only file depends on
+    the kernels alone.
+
+    Returns a string with header file contents and a list of strings
+    with the contents of each source file.
+    """
+
+    code_h, _ = format_code(code, parameters)
+    _, code_c_pre = _generate_preamble(parameters)
+
+    declarations = "".join(c[0] for parts_code in code for c in parts_code)
+
+    kernels = [c[1] for c in code.integrals] + [c[1] for c in code.expressions]
+    others = "".join(c[1] for name, parts_code in zip(code._fields, code)
+                     if name not in ("integrals", "expressions") for c in parts_code)
+
+    # Shards as lists of (code, is_kernel)
+    blocks = [(others, False)] + [(kernel, True) for kernel in kernels]
+    if num_shards < 0:
+        shards = [[block] for block in blocks]
+    else:
+        # Greedily place largest blocks first in the smallest shard
+        shards = [[] for i in range(max(num_shards, 1))]
+        for block in sorted(blocks, key=lambda block: len(block[0]), reverse=True):
+            min(shards, key=lambda shard: sum(len(b[0]) for b in shard)).append(block)
+
+    code_c_shards = []
+    for shard in shards:
+        body = "".join(b[0] for b in shard)
+        if not body:
+            continue
+        if all(is_kernel for _, is_kernel in shard):
+            code_c_shards.append(code_c_pre + body)
+        else:
+            code_c_shards.append(code_c_pre + declarations + body)
+
+    return code_h, code_c_shards
+
+
 def write_code(code_h, code_c, prefix, output_dir):
     _write_file(code_h, prefix, ".h", output_dir)
     _write_file(code_c, prefix, ".c", output_dir)
@@ -114,6 +147,30 @@ def _write_file(output, prefix, postfix, output_dir):
         hfile.write(output)
 
 
+def _generate_preamble(parameters):
+    """Generate the common beginning of header and source files."""
+
+    # Generate code for comment at top of file
+    code_h_pre = _generate_comment(parameters) + "\n"
+    code_c_pre = _generate_comment(parameters) + "\n"
+
+    # Generate code for header
+    code_h_pre += FORMAT_TEMPLATE["header_h"]
+    code_c_pre += FORMAT_TEMPLATE["header_c"]
+
+    # Define ufc_scalar before including ufc.h
+    scalar_type = _define_scalar(parameters)
+    code_h_pre += scalar_type
+    code_c_pre += scalar_type
+
+    # Generate includes and add to preamble
+    includes_h, includes_c = _generate_includes(parameters)
+    code_h_pre += includes_h
+    code_c_pre += includes_c
+
+    return code_h_pre, code_c_pre
+
+
 def _generate_comment(parameters):
     """Generate code for comment on top of file."""
 
@@ -124,7 +181,7 @@ def _generate_comment(parameters):
     comment += "//\n"
     comment += "// This code was generated with the following parameters:\n"
     comment += "//\n"
-    comment += textwrap.indent(pprint.pformat(parameters), "//  ")
+    comment += textwrap.indent(pprint.pformat(code_parameters(parameters)), "//  ")
     comment += "\n"
 
     return comment
@@ -25,7 +25,7 @@ import numpy
 
 import FIAT
 import ufl
-from ffcx import naming
+from ffcx import naming, parallel, tracing
 from ffcx.fiatinterface import SpaceOfReals, create_element
 from ffcx.ir import dof_permutations
 from ffcx.ir.integral import compute_integral_ir
@@ -122,35 +122,41 @@ def compute_ir(analysis: namedtuple, object_names, prefix, parameters, visualise
             integral_names[(fd_index, itg_index)] = naming.integral_name(itg_data.integral_type, fd.original_form,
                                                                          fd_index, itg_data.subdomain_id)
 
-    ir_elements = [
-        _compute_element_ir(e, analysis.element_numbers, finite_element_names, parameters["epsilon"])
-        for e in analysis.unique_elements
-    ]
-
-    ir_dofmaps = [
-        _compute_dofmap_ir(e, analysis.element_numbers, dofmap_names) for e in analysis.unique_elements
-    ]
-
-    ir_coordinate_mappings = [
-        _compute_coordinate_mapping_ir(e, prefix, analysis.element_numbers,
-                                       coordinate_mapping_names, dofmap_names, finite_element_names)
-        for e in analysis.unique_coordinate_elements
-    ]
-
-    irs = [
-        _compute_integral_ir(fd, i, prefix, analysis.element_numbers, integral_names, parameters, visualise)
-        for (i, fd) in enumerate(analysis.form_data)
-    ]
-    ir_integrals = list(itertools.chain(*irs))
-
-    ir_forms = [
-        _compute_form_ir(fd, i, prefix, analysis.element_numbers, finite_element_names,
-                         dofmap_names, coordinate_mapping_names, object_names)
-        for (i, fd) in enumerate(analysis.form_data)
-    ]
-
-    ir_expressions = [_compute_expression_ir(expr, i, prefix, analysis, parameters, visualise)
-                      for i, expr in enumerate(analysis.expressions)]
+    ir_elements = []
+    for e in analysis.unique_elements:
+        with tracing.span("ir", finite_element_names[e], kind="element"):
+            ir_elements.append(_compute_element_ir(e, analysis.element_numbers, finite_element_names,
+                                                   parameters["epsilon"]))
+
+    ir_dofmaps = []
+    for e in analysis.unique_elements:
+        with tracing.span("ir", dofmap_names[e], kind="dofmap"):
+            ir_dofmaps.append(_compute_dofmap_ir(e, analysis.element_numbers, dofmap_names))
+
+    ir_coordinate_mappings = []
+    for e in analysis.unique_coordinate_elements:
+        with tracing.span("ir", coordinate_mapping_names[e], kind="coordinate_mapping"):
+            ir_coordinate_mappings.append(_compute_coordinate_mapping_ir(
+                e, prefix, analysis.element_numbers, coordinate_mapping_names, dofmap_names, finite_element_names))
+
+    # The IR of integrands and expressions, which dominates, is computed
+    # in parallel processes with the parameter parallel_ir
+    integral_irs = itertools.chain(*(_compute_integral_ir(fd, i, analysis.element_numbers, integral_names)
+                                     for (i, fd) in enumerate(analysis.form_data)))
+    tasks = [(_compute_integrand_ir, (ir, cell, integrands, parameters, visualise))
+             for ir, cell, integrands in integral_irs]
+    num_integrals = len(tasks)
+    tasks += [(_compute_traced_expression_ir, (expr, i, prefix, analysis, parameters, visualise))
+              for i, expr in enumerate(analysis.expressions)]
+    irs = parallel.map_tasks(tasks, parameters["parallel_ir"])
+    ir_integrals = irs[:num_integrals]
+    ir_expressions = irs[num_integrals:]
+
+    ir_forms = []
+    for (i, fd) in enumerate(analysis.form_data):
+        with tracing.span("ir", "form_{}".format(i), kind="form"):
+            ir_forms.append(_compute_form_ir(fd, i, prefix, analysis.element_numbers, finite_element_names,
+                                             dofmap_names, coordinate_mapping_names, object_names))
 
     return ir_data(elements=ir_elements, dofmaps=ir_dofmaps,
                    coordinate_mappings=ir_coordinate_mappings,
@@ -372,9 +378,12 @@ def _num_global_support_dofs(fiat_element):
     return num_reals
 
 
-def _compute_integral_ir(form_data, form_index, prefix, element_numbers, integral_names,
-                         parameters, visualise):
-    """Compute intermediate represention for form integrals."""
+def _compute_integral_ir(form_data, form_index, element_numbers, integral_names):
+    """Compute intermediate represention for form integrals, except for the integrands.
+
+    Returns a list of (ir, cell, integrands) for each integral, to be
+    completed by _compute_integrand_ir.
+    """
 
     _entity_types = {
         "cell": "cell",
@@ -529,21 +538,26 @@ def _compute_integral_ir(form_data, form_index, prefix, element_numbers, integra
         # Create map from number of quadrature points -> integrand
         integrands = {rule: integral.integrand() for rule, integral in sorted_integrals.items()}
 
-        # Build more specific intermediate representation
-        integral_ir = compute_integral_ir(itg_data.domain.ufl_cell(), itg_data.integral_type,
-                                          ir["entitytype"], integrands, ir["tensor_shape"],
-                                          parameters, visualise)
-
-        ir.update(integral_ir)
-
         # Fetch name
         ir["name"] = integral_names[(form_index, itg_data_index)]
 
-        irs.append(ir_integral(**ir))
+        irs.append((ir, itg_data.domain.ufl_cell(), integrands))
 
     return irs
 
 
+def _compute_integrand_ir(ir, cell, integrands, parameters, visualise):
+    """Complete intermediate representation of integral with the representation of its integrands."""
+    with tracing.span("ir", ir["name"], kind="integral"):
+        # Build more specific intermediate representation
+        integral_ir = compute_integral_ir(cell, ir["integral_type"], ir["entitytype"], integrands,
+                                          ir["tensor_shape"], parameters, visualise)
+
+    ir.update(integral_ir)
+
+    return ir_integral(**ir)
+
+
 def _compute_form_ir(form_data, form_id, prefix, element_numbers, finite_element_names,
                      dofmap_names, coordinate_mapping_names, object_names):
     """Compute intermediate representation of form."""
@@ -607,6 +621,11 @@ def _compute_form_ir(form_data, form_id, prefix, element_numbers, finite_element
     return ir_form(**ir)
 
 
+def _compute_traced_expression_ir(expression, index, prefix, analysis, parameters, visualise):
+    with tracing.span("ir", "expression_{}".format(index), kind="expression"):
+        return _compute_expression_ir(expression, index, prefix, analysis, parameters, visualise)
+
+
 def _compute_expression_ir(expression, index, prefix, analysis, parameters, visualise):
 
     logger.info("Computing IR for expression {}".format(index))
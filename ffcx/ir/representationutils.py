@@ -25,8 +25,10 @@ class QuadratureRule:
 
     def __hash__(self):
         if self._hash is None:
-            self.hash_obj = hashlib.sha1(self.points)
-            self._hash = int(self.hash_obj.hexdigest(), 32)
+            # Keep the digest rather than the hash object, which cannot
+            # be pickled
+            self.hexdigest = hashlib.sha1(self.points).hexdigest()
+            self._hash = int(self.hexdigest, 32)
         return self._hash
 
     def __eq__(self, other):
@@ -41,7 +43,7 @@ class QuadratureRule:
         in generated code.
 
         """
-        return self.hash_obj.hexdigest()[-3:]
+        return self.hexdigest[-3:]
 
 
 def create_quadrature_points_and_weights(integral_type, cell, degree, rule):
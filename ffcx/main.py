@@ -9,26 +9,52 @@ Parse command-line arguments and generate code from input UFL form files.
 """
 
 import argparse
+import concurrent.futures
+import contextlib
 import cProfile
+import datetime
+import functools
+import json
 import logging
 import pathlib
 import re
+import shlex
 import string
+import sys
+import tempfile
+import time
 
-import ufl
-from ffcx import __version__ as FFCX_VERSION
-from ffcx import compiler, formatting
+import ffcx
+from ffcx.benchmark import VARIANTS as benchmark_variants
+from ffcx.codegeneration import cache, jit
 from ffcx.parameters import FFCX_DEFAULT_PARAMETERS, get_parameters
 
 logger = logging.getLogger("ffcx")
 
+
+class VersionAction(argparse.Action):
+    """Print the version and exit, looking up the version of the installed package only when requested."""
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS,
+                 help="show program's version number and exit"):
+        super().__init__(option_strings=option_strings, dest=dest, default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        sys.stdout.write("{} (version {})\n".format(parser.prog, ffcx.__version__))
+        parser.exit()
+
+
 parser = argparse.ArgumentParser(
     description="FEniCS Form Compiler (FFCX, https://fenicsproject.org)")
 parser.add_argument(
-    "--version", action='version', version="%(prog)s " + ("(version {})".format(FFCX_VERSION)))
+    "--version", action=VersionAction)
 parser.add_argument("-o", "--output-directory", type=str, default=".", help="output directory")
 parser.add_argument("--visualise", action="store_true", help="visualise the IR graph")
 parser.add_argument("-p", "--profile", action='store_true', help="enable profiling")
+parser.add_argument("--trace", type=str, metavar="FILE",
+                    help="write a trace of the compiler stages per compiled object (Chrome trace format) to FILE")
+parser.add_argument("--server", action='store_true',
+                    help="compile on a running compile server ('ffcx serve') of the same version, if any")
 
 # Add all parameters from FFC parameter system
 for param_name, (param_val, param_desc) in FFCX_DEFAULT_PARAMETERS.items():
@@ -37,50 +63,383 @@ for param_name, (param_val, param_desc) in FFCX_DEFAULT_PARAMETERS.items():
 
 parser.add_argument("ufl_file", nargs='+', help="UFL file(s) to be compiled")
 
+cache_parser = argparse.ArgumentParser(
+    prog="ffcx cache", description="Inspect and manage a FFCX JIT cache directory")
+cache_subparsers = cache_parser.add_subparsers(dest="command")
+cache_subparsers.required = True
+for command, command_help in (("list", "list cached modules, least recently used first"),
+                              ("prune", "evict least recently used modules to fit within limits"),
+                              ("clear", "remove all cached modules"),
+                              ("stats", "print summary statistics")):
+    subparser = cache_subparsers.add_parser(command, help=command_help)
+    subparser.add_argument("cache_dir", type=str, help="JIT cache directory")
+    if command == "prune":
+        subparser.add_argument("--max-bytes", type=int, default=None,
+                               help="maximum total size in bytes (default=jit_cache_max_bytes parameter)")
+        subparser.add_argument("--max-entries", type=int, default=None,
+                               help="maximum number of modules (default=jit_cache_max_entries parameter)")
+
+precompile_parser = argparse.ArgumentParser(
+    prog="ffcx precompile", description="Compile the forms in UFL files into a FFCX JIT cache directory")
+precompile_parser.add_argument("--cache-dir", type=str, required=True, help="JIT cache directory")
+precompile_parser.add_argument("-j", "--jobs", type=int, default=None,
+                               help="number of worker processes (default=number of CPUs)")
+precompile_parser.add_argument("--cffi-extra-compile-args", type=str, default=None,
+                               help="extra C compiler arguments, as passed to the JIT at runtime")
+for param_name, (param_val, param_desc) in FFCX_DEFAULT_PARAMETERS.items():
+    precompile_parser.add_argument("--{}".format(param_name),
+                                   type=type(param_val), help="{} (default={})".format(param_desc, param_val))
+precompile_parser.add_argument("path", nargs='+', help="UFL file(s), or directories searched for UFL files")
+
+bench_parser = argparse.ArgumentParser(prog="ffcx bench", description="Benchmark FFCX on UFL files")
+bench_subparsers = bench_parser.add_subparsers(dest="command")
+bench_subparsers.required = True
+bench_compile_parser = bench_subparsers.add_parser(
+    "compile", help="measure compile time, peak memory and generated code size for parameter variants")
+bench_compile_parser.add_argument("--variant", action="append", default=None, choices=list(benchmark_variants),
+                                  help="parameter variant (default=all, may be repeated)")
+bench_compile_parser.add_argument("-r", "--repeat", type=int, default=3,
+                                  help="number of timed compilations of each file and variant (default=3)")
+bench_compile_parser.add_argument("-o", "--output", type=str, default=None, help="write results to a JSON file")
+bench_compile_parser.add_argument("--compare", type=str, default=None,
+                                  help="JSON results to compare with, failing on regressions")
+bench_compile_parser.add_argument("--threshold", type=float, default=1.1,
+                                  help="factor by which a measurement may exceed the compared results (default=1.1)")
+for param_name, (param_val, param_desc) in FFCX_DEFAULT_PARAMETERS.items():
+    bench_compile_parser.add_argument("--{}".format(param_name),
+                                      type=type(param_val), help="{} (default={})".format(param_desc, param_val))
+bench_compile_parser.add_argument("path", nargs='+', help="UFL file(s), or directories searched for UFL files")
+bench_kernels_parser = bench_subparsers.add_parser(
+    "kernels", help="measure the throughput of the tabulate_tensor kernels of JIT compiled forms")
+bench_kernels_parser.add_argument("--cache-dir", type=str, default=None,
+                                  help="JIT cache directory (default=a temporary directory)")
+bench_kernels_parser.add_argument("--cffi-extra-compile-args", type=str, default=None,
+                                  help="extra C compiler arguments, as passed to the JIT at runtime")
+bench_kernels_parser.add_argument("-n", "--num-cells", type=int, default=1024,
+                                  help="number of synthetic cells each kernel is called for (default=1024)")
+bench_kernels_parser.add_argument("--min-time", type=float, default=0.2,
+                                  help="minimum time (in seconds) of each timed loop over all cells (default=0.2)")
+bench_kernels_parser.add_argument("-r", "--repeat", type=int, default=3,
+                                  help="number of timed loops, of which the fastest is taken (default=3)")
+bench_kernels_parser.add_argument("-o", "--output", type=str, default=None, help="write results to a JSON file")
+for param_name, (param_val, param_desc) in FFCX_DEFAULT_PARAMETERS.items():
+    bench_kernels_parser.add_argument("--{}".format(param_name),
+                                      type=type(param_val), help="{} (default={})".format(param_desc, param_val))
+bench_kernels_parser.add_argument("path", nargs='+', help="UFL file(s), or directories searched for UFL files")
+
+serve_parser = argparse.ArgumentParser(
+    prog="ffcx serve", description="Run a compile server, which keeps UFL, FIAT and compiler caches warm between"
+    " requests from 'ffcx' invocations and JIT clients")
+serve_parser.add_argument("--socket", type=str, default=None,
+                          help="Unix socket path (default=$FFCX_SERVER_SOCKET, or ffcx.sock in $XDG_RUNTIME_DIR or"
+                          " in a private ffcx-<uid> directory in the temporary directory)")
+serve_parser.add_argument("--stop", action="store_true", help="stop the server listening on the socket")
+
+
+def _format_time(t):
+    return "-" if t is None else datetime.datetime.fromtimestamp(t).isoformat(sep=" ", timespec="seconds")
+
+
+def cache_main(args):
+    """Run the 'ffcx cache' command."""
+    xargs = cache_parser.parse_args(args)
+
+    if xargs.command == "list":
+        entries = cache.entries(xargs.cache_dir)
+        for name, entry in sorted(entries.items(), key=lambda item: item[1]["last_access"] or 0.0):
+            compile_time = "-" if entry["compile_time"] is None else "{:.2f}s".format(entry["compile_time"])
+            print("{}  {:>12d}  {:>8}  {}".format(_format_time(entry["last_access"]), entry["size"],
+                                                  compile_time, name))
+    elif xargs.command == "prune":
+        parameters = get_parameters()
+        max_bytes = parameters["jit_cache_max_bytes"] if xargs.max_bytes is None else xargs.max_bytes
+        max_entries = parameters["jit_cache_max_entries"] if xargs.max_entries is None else xargs.max_entries
+        evicted = cache.prune(xargs.cache_dir, max_bytes=max_bytes, max_entries=max_entries)
+        print("Evicted {} module(s)".format(len(evicted)))
+    elif xargs.command == "clear":
+        removed = cache.clear(xargs.cache_dir)
+        print("Removed {} module(s)".format(len(removed)))
+    elif xargs.command == "stats":
+        stats = cache.stats(xargs.cache_dir)
+        print("Cache directory:    {}".format(stats["cache_dir"]))
+        print("Modules:            {}".format(stats["num_entries"]))
+        print("Object files:       {}".format(stats["num_objects"]))
+        print("Generated sources:  {}".format(stats["num_sources"]))
+        print("Stored modules:     {}".format(stats["num_stored"]))
+        print("Total size (bytes): {}".format(stats["total_bytes"]))
+        print("Stored (bytes):     {}".format(stats["stored_bytes"]))
+        print("Total compile time: {:.2f}s".format(stats["total_compile_time"]))
+        print("Oldest access:      {}".format(_format_time(stats["oldest_access"])))
+        print("Newest access:      {}".format(_format_time(stats["newest_access"])))
+
+    return 0
+
+
+@functools.lru_cache(maxsize=None)
+def _load_ufl_file(filename):
+    import ufl
+    return ufl.algorithms.load_ufl_file(filename)
+
+
+def _precompile_form(filename, index, parameters, cache_dir, cffi_extra_compile_args):
+    """Compile one form of a UFL file, as compile_forms would at runtime, in a worker process."""
+    ufd = _load_ufl_file(filename)
+    form = ufd.forms[index]
+    t0 = time.time()
+    _, module = jit.compile_forms([form], parameters=parameters, cache_dir=cache_dir,
+                                  cffi_extra_compile_args=cffi_extra_compile_args)
+    return ufd.object_names.get(id(form), str(index)), module.__name__, time.time() - t0
+
+
+def _ufl_files(paths):
+    """Return the UFL files given, and those in the directories given."""
+    filenames = []
+    for path in map(pathlib.Path, paths):
+        if path.is_dir():
+            filenames += sorted(path.rglob("*.ufl"))
+        else:
+            filenames.append(path)
+    return filenames
+
+
+def precompile_main(args):
+    """Run the 'ffcx precompile' command."""
+    xargs = precompile_parser.parse_args(args)
+
+    ffcx_parameters = {k: v for k, v in xargs.__dict__.items() if k in FFCX_DEFAULT_PARAMETERS and v is not None}
+    parameters = get_parameters(ffcx_parameters)
+    cffi_extra_compile_args = None
+    if xargs.cffi_extra_compile_args is not None:
+        cffi_extra_compile_args = shlex.split(xargs.cffi_extra_compile_args)
+
+    filenames = _ufl_files(xargs.path)
+
+    pathlib.Path(xargs.cache_dir).mkdir(parents=True, exist_ok=True)
+
+    t0 = time.time()
+    status = 0
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=xargs.jobs) as executor:
+        futures = {}
+        for filename in filenames:
+            try:
+                num_forms = len(_load_ufl_file(str(filename)).forms)
+            except Exception as e:
+                logger.error("Failed to load {}: {}".format(filename, e))
+                status = 1
+                continue
+            for i in range(num_forms):
+                future = executor.submit(_precompile_form, str(filename), i, parameters, xargs.cache_dir,
+                                         cffi_extra_compile_args)
+                futures[future] = filename
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                results.append((futures[future],) + future.result())
+            except Exception as e:
+                logger.error("Failed to compile form in {}: {}".format(futures[future], e))
+                status = 1
+
+    entries = cache.entries(xargs.cache_dir)
+    total_bytes = 0
+    for filename, name, module_name, compile_time in sorted(results):
+        size = entries.get(module_name, {"size": 0})["size"]
+        total_bytes += size
+        print("{:>8.2f}s  {:>12d}  {}:{}  {}".format(compile_time, size, filename, name, module_name))
+    print("Compiled {} form(s) from {} file(s) in {:.2f}s, {} bytes".format(
+        len(results), len(filenames), time.time() - t0, total_bytes))
+
+    return status
+
+
+def bench_main(args):
+    """Run the 'ffcx bench' command."""
+    from ffcx import benchmark
+
+    xargs = bench_parser.parse_args(args)
+    parameters = {k: v for k, v in xargs.__dict__.items() if k in FFCX_DEFAULT_PARAMETERS and v is not None}
+    if xargs.command == "kernels":
+        return _bench_kernels(xargs, parameters)
+
+    def print_record(record):
+        if "error" in record:
+            print("{}  {:<8}  failed: {}".format(record["file"], record["variant"], record["error"]))
+            return
+        stages = "  ".join("{} {:.3f}s".format(stage, record["stages"][stage]) for stage in benchmark.STAGES)
+        peak_memory = "-" if record["peak_memory"] is None else record["peak_memory"]
+        print("{}  {:<8}  {:>8.3f}s  ({})  {:>12} bytes peak  {:>10d} bytes code".format(
+            record["file"], record["variant"], record["time"], stages, peak_memory, record["code_size"]))
+        sys.stdout.flush()
+
+    results = benchmark.run(_ufl_files(xargs.path), variants=xargs.variant, common_parameters=parameters,
+                            repeat=xargs.repeat, callback=print_record)
+    if xargs.output is not None:
+        with open(xargs.output, "w") as f:
+            json.dump(results, f, indent=1)
+
+    status = 0
+    if xargs.compare is not None:
+        with open(xargs.compare) as f:
+            baseline = json.load(f)
+        regressions = benchmark.compare(baseline, results, xargs.threshold)
+        for filename, variant, metric, old, new in regressions:
+            print("Regression: {}  {}  {}: {} -> {}".format(filename, variant, metric, old, new))
+        print("{} regression(s) with respect to {} (commit {})".format(
+            len(regressions), xargs.compare, baseline.get("commit")))
+        status = 1 if regressions else 0
+    return status
+
+
+def _bench_kernels(xargs, parameters):
+    """Run the 'ffcx bench kernels' command."""
+    from ffcx import benchmark
+
+    cffi_extra_compile_args = None
+    if xargs.cffi_extra_compile_args is not None:
+        cffi_extra_compile_args = shlex.split(xargs.cffi_extra_compile_args)
+
+    status = 0
+    results = []
+    # Forms are compiled into a temporary directory unless a cache
+    # directory is given, and the driver is compiled once for all forms
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_dir = tmpdir if xargs.cache_dir is None else xargs.cache_dir
+        driver = benchmark.load_driver()
+        print("{:>14}  {:>12}  {:>10}  {:>9}  integral".format("cells/s", "ns/cell", "GFLOP/s", "flops"))
+        for filename in _ufl_files(xargs.path):
+            try:
+                ufd = _load_ufl_file(str(filename))
+            except Exception as e:
+                logger.error("Failed to load {}: {}".format(filename, e))
+                status = 1
+                continue
+            for i, form in enumerate(ufd.forms):
+                name = "{}:{}".format(filename, ufd.object_names.get(id(form), str(i)))
+                try:
+                    timings = benchmark.time_kernels(form, parameters, cache_dir, cffi_extra_compile_args,
+                                                     num_cells=xargs.num_cells, min_time=xargs.min_time,
+                                                     repeat=xargs.repeat, driver=driver)
+                except Exception as e:
+                    logger.error("Failed to benchmark {}: {}".format(name, e))
+                    status = 1
+                    continue
+                for t in timings:
+                    print("{:>14.0f}  {:>12.1f}  {:>10.3f}  {:>9d}  {} {} {}".format(
+                        t["cells_per_second"], t["ns_per_cell"], t["gflops"], t["flops"], name, t["integral_type"],
+                        t["subdomain_id"]))
+                    sys.stdout.flush()
+                    results.append(dict(t, file=str(filename), form=name))
+
+    if xargs.output is not None:
+        with open(xargs.output, "w") as f:
+            json.dump({"ffcx_version": ffcx.__version__, "parameters": get_parameters(parameters),
+                       "num_cells": xargs.num_cells, "kernels": results}, f, indent=1)
+    return status
+
+
+def serve_main(args):
+    """Run the 'ffcx serve' command."""
+    from ffcx import server
+
+    xargs = serve_parser.parse_args(args)
+    if xargs.stop:
+        # Also stops servers of other versions of FFCX
+        client = server.Client(xargs.socket)
+        if client.ping() is None:
+            logger.error("No compile server is listening.")
+            return 1
+        client.shutdown()
+        return 0
+
+    # Import the compiler before the first request
+    import ffcx.compiler  # noqa: F401
+
+    with server.Server(xargs.socket) as s:
+        print("Serving on {}".format(s.socket_path))
+        sys.stdout.flush()
+        try:
+            s.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+# Commands dispatched on the first command-line argument
+commands = {"bench": bench_main, "cache": cache_main, "precompile": precompile_main, "serve": serve_main}
+
 
 def main(args=None):
+    from ffcx import formatting, server, tracing
+
+    if args is None:
+        args = sys.argv[1:]
+    if len(args) > 0 and args[0] in commands:
+        return commands[args[0]](args[1:])
+
     xargs = parser.parse_args(args)
 
     # Parse all other parameters
     priority_parameters = {k: v for k, v in xargs.__dict__.items() if v is not None}
     parameters = get_parameters(priority_parameters)
 
+    # Compile on a running server if requested, unless the compilation
+    # is to be inspected locally
+    client = None
+    if xargs.server and not (xargs.profile or xargs.visualise or xargs.trace):
+        client = server.connect()
+        if client is None:
+            logger.warning("No compile server is listening, compiling locally.")
+    if client is None:
+        # UFL and the compiler are only imported when compiling locally
+        import ufl
+        from ffcx import compiler
+
     # Call parser and compiler for each file
-    for filename in xargs.ufl_file:
-        file = pathlib.Path(filename)
-        if file.suffix != ".ufl":
-            logger.error("Expecting a UFL form file (.ufl).")
-            return 1
+    with tracing.trace() if xargs.trace else contextlib.nullcontext() as tracer:
+        for filename in xargs.ufl_file:
+            file = pathlib.Path(filename)
+            if file.suffix != ".ufl":
+                logger.error("Expecting a UFL form file (.ufl).")
+                return 1
 
-        # Remove weird characters (file system allows more than the C
-        # preprocessor)
-        prefix = file.stem
-        prefix = re.subn("[^{}]".format(string.ascii_letters + string.digits + "_"), "!", prefix)[0]
-        prefix = re.subn("!+", "_", prefix)[0]
+            # Remove weird characters (file system allows more than the C
+            # preprocessor)
+            prefix = file.stem
+            prefix = re.subn("[^{}]".format(string.ascii_letters + string.digits + "_"), "!", prefix)[0]
+            prefix = re.subn("!+", "_", prefix)[0]
 
-        # Turn on profiling
-        if xargs.profile:
-            pr = cProfile.Profile()
-            pr.enable()
+            # Turn on profiling
+            if xargs.profile:
+                pr = cProfile.Profile()
+                pr.enable()
 
-        # Load UFL file
-        ufd = ufl.algorithms.load_ufl_file(filename)
+            with tracing.span("file", filename):
+                if client is not None:
+                    code_h, code_c = client.compile_file(filename, prefix, parameters)
+                else:
+                    # Load UFL file
+                    ufd = ufl.algorithms.load_ufl_file(filename)
 
-        # Generate code
-        if len(ufd.forms) > 0:
-            code_h, code_c = compiler.compile_ufl_objects(
-                ufd.forms, ufd.object_names, prefix=prefix, parameters=parameters, visualise=xargs.visualise)
-        else:
-            code_h, code_c = compiler.compile_ufl_objects(
-                ufd.elements, ufd.object_names, prefix=prefix, parameters=parameters, visualise=xargs.visualise)
+                    # Generate code
+                    if len(ufd.forms) > 0:
+                        code_h, code_c = compiler.compile_ufl_objects(
+                            ufd.forms, ufd.object_names, prefix=prefix, parameters=parameters,
+                            visualise=xargs.visualise)
+                    else:
+                        code_h, code_c = compiler.compile_ufl_objects(
+                            ufd.elements, ufd.object_names, prefix=prefix, parameters=parameters,
+                            visualise=xargs.visualise)
+
+            # Write to file
+            formatting.write_code(code_h, code_c, prefix, xargs.output_directory)
 
-        # Write to file
-        formatting.write_code(code_h, code_c, prefix, xargs.output_directory)
+            # Turn off profiling and write status to file
+            if xargs.profile:
+                pr.disable()
+                pfn = "ffcx_{0}.profile".format(prefix)
+                pr.dump_stats(pfn)
 
-        # Turn off profiling and write status to file
-        if xargs.profile:
-            pr.disable()
-            pfn = "ffcx_{0}.profile".format(prefix)
-            pr.dump_stats(pfn)
+    if tracer is not None:
+        tracer.write(xargs.trace)
 
     return 0
@@ -4,11 +4,65 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+import functools
 import hashlib
+import weakref
 
 import ffcx
 import ufl
 
+# UFL signatures of expressions, which are expensive to compute. Keys
+# are held by weak reference, so entries are dropped together with the
+# expressions. Lookup is by the UFL hash, which is cached on the
+# expression, and then by identity or else structural equality.
+_expression_signatures = weakref.WeakKeyDictionary()
+
+
+def _expression_signature(expr):
+    """Return the UFL signature of an expression, independent of the numbering of its terminals."""
+    try:
+        return _expression_signatures[expr]
+    except KeyError:
+        pass
+    except TypeError:
+        # Expressions of UFL releases which do not support weak
+        # references (__slots__ without __weakref__)
+        return _recent_expression_signature(expr)
+
+    signature = _compute_expression_signature(expr)
+    _expression_signatures[expr] = signature
+    return signature
+
+
+@functools.lru_cache(maxsize=128)
+def _recent_expression_signature(expr):
+    """Compute the UFL signature of an expression, remembering it for the most recently used expressions."""
+    return _compute_expression_signature(expr)
+
+
+def _compute_expression_signature(expr):
+    coeffs = ufl.algorithms.extract_coefficients(expr)
+    consts = ufl.algorithms.analysis.extract_constants(expr)
+    args = ufl.algorithms.analysis.extract_arguments(expr)
+
+    rn = dict()
+    rn.update(dict((c, i) for i, c in enumerate(coeffs)))
+    rn.update(dict((c, i) for i, c in enumerate(consts)))
+    rn.update(dict((c, i) for i, c in enumerate(args)))
+
+    domains = []
+    for coeff in coeffs:
+        domains.append(*coeff.ufl_domains())
+    for arg in args:
+        domains.append(*arg.ufl_domains())
+    for gc in ufl.algorithms.analysis.extract_type(expr, ufl.classes.GeometricQuantity):
+        domains.append(*gc.ufl_domains())
+
+    domains = ufl.algorithms.analysis.unique_tuple(domains)
+    rn.update(dict((d, i) for i, d in enumerate(domains)))
+
+    return ufl.algorithms.signature.compute_expression_signature(expr, rn)
+
 
 def compute_signature(ufl_objects, tag, coordinate_mapping=False):
     """Compute the signature hash.
@@ -45,30 +99,8 @@ def compute_signature(ufl_objects, tag, coordinate_mapping=False):
             expr = ufl_object[0]
             points = ufl_object[1]
 
-            # FIXME Move this to UFL, cache the computation
-            coeffs = ufl.algorithms.extract_coefficients(expr)
-            consts = ufl.algorithms.analysis.extract_constants(expr)
-            args = ufl.algorithms.analysis.extract_arguments(expr)
-
-            rn = dict()
-            rn.update(dict((c, i) for i, c in enumerate(coeffs)))
-            rn.update(dict((c, i) for i, c in enumerate(consts)))
-            rn.update(dict((c, i) for i, c in enumerate(args)))
-
-            domains = []
-            for coeff in coeffs:
-                domains.append(*coeff.ufl_domains())
-            for arg in args:
-                domains.append(*arg.ufl_domains())
-            for gc in ufl.algorithms.analysis.extract_type(expr, ufl.classes.GeometricQuantity):
-                domains.append(*gc.ufl_domains())
-
-            domains = ufl.algorithms.analysis.unique_tuple(domains)
-            rn.update(dict((d, i) for i, d in enumerate(domains)))
-
             # Hash on UFL signature and points
-            signature = ufl.algorithms.signature.compute_expression_signature(expr, rn)
-            object_signature += signature
+            object_signature += _expression_signature(expr)
             object_signature += repr(points)
 
             kind = "expression"
@@ -82,6 +114,8 @@ def compute_signature(ufl_objects, tag, coordinate_mapping=False):
 
 
 def integral_name(integral_type, original_form, form_id, subdomain_id):
+    # The kernel code depends on the coefficient numbering of the whole
+    # form, so the name is based on the signature of the form
     sig = compute_signature([original_form], str(form_id))
     return "integral_{}_{}_{!s}".format(integral_type, subdomain_id, sig)
 
@@ -0,0 +1,92 @@
+# Copyright (C) 2020 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Parallel execution of independent compiler tasks in forked processes.
+
+Tasks are inherited by the worker processes when they are forked,
+rather than pickled, so that their arguments (UFL form data, FIAT
+elements) need not be picklable. Only the results are pickled back.
+Results are returned in the order of the tasks, so that the generated
+code does not depend on the number of processes.
+
+Forking is only safe while the process runs no other threads, and not at
+all on macOS, so tasks run serially elsewhere (for example in the
+threads of :func:`ffcx.codegeneration.jit.compile_forms_async`, or while
+a JIT compilation holds a lock with a heartbeat thread).
+
+Spans recorded by the workers in an active trace (see
+:mod:`ffcx.tracing`) are added to the trace of the parent process.
+"""
+
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+
+from ffcx import tracing
+
+logger = logging.getLogger("ffcx")
+
+# Tasks of the map run by a worker process, set when it starts
+_tasks = None
+
+
+def _init_worker(tasks):
+    global _tasks
+    _tasks = tasks
+
+
+def _run_task(index):
+    function, args = _tasks[index]
+    tracer = tracing.active()
+    if tracer is None:
+        return function(*args), []
+    # The worker has a copy of the parent tracer, including its spans
+    num_spans = len(tracer.spans)
+    result = function(*args)
+    return result, tracer.spans[num_spans:]
+
+
+def num_processes(n, num_tasks):
+    """Return the number of processes to run num_tasks tasks on, for a parameter value n.
+
+    n = 0 means serial, n < 0 means the number of CPUs. Runs serially
+    where processes cannot be forked safely (on macOS, or while other
+    threads run, whose locks and file descriptors the workers would
+    inherit), or in a daemon process (such as a multiprocessing pool
+    worker), which cannot have children.
+    """
+    if n < 0:
+        n = os.cpu_count() or 1
+    n = min(n, num_tasks)
+    if n < 2:
+        return 1
+    if ("fork" not in multiprocessing.get_all_start_methods() or sys.platform == "darwin"
+            or threading.active_count() > 1 or multiprocessing.current_process().daemon):
+        logger.info("Running {} tasks serially, since processes cannot be forked safely here".format(num_tasks))
+        return 1
+    return n
+
+
+def map_tasks(tasks, n):
+    """Return the results of tasks [(function, args)], in order, computed in n processes.
+
+    See :func:`num_processes` for the meaning of n.
+    """
+    n = num_processes(n, len(tasks))
+    if n == 1:
+        return [function(*args) for function, args in tasks]
+
+    logger.info("Running {} tasks in {} processes".format(len(tasks), n))
+    # The tasks are inherited by the forked workers, not pickled
+    with multiprocessing.get_context("fork").Pool(n, initializer=_init_worker, initargs=(tasks,)) as pool:
+        results = pool.map(_run_task, range(len(tasks)), chunksize=1)
+
+    tracer = tracing.active()
+    for _, spans in results:
+        if tracer is not None:
+            tracer.spans.extend(spans)
+    return [result for result, _ in results]
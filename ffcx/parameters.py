@@ -32,10 +32,60 @@ FFCX_DEFAULT_PARAMETERS = {
                (-1 means no alignment assumed, safe option)"""),
     "padlen":
         (1, "Pads every declared array in tabulation kernel such that its last dimension is divisible by given value."),
+    "parallel_ir":
+        (0, "Number of processes computing the intermediate representation of integrals and expressions in parallel."
+            " (0 means serial, -1 means number of CPUs)"),
+    "parallel_codegen":
+        (0, "Number of processes generating code for elements, dofmaps, integrals, forms and expressions in"
+            " parallel. (0 means serial, -1 means number of CPUs)"),
     "verbosity":
-        (30, "Logger verbosity. Follows standard logging library levels, i.e. INFO=20, DEBUG=10, etc.")
+        (30, "Logger verbosity. Follows standard logging library levels, i.e. INFO=20, DEBUG=10, etc."),
+    "jit_cache_max_bytes":
+        (0, "Maximum size (in bytes) of the JIT cache directory before least recently used modules are evicted."
+            " (0 means unlimited)"),
+    "jit_cache_max_entries":
+        (0, "Maximum number of modules in the JIT cache directory before least recently used modules are evicted."
+            " (0 means unlimited)"),
+    "jit_shards":
+        (0, "Number of C files the JIT module source is split into and compiled in parallel. Their object files"
+            " are cached, so kernels of unchanged forms are not compiled again."
+            " (0 means a single file, -1 means one file per integral or expression kernel)"),
+    "jit_build_processes":
+        (0, "Maximum number of C compiler processes running in parallel for a sharded JIT build."
+            " (0 means number of CPUs)"),
+    "jit_retry_failed":
+        (False, "True to retry a JIT compilation which failed before, instead of failing with the recorded error."),
+    "jit_abi_mode":
+        (False, "True to build JIT modules as plain shared libraries loaded with cffi in ABI mode (dlopen),"
+                " instead of Python extension modules."),
+    "jit_cache_store":
+        ("", "Name of a single-file store of compiled JIT modules kept in the cache directory, e.g. 'sqlite'."
+             " Modules are extracted from the store into jit_local_dir. (empty means a plain cache directory)"),
+    "jit_local_dir":
+        ("", "Node-local directory into which modules are compiled and extracted when jit_cache_store is set."
+             " (empty means the system temporary directory)"),
+    "jit_event_log":
+        ("", "File to which an event with the outcome and timings of each JIT compilation is appended as a JSON line."
+             " (empty means no log)"),
+    "jit_compile_profile":
+        ("", "Named set of C compiler flags for JIT modules: 'fast-compile', 'balanced' or 'max-performance'."
+             " 'autotune' selects the profile with the fastest form kernels and records it in the cache directory."
+             " (empty means the default flags of Python extension modules)")
 }
 
+# Parameters which control how the compiler runs, but not the generated code
+SCHEDULING_PARAMETERS = ("parallel_ir", "parallel_codegen")
+
+
+def code_parameters(parameters: dict) -> dict:
+    """Return the parameters which affect the generated code.
+
+    JIT parameters (jit_*) and scheduling parameters (see
+    SCHEDULING_PARAMETERS) are left out, so that they change neither
+    the generated code nor the JIT module names.
+    """
+    return {k: v for k, v in parameters.items() if not k.startswith("jit_") and k not in SCHEDULING_PARAMETERS}
+
 
 @functools.lru_cache(maxsize=None)
 def _load_parameters():
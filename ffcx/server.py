@@ -0,0 +1,280 @@
+# Copyright (C) 2020 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Long-lived compile server, and a client for it.
+
+Every ``ffcx`` invocation, and every fresh process doing JIT
+compilation, imports UFL and FIAT and fills the FIAT element and
+quadrature caches from scratch. The server (``ffcx serve``) keeps one
+process with warm caches, which compiles on request from clients over
+a Unix socket.
+
+Requests and responses are pickled dicts, each preceded by its length.
+Since unpickling executes code, the socket is only accessible by its
+owner, and clients only connect to sockets owned by their user and not
+accessible by others. The default socket is in a private directory (see
+:func:`default_socket_path`). Clients only use servers running the same
+version of FFCX.
+
+Requests
+--------
+``{"command": "compile_file", "filename", "prefix", "parameters"}``
+    Compile the forms (or elements) of a .ufl file, returning
+    ``{"code_h", "code_c"}``.
+``{"command": "compile", "ufl_objects", "object_names", "prefix", "parameters"}``
+    Compile pickled UFL objects, returning ``{"code_h", "code_c"}``.
+``{"command": "jit", "kind", "ufl_objects", "kwargs"}``
+    Compile UFL objects with ``ffcx.codegeneration.jit.compile_<kind>``
+    into the cache directory given in kwargs, returning
+    ``{"module_name", "filename"}`` of the compiled module.
+``{"command": "stats"}``
+    Return ``{"pid", "requests", "uptime", "version"}``.
+``{"command": "shutdown"}``
+    Stop the server.
+
+Failed requests return ``{"error": <traceback>}``.
+"""
+
+import logging
+import os
+import pickle
+import socket
+import socketserver
+import stat
+import struct
+import tempfile
+import threading
+import time
+import traceback
+
+import ffcx
+
+logger = logging.getLogger("ffcx")
+
+_HEADER = struct.Struct("!Q")
+
+
+def default_socket_path():
+    """Return the socket path given by $FFCX_SERVER_SOCKET, or else a path in a private per-user directory.
+
+    The directory is $XDG_RUNTIME_DIR, or else ffcx-<uid> in the
+    temporary directory, which is created only accessible by its owner.
+    """
+    path = os.environ.get("FFCX_SERVER_SOCKET")
+    if path:
+        return path
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if not runtime_dir:
+        runtime_dir = os.path.join(tempfile.gettempdir(), "ffcx-{}".format(os.getuid()))
+        try:
+            os.mkdir(runtime_dir, 0o700)
+        except FileExistsError:
+            pass
+    _check_private(runtime_dir, stat.S_ISDIR)
+    return os.path.join(runtime_dir, "ffcx.sock")
+
+
+def _check_private(path, is_type=stat.S_ISSOCK):
+    """Raise PermissionError unless path is of the given type, owned by this user and not accessible by others.
+
+    Raises FileNotFoundError if path does not exist.
+    """
+    st = os.lstat(path)
+    if not is_type(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError("{} is not a {} owned by this user and only accessible by it.".format(
+            path, "directory" if is_type is stat.S_ISDIR else "socket"))
+
+
+def _send(sock, obj):
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise EOFError("Connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv(sock):
+    size, = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return pickle.loads(_recv_exactly(sock, size))
+
+
+def _compile_file(filename, prefix, parameters):
+    import ufl
+    import ffcx.compiler
+
+    ufd = ufl.algorithms.load_ufl_file(filename)
+    ufl_objects = ufd.forms if len(ufd.forms) > 0 else ufd.elements
+    code_h, code_c = ffcx.compiler.compile_ufl_objects(ufl_objects, ufd.object_names, prefix=prefix,
+                                                       parameters=parameters)
+    return {"code_h": code_h, "code_c": code_c}
+
+
+def _compile(ufl_objects, object_names, prefix, parameters):
+    import ffcx.compiler
+
+    code_h, code_c = ffcx.compiler.compile_ufl_objects(ufl_objects, object_names, prefix=prefix,
+                                                       parameters=parameters)
+    return {"code_h": code_h, "code_c": code_c}
+
+
+def _jit(kind, ufl_objects, kwargs):
+    import ffcx.codegeneration.jit
+
+    if kwargs.get("cache_dir") is None:
+        raise ValueError("JIT compilation on the server needs a cache directory.")
+    _, module = getattr(ffcx.codegeneration.jit, "compile_" + kind)(ufl_objects, **kwargs)
+    return {"module_name": module.__name__, "filename": module.__file__}
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        server = self.server
+        while True:
+            try:
+                request = _recv(self.request)
+            except EOFError:
+                return
+            server.num_requests += 1
+            command = request.get("command")
+            t0 = time.time()
+            try:
+                if command == "compile_file":
+                    response = _compile_file(request["filename"], request["prefix"], request["parameters"])
+                elif command == "compile":
+                    response = _compile(request["ufl_objects"], request.get("object_names", {}),
+                                        request["prefix"], request["parameters"])
+                elif command == "jit":
+                    response = _jit(request["kind"], request["ufl_objects"], request.get("kwargs", {}))
+                elif command == "stats":
+                    response = {"pid": os.getpid(), "requests": server.num_requests,
+                                "uptime": time.time() - server.start_time, "version": ffcx.__version__}
+                elif command == "shutdown":
+                    response = {}
+                    # Cannot call shutdown from the thread serving requests
+                    threading.Thread(target=server.shutdown).start()
+                else:
+                    raise ValueError("Unknown command {!r}".format(command))
+            except Exception:
+                response = {"error": traceback.format_exc()}
+            logger.info("Served {} in {:.4f}s".format(command, time.time() - t0))
+            _send(self.request, response)
+
+
+class Server(socketserver.UnixStreamServer):
+    """Compile server on a Unix socket.
+
+    Requests are served one at a time, since the compiler is not
+    thread safe.
+    """
+
+    def __init__(self, socket_path=None):
+        if socket_path is None:
+            socket_path = default_socket_path()
+        self.socket_path = socket_path
+        self.num_requests = 0
+        self.start_time = time.time()
+        # Remove the socket of a server which is gone
+        if os.path.lexists(socket_path):
+            _check_private(socket_path)
+            if Client(socket_path).ping() is None:
+                os.unlink(socket_path)
+        old_umask = os.umask(0o077)
+        try:
+            super().__init__(socket_path, _Handler)
+        finally:
+            os.umask(old_umask)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class Client:
+    """Client of a compile server."""
+
+    def __init__(self, socket_path=None, timeout=None):
+        self.socket_path = default_socket_path() if socket_path is None else socket_path
+        self.timeout = timeout
+
+    def _request(self, request):
+        _check_private(self.socket_path)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            _send(sock, request)
+            response = _recv(sock)
+        if "error" in response:
+            raise RuntimeError("Compile server failed with:\n{}".format(response["error"]))
+        return response
+
+    def ping(self):
+        """Return the statistics of the server, or None if it cannot be reached.
+
+        Raises PermissionError if the socket is not private to this user.
+        """
+        try:
+            return self._request({"command": "stats"})
+        except PermissionError:
+            raise
+        except (OSError, EOFError):
+            return None
+
+    def compile_file(self, filename, prefix, parameters):
+        """Compile a .ufl file, returning header and source."""
+        response = self._request({"command": "compile_file", "filename": os.path.abspath(filename),
+                                  "prefix": prefix, "parameters": parameters})
+        return response["code_h"], response["code_c"]
+
+    def compile_ufl_objects(self, ufl_objects, object_names={}, prefix=None, parameters=None):
+        """Compile UFL objects, returning header and source. See ffcx.compiler.compile_ufl_objects."""
+        response = self._request({"command": "compile", "ufl_objects": ufl_objects, "object_names": object_names,
+                                  "prefix": prefix, "parameters": parameters})
+        return response["code_h"], response["code_c"]
+
+    def jit(self, kind, ufl_objects, **kwargs):
+        """Compile UFL objects with compile_<kind> into a cache directory, returning module name and file.
+
+        The module can then be loaded from the cache directory by
+        calling compile_<kind> with the same arguments.
+        """
+        response = self._request({"command": "jit", "kind": kind, "ufl_objects": ufl_objects, "kwargs": kwargs})
+        return response["module_name"], response["filename"]
+
+    def shutdown(self):
+        """Stop the server."""
+        self._request({"command": "shutdown"})
+
+
+def connect(socket_path=None):
+    """Return a client of the compile server, or None if no server of this version of FFCX is reachable.
+
+    Sockets which are not private to this user are not used.
+    """
+    socket_path = default_socket_path() if socket_path is None else socket_path
+    if not os.path.lexists(socket_path):
+        return None
+    client = Client(socket_path)
+    try:
+        stats = client.ping()
+    except PermissionError as e:
+        logger.warning("Not using compile server: {}".format(e))
+        return None
+    if stats is None:
+        return None
+    if stats.get("version") != ffcx.__version__:
+        logger.warning("Not using compile server on {}, which runs FFCX {} instead of {}. Restart it.".format(
+            socket_path, stats.get("version"), ffcx.__version__))
+        return None
+    return client
@@ -0,0 +1,149 @@
+# Copyright (C) 2020 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Tracing of the compiler stages, per compiled object.
+
+The compiler records spans (analysis of each form, IR of each element,
+dofmap, integral and expression, code generation by each generator and
+formatting) while a trace is active::
+
+    with ffcx.tracing.trace() as tracer:
+        ffcx.compiler.compile_ufl_objects(forms)
+    tracer.write("trace.json")
+
+Each span records wall time, CPU time and, if memory tracing is
+enabled, the peak memory allocated by Python (tracemalloc) during the
+span. The peak can only be measured per span on Python 3.9 or later,
+and is None on earlier versions. Traces are written in the Chrome trace event format, which can be
+viewed in chrome://tracing or https://ui.perfetto.dev.
+
+When no trace is active, spans cost a single function call.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+_active = None
+_active_lock = threading.Lock()
+
+# Whether the peak of traced memory can be reset at the start of each span
+_PEAK_PER_SPAN = hasattr(tracemalloc, "reset_peak")
+
+
+class Tracer:
+    """Recorder of compiler spans."""
+
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._t0 = time.perf_counter()
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextlib.contextmanager
+    def span(self, category, name, **args):
+        """Record a span around the body of the context."""
+        stack = self._stack()
+        record = {"category": category, "name": name, "args": args, "depth": len(stack),
+                  "process": os.getpid(), "thread": threading.get_ident(), "peak": 0}
+        if self.memory and _PEAK_PER_SPAN:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+            record["start_memory"] = current
+            tracemalloc.reset_peak()
+        stack.append(record)
+        record["start"] = time.perf_counter() - self._t0
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record["cpu_time"] = time.process_time() - cpu_start
+            record["wall_time"] = time.perf_counter() - self._t0 - record["start"]
+            stack.pop()
+            if self.memory and _PEAK_PER_SPAN:
+                peak = max(record["peak"], tracemalloc.get_traced_memory()[1])
+                record["peak_memory"] = max(peak - record.pop("start_memory"), 0)
+                if stack:
+                    stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+            elif self.memory:
+                record["peak_memory"] = None
+            del record["peak"]
+            with self._lock:
+                self.spans.append(record)
+
+    def to_chrome_trace(self):
+        """Return the spans in Chrome trace event format."""
+        events = []
+        for span in sorted(self.spans, key=lambda s: (s["start"], s["depth"])):
+            args = dict(span["args"], wall_time=span["wall_time"], cpu_time=span["cpu_time"])
+            if span.get("peak_memory") is not None:
+                args["peak_memory"] = span["peak_memory"]
+            events.append({"name": span["name"], "cat": span["category"], "ph": "X", "pid": span["process"],
+                           "tid": span["thread"], "ts": span["start"] * 1e6, "dur": span["wall_time"] * 1e6,
+                           "args": args})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, filename):
+        """Write the spans to a file in Chrome trace event format."""
+        with open(filename, "w") as f:
+            json.dump(self.to_chrome_trace(), f, indent=1)
+
+    def summary(self, category=None):
+        """Return the spans (of a category), slowest first, as tuples (category, name, wall time)."""
+        spans = [s for s in self.spans if category is None or s["category"] == category]
+        return sorted(((s["category"], s["name"], s["wall_time"]) for s in spans), key=lambda s: -s[2])
+
+
+@contextlib.contextmanager
+def trace(memory=True):
+    """Record compiler spans in the body of the context, yielding the Tracer.
+
+    With memory=True, Python memory allocations are traced with
+    tracemalloc, which slows down compilation. On Python < 3.9, the peak
+    memory of spans is None and memory is not traced.
+    """
+    global _active
+    tracer = Tracer(memory)
+    with _active_lock:
+        if _active is not None:
+            raise RuntimeError("A compiler trace is already active.")
+        _active = tracer
+    started_tracemalloc = memory and _PEAK_PER_SPAN and not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+    try:
+        yield tracer
+    finally:
+        if started_tracemalloc:
+            tracemalloc.stop()
+        with _active_lock:
+            _active = None
+
+
+_no_span = contextlib.nullcontext()
+
+
+def span(category, name, **args):
+    """Return a context recording a span in the active trace, if any."""
+    tracer = _active
+    if tracer is None:
+        return _no_span
+    return tracer.span(category, name, **args)
+
+
+def active():
+    """Return the active Tracer, or None."""
+    return _active
@@ -4,8 +4,19 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+import gc
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
 import sys
+from pathlib import Path
 
+import cffi
+import pytest
+
+import ffcx.codegeneration.cache
 import ffcx.codegeneration.jit
 import ufl
 
@@ -33,3 +44,371 @@ def test_cache_modes(compile_args):
 
     assert(newname == tmpname)
     assert(newfile != tmpfile)
+
+
+def test_cache_manifest_prune(compile_args, tmp_path):
+    cell = ufl.triangle
+    forms = []
+    for degree in (1, 2):
+        element = ufl.FiniteElement("Lagrange", cell, degree)
+        u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+        forms.append(ufl.inner(u, v) * ufl.dx)
+
+    modules = []
+    for form in forms:
+        _, module = ffcx.codegeneration.jit.compile_forms(
+            [form], cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+        modules.append(module.__name__)
+
+    # Generated source code is listed in the manifest next to the modules
+    entries = ffcx.codegeneration.cache.entries(tmp_path)
+    assert {name for name in entries if not name.startswith("source/")} == set(modules)
+    assert sum(1 for name in entries if name.startswith("source/")) == 2
+    assert all(entries[name]["size"] > 0 for name in modules)
+    assert all(entries[name]["compile_time"] > 0.0 for name in modules)
+
+    # Load first form again, so the second one is least recently used
+    ffcx.codegeneration.jit.compile_forms([forms[0]], cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+    evicted = ffcx.codegeneration.cache.prune(tmp_path, max_entries=1)
+    assert evicted == [modules[1]]
+    assert modules[1] not in ffcx.codegeneration.cache.entries(tmp_path)
+    assert not list(tmp_path.glob(modules[1] + ".c*"))
+
+    assert modules[0] in ffcx.codegeneration.cache.clear(tmp_path)
+    assert not list(tmp_path.joinpath("source").glob("*.json"))
+    assert ffcx.codegeneration.cache.stats(tmp_path)["num_entries"] == 0
+
+
+def test_cache_max_entries_parameter(compile_args, tmp_path):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(u, v) * ufl.dx, ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx]
+
+    for form in forms:
+        _, module = ffcx.codegeneration.jit.compile_forms(
+            [form], parameters={"jit_cache_max_entries": 1}, cache_dir=tmp_path,
+            cffi_extra_compile_args=compile_args)
+
+    entries = ffcx.codegeneration.cache.entries(tmp_path)
+    assert [name for name in entries if name.startswith("libffcx_")] == [module.__name__]
+
+
+def _compile_mass_form(cache_dir):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 3)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    _, module = ffcx.codegeneration.jit.compile_forms([ufl.inner(u, v) * ufl.dx], cache_dir=cache_dir)
+    return module.__name__
+
+
+def test_cache_concurrent_compile(tmp_path):
+    ctx = multiprocessing.get_context("fork")
+    with ctx.Pool(4) as pool:
+        names = pool.map(_compile_mass_form, [tmp_path] * 4)
+    assert len(set(names)) == 1
+    assert len(list(tmp_path.glob(names[0] + ".c.cached"))) == 1
+
+
+class _QueueComm:
+    """Minimal communicator of forked processes, broadcasting through queues."""
+
+    def __init__(self, size):
+        ctx = multiprocessing.get_context("fork")
+        self.queues = [ctx.Queue() for i in range(size)]
+        self.rank = 0
+
+    def bcast(self, obj, root=0):
+        if self.rank == root:
+            for rank, queue in enumerate(self.queues):
+                if rank != root:
+                    queue.put(obj)
+            return obj
+        return self.queues[self.rank].get()
+
+
+def _compile_mass_form_collective(comm, rank, cache_dir, compile_args, results, parameters):
+    comm.rank = rank
+    coordinator = ffcx.codegeneration.jit.CommCoordinator(comm)
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    parameters = dict(parameters)
+    if "jit_local_dir" in parameters:
+        # Each process on its own node
+        parameters["jit_local_dir"] += str(rank)
+    try:
+        for i in range(2):
+            # Loaded by only some of the processes the second time
+            if rank % 2 == 1:
+                ffcx.codegeneration.jit.clear_registry()
+            _, module = ffcx.codegeneration.jit.compile_forms([ufl.inner(u, v) * ufl.dx], parameters=parameters,
+                                                              cache_dir=cache_dir,
+                                                              cffi_extra_compile_args=compile_args,
+                                                              coordinator=coordinator)
+        results.put((rank, module.__name__))
+    except RuntimeError as e:
+        results.put((rank, str(e)))
+    except cffi.VerificationError:
+        results.put((rank, "failed on root"))
+
+
+def _run_collective(cache_dir, compile_args, parameters={}, size=4):
+    ctx = multiprocessing.get_context("fork")
+    comm = _QueueComm(size)
+    results = ctx.Queue()
+    processes = [ctx.Process(target=_compile_mass_form_collective,
+                             args=(comm, rank, cache_dir, compile_args, results, parameters))
+                 for rank in range(size)]
+    for process in processes:
+        process.start()
+    outcome = dict(results.get(timeout=60) for i in range(size))
+    for process in processes:
+        process.join()
+    return [outcome[rank] for rank in range(size)]
+
+
+def test_cache_comm_coordinator(tmp_path):
+    names = _run_collective(tmp_path, None)
+    assert len(set(names)) == 1
+    assert len(list(tmp_path.glob(names[0] + ".c.cached"))) == 1
+
+    # A compiler error on the root process is broadcast to the others
+    outcome = _run_collective(tmp_path, ["-fno-such-compiler-option"])
+    assert outcome[0] == "failed on root"
+    assert all("no-such-compiler-option" in message for message in outcome[1:])
+
+
+def test_cache_comm_coordinator_store(tmp_path):
+    # Processes on other nodes than the root extract the module from the store
+    cache_dir = tmp_path.joinpath("shared")
+    p = {"jit_cache_store": "sqlite", "jit_local_dir": str(tmp_path.joinpath("node"))}
+    names = _run_collective(cache_dir, None, p)
+    assert len(set(names)) == 1
+    for rank in range(len(names)):
+        assert tmp_path.joinpath("node{}".format(rank)).is_dir()
+
+
+def test_cache_comm_coordinator_evicted(compile_args, tmp_path):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(u, v) * ufl.dx]
+    coordinator = ffcx.codegeneration.jit.CommCoordinator(_QueueComm(1))
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args, coordinator=coordinator)
+    library = Path(module.__file__)
+
+    # The root compiles a module loaded before again if it has been
+    # evicted, since the other processes may need it
+    ffcx.codegeneration.cache.clear(tmp_path)
+    assert not library.exists()
+    assert ffcx.codegeneration.jit.compile_forms(
+        forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args, coordinator=coordinator)[0] is compiled_forms
+    assert library.exists()
+
+    # Also if only the library has been removed
+    library.unlink()
+    ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args,
+                                          coordinator=coordinator)
+    assert library.exists()
+
+
+def test_cache_stale_lock(tmp_path):
+    # Simulate a crashed compilation: empty C file and a lock file owned
+    # by a process which no longer exists
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 3)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(u, v) * ufl.dx]
+    p = ffcx.parameters.get_parameters()
+    module_name = 'libffcx_forms_' + ffcx.naming.compute_signature(
+        forms, ffcx.codegeneration.jit._compute_parameter_signature(p) + str(None) + str(None))
+    tmp_path.joinpath(module_name + ".c").touch()
+    tmp_path.joinpath(module_name + ".lock").write_text(
+        json.dumps({"pid": process.pid, "hostname": socket.gethostname()}))
+
+    _, module = ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path, timeout=1)
+    assert module.__name__ == module_name
+
+
+def test_cache_prune_crashed_compile(tmp_path):
+    # C file left behind by a crashed compilation, without heartbeat for long
+    c_filename = tmp_path.joinpath("libffcx_forms_crashed.c")
+    c_filename.write_text("int x;")
+    old = c_filename.stat().st_mtime - 2 * ffcx.codegeneration.cache.STALE_LOCK_AGE
+    os.utime(c_filename, (old, old))
+    assert ffcx.codegeneration.cache.prune(tmp_path, max_bytes=1) == ["libffcx_forms_crashed"]
+
+    # Compilation in progress is kept
+    c_filename.write_text("int x;")
+    assert ffcx.codegeneration.cache.prune(tmp_path, max_bytes=1) == []
+
+
+def test_cache_kernel_objects(compile_args, tmp_path):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    L = v * ufl.dx
+    p = {"jit_shards": -1}
+
+    ffcx.codegeneration.jit.compile_forms([ufl.inner(u, v) * ufl.dx, L], parameters=p, cache_dir=tmp_path,
+                                          cffi_extra_compile_args=compile_args)
+    objects = set(tmp_path.joinpath("objects").glob("*.o"))
+    assert len(objects) == 3
+
+    # Changing the bilinear form recompiles its kernel and the shard
+    # with the forms, but reuses the kernel of the linear form
+    ffcx.codegeneration.jit.compile_forms([ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx, L], parameters=p,
+                                          cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+    new_objects = set(tmp_path.joinpath("objects").glob("*.o")) - objects
+    assert len(new_objects) == 2
+
+    stats = ffcx.codegeneration.cache.stats(tmp_path)
+    assert stats["num_entries"] == 2
+    assert stats["num_objects"] == 5
+
+
+def test_cache_generated_source(tmp_path, monkeypatch):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(u, v) * ufl.dx]
+
+    _, module0 = ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path, cffi_extra_compile_args=["-O1"])
+    assert len(list(tmp_path.joinpath("source").glob("*.json"))) == 1
+
+    # Changing C compiler flags compiles a new module, but reuses the
+    # generated code
+    def compile_ufl_objects(*args, **kwargs):
+        raise RuntimeError("Generated code should have been found in the source cache")
+    monkeypatch.setattr(ffcx.compiler, "compile_ufl_objects", compile_ufl_objects)
+
+    _, module1 = ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path, cffi_extra_compile_args=["-O2"])
+    assert module1.__name__ != module0.__name__
+
+    stats = ffcx.codegeneration.cache.stats(tmp_path)
+    assert stats["num_entries"] == 2
+    assert stats["num_sources"] == 1
+
+
+def test_cache_registry(compile_args, tmp_path):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(u, v) * ufl.dx]
+
+    ffcx.codegeneration.jit.clear_registry()
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+
+    # Compiling again returns the loaded module and objects
+    for i in range(3):
+        compiled_forms_i, module_i = ffcx.codegeneration.jit.compile_forms(
+            forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+        assert compiled_forms_i is compiled_forms
+        assert module_i is module
+    assert ffcx.codegeneration.jit.registry_stats() == {"hits": 3, "misses": 1, "size": 1}
+
+    # Entry is dropped once the objects are no longer used
+    del compiled_forms, compiled_forms_i, module, module_i
+    gc.collect()
+    assert ffcx.codegeneration.jit.registry_stats()["size"] == 0
+
+
+def test_cache_failed_compile(tmp_path):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx]
+    compile_args = ["-fno-such-compiler-option"]
+
+    with pytest.raises(cffi.VerificationError, match="no-such-compiler-option"):
+        ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+
+    # Fails immediately with the recorded compiler error
+    with pytest.raises(RuntimeError, match="no-such-compiler-option"):
+        ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+
+    # Unless asked to retry
+    with pytest.raises(cffi.VerificationError):
+        ffcx.codegeneration.jit.compile_forms(forms, parameters={"jit_retry_failed": True}, cache_dir=tmp_path,
+                                              cffi_extra_compile_args=compile_args)
+
+    # Clearing the cache forgets the failure
+    ffcx.codegeneration.cache.clear(tmp_path)
+    with pytest.raises(cffi.VerificationError):
+        ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+
+
+def test_cache_failure_after_compile(compile_args, tmp_path, monkeypatch):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(u, v) * ufl.ds]
+
+    # Errors after the module has been compiled are not recorded as
+    # compile failures, so later attempts load the module
+    def record(cache_dir, module_name, compile_time=None):
+        raise OSError("Manifest not writable")
+    monkeypatch.setattr(ffcx.codegeneration.cache, "record", record)
+    with pytest.raises(OSError, match="Manifest not writable"):
+        ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+    assert not list(tmp_path.glob("*.failed"))
+
+    monkeypatch.undo()
+    compiled_forms, _ = ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path,
+                                                              cffi_extra_compile_args=compile_args)
+    assert compiled_forms[0].rank == 2
+
+
+def test_cache_store(compile_args, tmp_path, monkeypatch):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(u, v) * ufl.dx]
+    cache_dir = tmp_path.joinpath("shared")
+
+    # Compile on the first node, which adds the module to the store
+    p = {"jit_cache_store": "sqlite", "jit_local_dir": str(tmp_path.joinpath("node0"))}
+    ffcx.codegeneration.jit.clear_registry()
+    _, module = ffcx.codegeneration.jit.compile_forms(forms, parameters=p, cache_dir=cache_dir,
+                                                      cffi_extra_compile_args=compile_args)
+    assert [path.name for path in cache_dir.iterdir()] == ["ffcx_store.sqlite"]
+    assert ffcx.codegeneration.cache.stats(cache_dir)["num_stored"] == 1
+
+    # Other nodes extract the module from the store instead of compiling
+    def compile_objects(*args, **kwargs):
+        raise RuntimeError("Module should have been found in the store")
+    monkeypatch.setattr(ffcx.codegeneration.jit, "_compile_objects", compile_objects)
+
+    p["jit_local_dir"] = str(tmp_path.joinpath("node1"))
+    ffcx.codegeneration.jit.clear_registry()
+    compiled_forms, module1 = ffcx.codegeneration.jit.compile_forms(forms, parameters=p, cache_dir=cache_dir,
+                                                                    cffi_extra_compile_args=compile_args)
+    assert module1.__name__ == module.__name__
+    assert module1.__file__.startswith(p["jit_local_dir"])
+    assert compiled_forms[0].rank == 2
+
+    assert module.__name__ in ffcx.codegeneration.cache.clear(cache_dir)
+    assert ffcx.codegeneration.cache.stats(cache_dir)["num_stored"] == 0
+
+
+def test_cache_stats(compile_args, tmp_path):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(u, v) * ufl.dx]
+    event_log = tmp_path.joinpath("events.jsonl")
+    p = {"jit_event_log": str(event_log)}
+
+    ffcx.codegeneration.jit.clear_registry()
+    ffcx.codegeneration.jit.reset_stats()
+    ffcx.codegeneration.jit.compile_forms(forms, parameters=p, cache_dir=tmp_path,
+                                          cffi_extra_compile_args=compile_args)
+    ffcx.codegeneration.jit.clear_registry()
+    ffcx.codegeneration.jit.compile_forms(forms, parameters=p, cache_dir=tmp_path,
+                                          cffi_extra_compile_args=compile_args)
+
+    stats = ffcx.codegeneration.jit.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+    assert stats["failures"] == 0
+    assert stats["compile_time"] > 0.0
+    assert stats["load_time"] > 0.0
+
+    events = [json.loads(line) for line in event_log.read_text().splitlines()]
+    assert [event["outcome"] for event in events] == ["miss", "hit"]
+    assert events[0]["codegen_time"] > 0.0
+    assert events[1]["compile_time"] == 0.0
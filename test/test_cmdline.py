@@ -4,9 +4,15 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+import json
 import os
 import os.path
+import pathlib
 import subprocess
+import tracemalloc
+
+import ffcx.codegeneration.jit
+import ufl
 
 
 def test_cmdline_simple():
@@ -19,3 +25,70 @@ def test_visualise():
     subprocess.run(["ffcx", "--visualise", "Poisson.ufl"])
     assert os.path.isfile("S.pdf")
     assert os.path.isfile("F.pdf")
+
+
+def test_cmdline_cache(tmp_path):
+    result = subprocess.run(["ffcx", "cache", "stats", str(tmp_path)], stdout=subprocess.PIPE, check=True)
+    assert b"Modules:            0" in result.stdout
+    subprocess.run(["ffcx", "cache", "prune", "--max-bytes", "1", str(tmp_path)], check=True)
+    subprocess.run(["ffcx", "cache", "list", str(tmp_path)], check=True)
+    subprocess.run(["ffcx", "cache", "clear", str(tmp_path)], check=True)
+
+
+def test_cmdline_precompile(tmp_path):
+    ufl_dir = tmp_path.joinpath("forms")
+    ufl_dir.mkdir()
+    ufl_dir.joinpath("Mass.ufl").write_text(
+        "from ufl import FiniteElement, TestFunction, TrialFunction, dx, inner, triangle\n"
+        "element = FiniteElement('Lagrange', triangle, 1)\n"
+        "u, v = TrialFunction(element), TestFunction(element)\n"
+        "a = inner(u, v) * dx\n"
+        "L = v * dx\n")
+    cache_dir = tmp_path.joinpath("cache")
+    result = subprocess.run(["ffcx", "precompile", "--cache-dir", str(cache_dir), "-j", "2", str(ufl_dir)],
+                            stdout=subprocess.PIPE, check=True)
+    assert b"Compiled 2 form(s) from 1 file(s)" in result.stdout
+    assert len(list(cache_dir.glob("libffcx_forms_*.c.cached"))) == 2
+
+    # The JIT finds the precompiled modules
+    ufd = ufl.algorithms.load_ufl_file(str(ufl_dir.joinpath("Mass.ufl")))
+    _, module = ffcx.codegeneration.jit.compile_forms(ufd.forms[:1], cache_dir=cache_dir)
+    assert pathlib.Path(module.__file__).parent == cache_dir
+    assert len(list(cache_dir.glob("libffcx_forms_*.c.cached"))) == 2
+
+
+def test_cmdline_bench_compile(tmp_path):
+    os.chdir(os.path.dirname(__file__))
+    results_file = tmp_path.joinpath("results.json")
+    subprocess.run(["ffcx", "bench", "compile", "--variant", "double", "--variant", "aligned", "-r", "1",
+                    "-o", str(results_file), "Poisson.ufl"], check=True)
+    with open(results_file) as f:
+        results = json.load(f)
+    assert [b["variant"] for b in results["benchmarks"]] == ["double", "aligned"]
+    for b in results["benchmarks"]:
+        assert set(b["stages"]) == {"analysis", "ir", "codegen", "formatting"}
+        assert b["code_size"] > b["header_size"] > 0
+        if hasattr(tracemalloc, "reset_peak"):
+            assert b["peak_memory"] > 0
+        else:
+            # Cannot be measured before Python 3.9
+            assert b["peak_memory"] is None
+
+    # Compare with itself, allowing for noise
+    subprocess.run(["ffcx", "bench", "compile", "--variant", "double", "-r", "1", "--compare", str(results_file),
+                    "--threshold", "100", "Poisson.ufl"], check=True)
+
+
+def test_cmdline_bench_kernels(tmp_path):
+    os.chdir(os.path.dirname(__file__))
+    results_file = tmp_path.joinpath("results.json")
+    subprocess.run(["ffcx", "bench", "kernels", "--cache-dir", str(tmp_path.joinpath("cache")), "-n", "16",
+                    "--min-time", "0.001", "-r", "1", "-o", str(results_file), "Poisson.ufl"], check=True)
+    with open(results_file) as f:
+        results = json.load(f)
+    assert results["num_cells"] == 16
+    assert [k["integral_type"] for k in results["kernels"]] == ["cell", "cell"]
+    for k in results["kernels"]:
+        assert k["flops"] > 0
+        assert k["ns_per_cell"] > 0
+        assert k["cells_per_second"] > 0
@@ -0,0 +1,42 @@
+# Copyright (C) 2020 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+
+import subprocess
+import sys
+
+import pytest
+
+
+def import_times(module):
+    """Import a module in a fresh interpreter, returning the cumulative import time (us) of each module."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize("module", ["ffcx", "ffcx.codegeneration.jit", "ffcx.main"])
+def test_import_time(module):
+    times = import_times(module)
+    print("import {}: {:.1f}ms".format(module, times[module] / 1000))
+
+    # UFL, FIAT, numpy and cffi are only imported when first needed
+    for heavy in ("ufl", "FIAT", "numpy", "cffi", "pkg_resources"):
+        assert heavy not in times
+
+
+def test_import_without_importlib_metadata():
+    # Python 3.7 has no importlib.metadata, and the version falls back
+    # to pkg_resources, which is slow to import: it is only looked up
+    # when needed
+    code = ("import sys; sys.modules['importlib.metadata'] = None; import ffcx.main; "
+            "assert 'pkg_resources' not in sys.modules")
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -9,6 +9,7 @@ import numpy as np
 
 import cffi
 import ffcx.codegeneration.jit
+import ffcx.naming
 import ufl
 
 
@@ -135,3 +136,45 @@ def test_rank1(compile_args):
     u_correct = np.array([f[1], f[0]]) + gradf0
 
     assert np.allclose(u_ffcx, u_correct.T)
+
+
+def test_expression_signature_memoized(monkeypatch):
+    e = ufl.VectorElement("P", "triangle", 1)
+    mesh = ufl.Mesh(e)
+    V = ufl.FunctionSpace(mesh, e)
+    f = ufl.Coefficient(V)
+    points = np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 1.0]])
+
+    expr = f[0] * f[1] + f[0]
+    signature = ffcx.naming.compute_signature([(expr, points)], "")
+
+    # Same and structurally equal expressions are looked up without
+    # recomputing their UFL signature
+    def extract_coefficients(expr):
+        raise RuntimeError("Signature should have been memoized")
+    monkeypatch.setattr(ufl.algorithms, "extract_coefficients", extract_coefficients)
+    assert ffcx.naming.compute_signature([(expr, points)], "") == signature
+    assert ffcx.naming.compute_signature([(f[0] * f[1] + f[0], points)], "") == signature
+    assert ffcx.naming.compute_signature([(expr, points[:2])], "") != signature
+
+
+def test_expression_signature_without_weak_references(monkeypatch):
+    e = ufl.VectorElement("P", "triangle", 1)
+    mesh = ufl.Mesh(e)
+    V = ufl.FunctionSpace(mesh, e)
+    f = ufl.Coefficient(V)
+    points = np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 1.0]])
+
+    # Older UFL releases define __slots__ without __weakref__
+    class Signatures(dict):
+        def __getitem__(self, expr):
+            raise TypeError("cannot create weak reference to {!r} object".format(type(expr).__name__))
+    monkeypatch.setattr(ffcx.naming, "_expression_signatures", Signatures())
+
+    expr = f[1] * f[1] - f[0]
+    signature = ffcx.naming.compute_signature([(expr, points)], "")
+
+    def extract_coefficients(expr):
+        raise RuntimeError("Signature should have been memoized")
+    monkeypatch.setattr(ufl.algorithms, "extract_coefficients", extract_coefficients)
+    assert ffcx.naming.compute_signature([(f[1] * f[1] - f[0], points)], "") == signature
@@ -4,11 +4,21 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import sys
+
 import cffi
 import numpy as np
 import pytest
 
+import ffcx.codegeneration.autotune
 import ffcx.codegeneration.jit
+import ffcx.compiler
+import ffcx.naming
+import ffcx.parallel
 import ufl
 
 
@@ -438,3 +448,270 @@ def test_custom_quadrature(compile_args):
 
     # Check that A is diagonal
     assert np.count_nonzero(A - np.diag(np.diagonal(A))) == 0
+
+
+@pytest.mark.parametrize("num_shards", [-1, 2])
+def test_sharded_build(num_shards, compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    a = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + ufl.inner(u, v) * ufl.dx(1)
+    L = v * ufl.dx
+    forms = [a, L]
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        forms, parameters={"jit_shards": num_shards}, cffi_extra_compile_args=compile_args)
+
+    ffi = cffi.FFI()
+    A = np.zeros((3, 3), dtype=np.float64)
+    w = np.array([], dtype=np.float64)
+    c = np.array([], dtype=np.float64)
+    coords = np.array([0.0, 0.0, 1.0, 0.0, 0.0, 1.0], dtype=np.float64)
+    compiled_forms[0].create_cell_integral(-1).tabulate_tensor(
+        ffi.cast("double *", A.ctypes.data), ffi.cast("double *", w.ctypes.data),
+        ffi.cast("double *", c.ctypes.data), ffi.cast("double *", coords.ctypes.data), ffi.NULL, ffi.NULL, 0)
+    assert np.allclose(A, np.array([[1.0, -0.5, -0.5], [-0.5, 0.5, 0.0], [-0.5, 0.0, 0.5]]))
+
+    b = np.zeros(3, dtype=np.float64)
+    compiled_forms[1].create_cell_integral(-1).tabulate_tensor(
+        ffi.cast("double *", b.ctypes.data), ffi.cast("double *", w.ctypes.data),
+        ffi.cast("double *", c.ctypes.data), ffi.cast("double *", coords.ctypes.data), ffi.NULL, ffi.NULL, 0)
+    assert np.allclose(b, 1.0 / 6.0)
+
+
+@pytest.mark.parametrize("executor_type", ["thread", "process"])
+def test_compile_forms_async(executor_type, compile_args, tmp_path):
+    if executor_type == "thread":
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("fork"))
+
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    a = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx
+    L = v * ufl.dx
+
+    with executor:
+        futures = [ffcx.codegeneration.jit.compile_forms_async(
+            forms, executor=executor, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+            for forms in ([a], [a], [L])]
+
+        # Identical requests share the compilation in flight
+        assert futures[0] is futures[1]
+        assert futures[0] is not futures[2]
+
+        (compiled_a,), _ = futures[0].result()
+        (compiled_L,), _ = futures[2].result()
+
+    ffi = cffi.FFI()
+    A = np.zeros((3, 3), dtype=np.float64)
+    w = np.array([], dtype=np.float64)
+    c = np.array([], dtype=np.float64)
+    coords = np.array([0.0, 0.0, 1.0, 0.0, 0.0, 1.0], dtype=np.float64)
+    compiled_a.create_cell_integral(-1).tabulate_tensor(
+        ffi.cast("double *", A.ctypes.data), ffi.cast("double *", w.ctypes.data),
+        ffi.cast("double *", c.ctypes.data), ffi.cast("double *", coords.ctypes.data), ffi.NULL, ffi.NULL, 0)
+    assert np.allclose(A, np.array([[1.0, -0.5, -0.5], [-0.5, 0.5, 0.0], [-0.5, 0.0, 0.5]]))
+    assert compiled_L.rank == 1
+
+
+def test_compile_forms_async_process_state(compile_args, tmp_path):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    a = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx
+
+    # The working directory and sys.stdout of the process are left alone
+    # while modules compile in the background
+    cwd = os.getcwd()
+    stdout = sys.stdout
+    futures = [ffcx.codegeneration.jit.compile_forms_async(
+        [a], parameters={"jit_shards": num_shards}, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+        for num_shards in (0, 2)]
+    while not all(future.done() for future in futures):
+        assert os.getcwd() == cwd
+        assert sys.stdout is stdout
+
+    # Requests which only differ in JIT parameters do not share futures
+    assert futures[0] is not futures[1]
+    assert [future.result()[0][0].rank for future in futures] == [2, 2]
+
+
+def test_lazy_objects(compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(u, v) * ufl.dx, v * ufl.dx, ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx]
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(forms, cffi_extra_compile_args=compile_args)
+
+    # Objects are created on first access, and then reused
+    assert len(compiled_forms) == 3
+    assert compiled_forms[1].rank == 1
+    assert compiled_forms[1] is compiled_forms[-2]
+    assert [form.rank for form in compiled_forms] == [2, 1, 2]
+    assert compiled_forms[::2] == [compiled_forms[0], compiled_forms[2]]
+
+
+def test_compile_bundle(compile_args):
+    cell = ufl.triangle
+    mesh = ufl.Mesh(ufl.VectorElement("Lagrange", cell, 1))
+    element = ufl.FiniteElement("Lagrange", cell, 2)
+    V = ufl.FunctionSpace(mesh, element)
+    u, v = ufl.TrialFunction(V), ufl.TestFunction(V)
+    f = ufl.Coefficient(V)
+    forms = [ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx, f * v * ufl.dx]
+    points = np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 1.0]])
+    expressions = [(ufl.grad(f), points)]
+
+    objects, module = ffcx.codegeneration.jit.compile_bundle(
+        forms=forms, elements=[element], meshes=[mesh], expressions=expressions,
+        cffi_extra_compile_args=compile_args)
+
+    assert [form.rank for form in objects["forms"]] == [2, 1]
+    ufc_element, ufc_dofmap = objects["elements"][0]
+    assert ufc_element.space_dimension == 6
+    assert ufc_dofmap.num_element_support_dofs == 6
+    assert objects["coordinate_maps"][0].geometric_dimension == 2
+    assert objects["expressions"][0].num_points == 3
+
+    # Element, dofmap and coordinate mapping shared by the objects are
+    # emitted once
+    code = open(module.__file__.split(".")[0] + ".c").read()
+    assert code.count("ufc_finite_element* create_{}(void)\n{{".format(
+        ffcx.naming.finite_element_name(element, "JIT"))) == 1
+    assert code.count("ufc_coordinate_mapping* create_{}(void)\n{{".format(
+        ffcx.naming.coordinate_map_name(mesh.ufl_coordinate_element(), "JIT"))) == 1
+
+
+def test_ufc_declarations_parsed_once(compile_args, tmp_path):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+
+    ffcx.codegeneration.jit._ufc_ffibuilder.cache_clear()
+    for form in (ufl.inner(u, v) * ufl.dx, ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx):
+        compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+            [form], cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+        assert compiled_forms[0].rank == 2
+        assert compiled_forms[0].create_cell_integral(-1) != module.ffi.NULL
+
+    # The modules include the UFC types from a module built once
+    assert ffcx.codegeneration.jit._ufc_ffibuilder.cache_info().misses == 1
+    assert len(list(tmp_path.glob(ffcx.codegeneration.jit._UFC_MODULE_PREFIX + "*"))) == 1
+
+
+@pytest.mark.parametrize("num_shards", [0, 2])
+def test_abi_mode(num_shards, compile_args, tmp_path):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    a = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx
+    L = v * ufl.dx
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        [a, L], parameters={"jit_abi_mode": True, "jit_shards": num_shards}, cache_dir=tmp_path,
+        cffi_extra_compile_args=compile_args)
+
+    # Plain shared library, not a Python extension module
+    assert module.__file__.endswith(module.__name__ + ".so")
+
+    ffi = module.ffi
+    A = np.zeros((3, 3), dtype=np.float64)
+    w = np.array([], dtype=np.float64)
+    c = np.array([], dtype=np.float64)
+    coords = np.array([0.0, 0.0, 1.0, 0.0, 0.0, 1.0], dtype=np.float64)
+    compiled_forms[0].create_cell_integral(-1).tabulate_tensor(
+        ffi.cast("double *", A.ctypes.data), ffi.cast("double *", w.ctypes.data),
+        ffi.cast("double *", c.ctypes.data), ffi.cast("double *", coords.ctypes.data), ffi.NULL, ffi.NULL, 0)
+    assert np.allclose(A, np.array([[1.0, -0.5, -0.5], [-0.5, 0.5, 0.0], [-0.5, 0.0, 0.5]]))
+    assert compiled_forms[1].rank == 1
+
+    # Loaded from the cache directory
+    ffcx.codegeneration.jit.clear_registry()
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        [a, L], parameters={"jit_abi_mode": True, "jit_shards": num_shards}, cache_dir=tmp_path,
+        cffi_extra_compile_args=compile_args)
+    assert compiled_forms[0].rank == 2
+
+
+def test_compile_profiles(tmp_path):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + ufl.inner(u, v) * ufl.ds]
+
+    _, module0 = ffcx.codegeneration.jit.compile_forms(forms, parameters={"jit_compile_profile": "fast-compile"},
+                                                       cache_dir=tmp_path)
+    _, module1 = ffcx.codegeneration.jit.compile_forms(forms, parameters={"jit_compile_profile": "balanced"},
+                                                       cache_dir=tmp_path)
+    assert module0.__name__ != module1.__name__
+
+    # Code for the host CPU is specific to the host CPU
+    host_define = "-DFFCX_HOST_CPU=" + ffcx.codegeneration.autotune.host_signature()
+    assert host_define in ffcx.codegeneration.autotune.compile_args("max-performance", None)
+    assert host_define in ffcx.codegeneration.autotune.compile_args(None, ["-march=native"])
+    assert ffcx.codegeneration.autotune.compile_args(None, ["-O1"]) == ["-O1"]
+
+    with pytest.raises(ValueError, match="Unknown JIT compile profile"):
+        ffcx.codegeneration.jit.compile_forms(forms, parameters={"jit_compile_profile": "no-such-profile"})
+
+    # Autotuning compiles and times each profile, and records the fastest
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        forms, parameters={"jit_compile_profile": "autotune"}, cache_dir=tmp_path)
+    selected = list(tmp_path.joinpath("autotune").glob("*.json"))
+    assert len(selected) == 1
+    profile = json.loads(selected[0].read_text())["profile"]
+    assert profile in ffcx.codegeneration.autotune.COMPILE_PROFILES
+
+    # Later calls use the recorded profile without timing again
+    _, module_profile = ffcx.codegeneration.jit.compile_forms(
+        forms, parameters={"jit_compile_profile": profile}, cache_dir=tmp_path)
+    assert module_profile.__name__ == module.__name__
+
+
+@pytest.mark.parametrize("parameter", ["parallel_ir", "parallel_codegen"])
+def test_parallel_compile(parameter, compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    f = ufl.Coefficient(element)
+    a = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + ufl.inner(u, v) * ufl.dx(1) + ufl.inner(u, v) * ufl.ds
+    L = f * v * ufl.dx + v * ufl.dS
+    expression = (ufl.grad(f), np.array([[0.25, 0.25]]))
+
+    # Generated code, including the parameters listed in it, does not
+    # depend on the number of processes
+    code = ffcx.compiler.compile_ufl_objects([a, L, expression], prefix="parallel",
+                                             parameters=ffcx.parameters.get_parameters())
+    assert ffcx.compiler.compile_ufl_objects([a, L, expression], prefix="parallel",
+                                             parameters=ffcx.parameters.get_parameters({parameter: 3})) == code
+    assert parameter not in code[0]
+
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        [a], parameters={parameter: -1}, cffi_extra_compile_args=compile_args)
+    _, module_serial = ffcx.codegeneration.jit.compile_forms([a], cffi_extra_compile_args=compile_args)
+    assert module.__name__ == module_serial.__name__
+
+    # Compilations in threads run serially
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [ffcx.codegeneration.jit.compile_forms_async(
+            forms, executor=executor, parameters={parameter: 2}, cffi_extra_compile_args=compile_args)
+            for forms in ([a], [L])]
+        assert [future.result()[0][0].rank for future in futures] == [2, 1]
+
+    ffi = cffi.FFI()
+    A = np.zeros((3, 3), dtype=np.float64)
+    w = np.array([], dtype=np.float64)
+    c = np.array([], dtype=np.float64)
+    coords = np.array([0.0, 0.0, 1.0, 0.0, 0.0, 1.0], dtype=np.float64)
+    compiled_forms[0].create_cell_integral(-1).tabulate_tensor(
+        ffi.cast("double *", A.ctypes.data), ffi.cast("double *", w.ctypes.data),
+        ffi.cast("double *", c.ctypes.data), ffi.cast("double *", coords.ctypes.data), ffi.NULL, ffi.NULL, 0)
+    assert np.allclose(A, np.array([[1.0, -0.5, -0.5], [-0.5, 0.5, 0.0], [-0.5, 0.0, 0.5]]))
+
+
+@pytest.mark.parametrize("parameter", ["parallel_ir", "parallel_codegen"])
+def test_parallel_compile_locked(parameter, compile_args, tmp_path, monkeypatch):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    a = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + ufl.inner(u, v) * ufl.ds
+
+    # The lock on the module has a heartbeat thread, so the process is
+    # not forked while it is held
+    def get_context(method=None):
+        raise RuntimeError("Forked while other threads run")
+    monkeypatch.setattr(ffcx.parallel.multiprocessing, "get_context", get_context)
+    compiled_forms, module = ffcx.codegeneration.jit.compile_forms(
+        [a], parameters={parameter: 2}, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+    assert compiled_forms[0].rank == 2
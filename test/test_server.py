@@ -0,0 +1,76 @@
+# Copyright (C) 2020 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+
+import os
+import threading
+
+import pytest
+
+import ffcx.codegeneration.jit
+import ffcx.compiler
+import ffcx.main
+import ffcx.server
+import ufl
+
+
+@pytest.fixture
+def server(tmp_path):
+    s = ffcx.server.Server(str(tmp_path.joinpath("ffcx.sock")))
+    thread = threading.Thread(target=s.serve_forever)
+    thread.start()
+    yield s
+    s.shutdown()
+    thread.join()
+    s.server_close()
+
+
+def test_server_compile(server, tmp_path):
+    client = ffcx.server.connect(server.socket_path)
+    assert client is not None
+
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx]
+    parameters = ffcx.get_parameters()
+    assert client.compile_ufl_objects(forms, prefix="a", parameters=parameters) == \
+        ffcx.compiler.compile_ufl_objects(forms, prefix="a", parameters=parameters)
+
+    module_name, filename = client.jit("forms", forms, cache_dir=str(tmp_path))
+    _, module = ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path)
+    assert module.__name__ == module_name
+    assert os.path.exists(filename)
+
+    with pytest.raises(RuntimeError, match="needs a cache directory"):
+        client.jit("forms", forms)
+
+
+def test_server_cmdline(server, tmp_path, monkeypatch):
+    monkeypatch.setenv("FFCX_SERVER_SOCKET", server.socket_path)
+    poisson = os.path.join(os.path.dirname(__file__), "Poisson.ufl")
+    assert ffcx.main.main(["-o", str(tmp_path), poisson]) == 0
+    assert ffcx.server.Client(server.socket_path).ping()["requests"] == 1
+
+    # The server is only used when requested
+    assert ffcx.main.main(["--server", "-o", str(tmp_path), poisson]) == 0
+    assert tmp_path.joinpath("Poisson.c").exists()
+    assert ffcx.server.Client(server.socket_path).ping()["requests"] >= 4
+
+
+def test_server_socket_checks(server, tmp_path, monkeypatch):
+    assert ffcx.server.Client(server.socket_path).ping()["version"] == ffcx.__version__
+
+    # Servers of other versions are not used
+    with monkeypatch.context() as m:
+        m.setattr(ffcx.server.Client, "ping", lambda self: {"version": "0.0.0"})
+        assert ffcx.server.connect(server.socket_path) is None
+
+    # Sockets accessible by other users are not used
+    os.chmod(server.socket_path, 0o666)
+    assert ffcx.server.connect(server.socket_path) is None
+    with pytest.raises(PermissionError):
+        ffcx.server.Client(server.socket_path).ping()
+    os.chmod(server.socket_path, 0o600)
+    assert ffcx.server.connect(server.socket_path) is not None
@@ -0,0 +1,67 @@
+# Copyright (C) 2020 FEniCS Project
+#
+# This file is part of FFCX.(https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+
+import json
+import os
+import subprocess
+import tracemalloc
+
+import pytest
+
+import ffcx.compiler
+import ffcx.parameters
+import ffcx.tracing
+import ufl
+
+
+def test_trace_compile(tmp_path):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx, ufl.inner(u, v) * ufl.ds]
+
+    parameters = ffcx.parameters.get_parameters()
+    with ffcx.tracing.trace() as tracer:
+        ffcx.compiler.compile_ufl_objects(forms, prefix="trace", parameters=parameters)
+
+    stages = [name for _, name, _ in tracer.summary("stage")]
+    assert sorted(stages) == ["analysis", "codegen", "formatting", "ir"]
+    assert len(tracer.summary("analysis")) == 2
+    if hasattr(tracemalloc, "reset_peak"):
+        assert all(span["peak_memory"] >= 0 for span in tracer.spans)
+    else:
+        # Cannot be measured per span
+        assert all(span["peak_memory"] is None for span in tracer.spans)
+
+    # One IR span and one codegen span per integral
+    ir_integrals = [s["name"] for s in tracer.spans if s["category"] == "ir" and s["args"]["kind"] == "integral"]
+    codegen_integrals = [s["name"] for s in tracer.spans
+                         if s["category"] == "codegen" and s["args"]["generator"] == "integral"]
+    assert len(ir_integrals) == 2
+    assert sorted(ir_integrals) == sorted(codegen_integrals)
+
+    filename = tmp_path.joinpath("trace.json")
+    tracer.write(filename)
+    with open(filename) as f:
+        events = json.load(f)["traceEvents"]
+    assert len(events) == len(tracer.spans)
+    assert all(e["ph"] == "X" and e["dur"] >= 0 for e in events)
+
+    # Nothing is recorded without an active trace
+    ffcx.compiler.compile_ufl_objects(forms[:1], prefix="trace", parameters=parameters)
+    assert len(tracer.spans) == len(events)
+    with ffcx.tracing.trace():
+        with pytest.raises(RuntimeError):
+            with ffcx.tracing.trace():
+                pass
+
+
+def test_cmdline_trace(tmp_path):
+    os.chdir(os.path.dirname(__file__))
+    filename = tmp_path.joinpath("trace.json")
+    subprocess.run(["ffcx", "-o", str(tmp_path), "--trace", str(filename), "Poisson.ufl"], check=True)
+    with open(filename) as f:
+        events = json.load(f)["traceEvents"]
+    assert {e["cat"] for e in events} == {"file", "stage", "analysis", "ir", "codegen"}